@@ -0,0 +1,84 @@
+"""
+Compares tracing a batch of observations one at a time with the vectorized
+engine, both through trace() and through trace_indexed() with the parameters
+already held in a BKTState, as kt_trace_batch holds them. kt_trace_batch uses
+whichever the last column shows; VECTOR_MIN_BATCH in bkt_engine should sit
+where the speedup of the indexed path passes 1.
+
+Usage: python bkt_benchmark.py [observation counts...]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins'))
+
+from bkt_engine import BKTState, VectorizedBKT, VECTOR_MIN_BATCH, trace_scalar
+
+DEFAULT_SIZES = [20, 100, 200, 500, 1000, 10000, 100000, 1000000]
+
+
+def make_observations(count, students=1000, skills=20, seed=0):
+    rng = np.random.RandomState(seed)
+
+    student_ids = rng.randint(0, students, count)
+    skill_ids = rng.randint(0, skills, count)
+    keys = list(zip(student_ids.tolist(), skill_ids.tolist()))
+    correct = (rng.random_sample(count) < 0.6).tolist()
+
+    params = {}
+    for key in set(keys):
+        params[key] = (rng.uniform(0.1, 0.5), rng.uniform(0.05, 0.3), rng.uniform(0.1, 0.3), rng.uniform(0.05, 0.2))
+
+    return keys, correct, params
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(sizes):
+    engine = VectorizedBKT()
+
+    print('%12s %12s %12s %12s %10s %8s' % (
+        'observations', 'scalar (s)', 'vector (s)', 'indexed (s)', 'speedup', 'uses'))
+
+    for count in sizes:
+        keys, correct, params = make_observations(count)
+        repeat = max(3, 20000 // count)
+
+        _, expected = trace_scalar(keys, correct, params)
+        posteriors, known = engine.trace(keys, correct, params)
+
+        worst = max(abs(known[key] - expected[key]) for key in known)
+        if worst > 1e-9:
+            raise AssertionError('Vectorized results differ from scalar results by ' + str(worst))
+
+        scalar_time = best_time(lambda: trace_scalar(keys, correct, params), repeat)
+        vector_time = best_time(lambda: engine.trace(keys, correct, params), repeat)
+
+        #The same work with the parameters held between batches, including
+        #looking up where each key's parameters are
+        state = BKTState()
+        state.load(params)
+
+        def trace_held():
+            engine.trace_indexed(state.indices(keys), np.asarray(correct, dtype=bool), *state.columns())
+
+        indexed_time = best_time(trace_held, repeat)
+
+        print('%12d %12.6f %12.6f %12.6f %9.2fx %8s' % (
+            count, scalar_time, vector_time, indexed_time, scalar_time / indexed_time,
+            'vector' if count >= VECTOR_MIN_BATCH else 'scalar'))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,112 @@
+"""
+Compares the per-message cost of the knowledge tracing storage backends.
+
+Each backend is timed reading and writing one student and skill per message,
+as kt_trace does without a cache, and reading and writing in batches, as the
+plugin's KTStateCache does. Mongo is skipped if no server is reachable.
+
+Usage: python kt_storage_benchmark.py [message count] [mongo url]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins'))
+
+from kt_storage import MemoryKTStorage, MongoKTStorage, SQLiteKTStorage
+
+DEFAULT_COUNT = 10000
+BATCH_SIZE = 500
+
+
+def make_messages(count, students=1000, skills=20, seed=0):
+    rng = random.Random(seed)
+    return [('student-%d' % rng.randrange(students), 'skill-%d' % rng.randrange(skills)) for _ in range(count)]
+
+
+def make_params(known):
+    return {
+        'probability_known': known,
+        'probability_learned': 0.1,
+        'probability_guess': 0.2,
+        'probability_mistake': 0.1
+    }
+
+
+def per_message(storage, messages):
+    start = time.perf_counter()
+
+    for key in messages:
+        params = storage.load_many([key]).get(key)
+        known = params['probability_known'] if params else 0.5
+        storage.save_many({key: make_params(known * 0.99)})
+
+    return time.perf_counter() - start
+
+
+def batched(storage, messages):
+    start = time.perf_counter()
+
+    for offset in range(0, len(messages), BATCH_SIZE):
+        batch = messages[offset:offset + BATCH_SIZE]
+        found = storage.load_many(set(batch))
+
+        dirty = {}
+        for key in batch:
+            params = dirty.get(key) or found.get(key)
+            known = params['probability_known'] if params else 0.5
+            dirty[key] = make_params(known * 0.99)
+
+        storage.save_many(dirty)
+
+    return time.perf_counter() - start
+
+
+def connect_mongo(url):
+    try:
+        from pymongo import MongoClient
+        client = MongoClient(url, serverSelectionTimeoutMS=500)
+        client.admin.command('ping')
+    except Exception:
+        return None
+
+    collection = client.hpit_benchmark.kt_storage_benchmark
+    collection.drop()
+    return MongoKTStorage(collection)
+
+
+def main(count, mongo_url):
+    messages = make_messages(count)
+    directory = tempfile.mkdtemp()
+
+    backends = [
+        ('memory', lambda: MemoryKTStorage()),
+        ('sqlite', lambda: SQLiteKTStorage(os.path.join(directory, 'kt-%d.db' % time.perf_counter_ns()))),
+        ('mongo', lambda: connect_mongo(mongo_url)),
+    ]
+
+    print('%8s %22s %22s' % ('backend', 'per message (us/msg)', 'batched (us/msg)'))
+
+    for name, create in backends:
+        results = []
+        for run in (per_message, batched):
+            storage = create()
+            if storage is None:
+                break
+
+            results.append(run(storage, messages) / count * 1e6)
+            storage.close()
+
+        if not results:
+            print('%8s %22s %22s' % (name, 'skipped', 'skipped'))
+            continue
+
+        print('%8s %22.1f %22.1f' % (name, results[0], results[1]))
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT,
+        sys.argv[2] if len(sys.argv) > 2 else 'mongodb://localhost:27017/')
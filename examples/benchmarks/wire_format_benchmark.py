@@ -0,0 +1,114 @@
+"""
+Compares the JSON and MessagePack wire formats, first by encoding a poll's
+worth of DataShop transactions directly and then end to end: a tutor sends
+kt_trace messages through the local HPIT stand-in server to a plugin, which
+answers each one.
+
+Usage: python wire_format_benchmark.py [message count]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'examples', 'server'))
+
+from hpitclient import Plugin, Tutor
+from hpitclient.codec import CODECS
+from hpit_standin import StandInServer
+
+DEFAULT_COUNT = 2000
+
+
+def make_transaction(i):
+    return {
+        'session_id': 'session-%d' % (i // 50),
+        'transaction_id': 'transaction-%d' % i,
+        'problem_name': 'fractions-%d' % (i % 30),
+        'step_name': 'step-%d' % (i % 7),
+        'skill': 'addition',
+        'correct': i % 3 != 0,
+        'outcome': 'CORRECT' if i % 3 != 0 else 'INCORRECT',
+        'selection': 'input-%d' % (i % 5),
+        'action': 'UpdateTextField',
+        'input': str(i * 7 % 100),
+        'probability_known': 0.4 + (i % 10) / 100.0,
+        'duration': 1.25 + i % 13,
+    }
+
+
+def codec_benchmark(count):
+    page = {'transactions': [{
+        'message_id': '%032x' % i,
+        'sender_entity_id': 'tutor',
+        'message_name': 'transaction',
+        'time_created': '2014-08-01T12:00:00',
+        'message': make_transaction(i)} for i in range(count)]}
+
+    print('%10s %12s %12s %12s' % ('format', 'bytes', 'encode (ms)', 'decode (ms)'))
+
+    for name, codec in CODECS.items():
+        start = time.perf_counter()
+        body = codec.encode(page)
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        codec.decode(body)
+        decode_time = time.perf_counter() - start
+
+        print('%10s %12d %12.2f %12.2f' % (name, len(body), encode_time * 1000, decode_time * 1000))
+
+
+def end_to_end_benchmark(count):
+    server = StandInServer().start()
+
+    print()
+    print('%10s %12s %12s %12s %12s' % ('format', 'bytes sent', 'bytes recv', 'requests', 'elapsed (s)'))
+
+    try:
+        for name in CODECS:
+            answered = []
+
+            plugin = Plugin('kt-plugin-' + name, 'key')
+            plugin.set_hpit_root_url(server.root_url)
+            plugin.set_wire_format(name)
+            plugin.send_log_entry = lambda text: None
+            plugin.connect()
+            plugin.subscribe(kt_trace=lambda message: plugin.send_response(message['message_id'], {
+                'skill': message['skill'], 'probability_known': message['probability_known']}))
+
+            tutor = Tutor('kt-tutor-' + name, 'key', lambda: True)
+            tutor.set_hpit_root_url(server.root_url)
+            tutor.set_wire_format(name)
+            tutor.connect()
+
+            server.state.reset_counters()
+            start = time.perf_counter()
+
+            for i in range(count):
+                tutor.send('kt_trace', make_transaction(i), answered.append)
+
+            while len(answered) < count:
+                plugin._dispatch(plugin._poll())
+                tutor._dispatch_responses(tutor._poll_responses())
+
+            elapsed = time.perf_counter() - start
+
+            print('%10s %12d %12d %12d %12.2f' % (
+                name, server.state.bytes_in, server.state.bytes_out, server.state.requests, elapsed))
+
+            plugin.disconnect()
+            tutor.disconnect()
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+
+    if 'msgpack' not in CODECS:
+        print('msgpack is not installed; only JSON will be measured.')
+
+    codec_benchmark(count)
+    end_to_end_benchmark(count)
@@ -0,0 +1,240 @@
+import math
+
+import numpy as np
+
+#Below this many observations in a batch, trace_scalar() is faster than
+#VectorizedBKT.trace_indexed() on parameters held in a BKTState. Measured with
+#examples/benchmarks/bkt_benchmark.py.
+VECTOR_MIN_BATCH = 300
+
+
+def bkt_update(p_known, p_learned, p_guess, p_mistake, correct):
+    """
+    Bayesian knowledge tracing update for a single observation. This is the same
+    calculation the knowledge tracing plugin does in kt_trace.
+
+    Returns: float - The new probability the skill is known.
+    """
+    if correct:
+        numer = p_known * (1 - p_mistake)
+        denom = numer + (1 - p_known) * p_guess
+    else:
+        numer = p_known * p_mistake
+        denom = numer + (1 - p_known) * (1 - p_guess)
+
+    p_known_prime = numer / denom if denom != 0 else 0
+    return p_known_prime + (1 - p_known_prime) * p_learned
+
+
+def trace_scalar(keys, correct, params):
+    """
+    VectorizedBKT.trace() one observation at a time, for batches too small for
+    the vectorized version to pay off. Takes and returns the same things, except
+    that posteriors is a list.
+    """
+    posteriors = []
+    known = {}
+
+    for key, is_correct in zip(keys, correct):
+        key_params = params.get(key)
+        if key_params is None:
+            posteriors.append(math.nan)
+            continue
+
+        p_known, p_learned, p_guess, p_mistake = key_params
+        p_known = bkt_update(known.get(key, p_known), p_learned, p_guess, p_mistake, is_correct)
+
+        known[key] = p_known
+        posteriors.append(p_known)
+
+    return posteriors, known
+
+
+def bkt_update_vector(p_known, p_learned, p_guess, p_mistake, correct):
+    """
+    bkt_update over NumPy arrays, one element per observation.
+    """
+    correct = np.asarray(correct, dtype=bool)
+
+    numer = np.where(correct, p_known * (1 - p_mistake), p_known * p_mistake)
+    denom = numer + np.where(correct, (1 - p_known) * p_guess, (1 - p_known) * (1 - p_guess))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_known_prime = np.where(denom != 0, numer / denom, 0.0)
+
+    return p_known_prime + (1 - p_known_prime) * p_learned
+
+
+class VectorizedBKT:
+    """
+    Applies Bayesian knowledge tracing updates to a whole batch of
+    (student, skill, correct) observations at once.
+
+    Observations of the same student and skill are applied in the order they
+    appear in the batch. The batch is split into levels by how many earlier
+    observations of the same student and skill precede each one; every level
+    holds each student and skill at most once and is updated in a single
+    vectorized step. A batch with no repeats is one step.
+    """
+    def trace(self, keys, correct, params):
+        """
+        Input:
+            keys - A sequence of hashable (sender_entity_id, skill) keys, one per
+            observation, in the order the observations happened.
+            correct - A sequence of booleans, one per observation.
+            params - A dictionary of key to (probability_known, probability_learned,
+            probability_guess, probability_mistake). Keys missing from params are
+            skipped.
+
+        Returns: tuple -
+            posteriors - A float array with the probability known after each
+            observation, NaN for observations that were skipped.
+            known - A dictionary of key to the final probability known, for each key
+            that was traced.
+        """
+        n = len(keys)
+        posteriors = np.full(n, np.nan)
+        if not n:
+            return posteriors, {}
+
+        index_of = {}
+        observation_index = np.fromiter(
+            (index_of.setdefault(key, len(index_of)) for key in keys), dtype=np.int64, count=n)
+        unique_keys = list(index_of)
+
+        table = np.array([params.get(key, (np.nan,) * 4) for key in unique_keys], dtype=float).reshape(-1, 4)
+        known, learned, guess, mistake = (table[:, column].copy() for column in range(4))
+
+        observations = np.nonzero(~np.isnan(known[observation_index]))[0]
+        if not len(observations):
+            return posteriors, {}
+
+        posteriors[observations] = self.trace_indexed(
+            observation_index[observations],
+            np.asarray(correct, dtype=bool)[observations],
+            known, learned, guess, mistake)
+
+        traced = np.unique(observation_index[observations])
+        return posteriors, {unique_keys[i]: float(known[i]) for i in traced}
+
+
+    def trace_indexed(self, observation_index, correct, known, learned, guess, mistake):
+        """
+        The core of trace() for callers that already hold their parameters in
+        arrays. known is updated in place.
+
+        Input:
+            observation_index - An integer array giving, for each observation, the
+            position of its student and skill in the parameter arrays.
+            correct - A boolean array, one element per observation.
+            known, learned, guess, mistake - Float arrays of BKT parameters, one
+            element per student and skill.
+
+        Returns: array - The probability known after each observation.
+        """
+        posteriors = np.empty(len(observation_index))
+        if not len(observation_index):
+            return posteriors
+
+        #Rank each observation among earlier observations of the same key
+        by_key = np.argsort(observation_index, kind='stable')
+        sorted_index = observation_index[by_key]
+        group_start = np.r_[0, np.nonzero(np.diff(sorted_index))[0] + 1]
+        group_sizes = np.diff(np.r_[group_start, len(sorted_index)])
+        rank = np.empty(len(observation_index), dtype=np.int64)
+        rank[by_key] = np.arange(len(sorted_index)) - np.repeat(group_start, group_sizes)
+
+        by_rank = np.argsort(rank, kind='stable')
+        level_bounds = np.r_[0, np.cumsum(np.bincount(rank))]
+
+        for start, end in zip(level_bounds[:-1], level_bounds[1:]):
+            level = by_rank[start:end]
+            index = observation_index[level]
+
+            known[index] = bkt_update_vector(known[index], learned[index], guess[index], mistake[index], correct[level])
+            posteriors[level] = known[index]
+
+        return posteriors
+
+
+class BKTState:
+    """
+    BKT parameters for each student and skill, held in arrays between batches
+    so VectorizedBKT.trace_indexed() can trace a batch without building them
+    again. Parameters are (probability_known, probability_learned,
+    probability_guess, probability_mistake) tuples.
+
+    Once more than max_size students and skills are held the state is cleared
+    before the next load(), and the parameters are read again as they are needed.
+    """
+    def __init__(self, max_size=1000000):
+        self.max_size = max_size
+        self.clear()
+
+
+    def __len__(self):
+        return len(self.index_of)
+
+
+    def __contains__(self, key):
+        return key in self.index_of
+
+
+    def clear(self):
+        self.index_of = {}
+        self.keys = []
+        self.known, self.learned, self.guess, self.mistake = (np.empty(1024) for _ in range(4))
+
+
+    def load(self, params_by_key):
+        """
+        Hold params_by_key, a dictionary of key to parameters, replacing the
+        parameters of keys already held.
+        """
+        if len(self.keys) + len(params_by_key) > self.max_size:
+            self.clear()
+
+        for key, params in params_by_key.items():
+            index = self.index_of.get(key)
+
+            if index is None:
+                index = self.index_of[key] = len(self.keys)
+                self.keys.append(key)
+
+                if index == len(self.known):
+                    self.known, self.learned, self.guess, self.mistake = (
+                        np.resize(column, 2 * len(column)) for column in self.columns())
+
+            self.known[index], self.learned[index], self.guess[index], self.mistake[index] = params
+
+
+    def discard(self, key):
+        """
+        Stop holding key's parameters, eg. after they were changed elsewhere. Its
+        slot is reclaimed when the state is cleared.
+        """
+        self.index_of.pop(key, None)
+
+
+    def indices(self, keys):
+        """
+        Returns: array - The position of each of keys in the parameter arrays, or
+        -1 for keys that aren't held.
+        """
+        return np.fromiter((self.index_of.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+
+
+    def columns(self):
+        """
+        Returns: tuple - The known, learned, guess and mistake arrays, to pass to
+        VectorizedBKT.trace_indexed().
+        """
+        return self.known, self.learned, self.guess, self.mistake
+
+
+    def params(self, index):
+        """
+        Returns: tuple - The parameters at index.
+        """
+        return (float(self.known[index]), float(self.learned[index]),
+            float(self.guess[index]), float(self.mistake[index]))
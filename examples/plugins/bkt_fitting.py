@@ -0,0 +1,358 @@
+"""
+Fits knowledge tracing parameters offline from traffic recorded by a plugin
+with start_recording(), instead of relying on the guesses tutors send with
+kt_set_initial.
+
+Usage: python bkt_fitting.py recording.jsonl parameters.json [--method em|grid]
+           [--storage mongo|sqlite|memory] [--storage-path path]
+
+The parameter file can be loaded into a running plugin with
+KnowledgeTracingPlugin.load_parameters(), or straight into a storage backend
+with --storage.
+"""
+import sys
+import json
+import argparse
+import itertools
+
+import numpy as np
+
+#Bounds that keep EM away from degenerate solutions where guess and slip explain everything
+DEFAULT_MAX_GUESS = 0.3
+DEFAULT_MAX_SLIP = 0.1
+EPSILON = 1e-4
+
+DEFAULT_GRID = {
+    'probability_known': np.linspace(0.05, 0.95, 10),
+    'probability_learned': np.linspace(0.05, 0.5, 10),
+    'probability_guess': np.linspace(0.05, DEFAULT_MAX_GUESS, 6),
+    'probability_mistake': np.linspace(0.02, DEFAULT_MAX_SLIP, 5),
+}
+
+
+def _is_correct(payload):
+    value = payload.get('correct')
+    if value is None and 'outcome' in payload:
+        value = payload['outcome']
+
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'correct', 'yes')
+    if value is None:
+        return None
+
+    return bool(value)
+
+
+def read_observations(path, message_names=('kt_trace',)):
+    """
+    Read correctness observations from a recording made by TrafficRecorder.
+    kt_trace messages and transactions carrying a skill and a correct flag (or a
+    DataShop style outcome) are used, in the order they were recorded.
+    Redelivered messages are counted once.
+
+    Returns: tuple - Lists of sender_entity_ids, skills and correct flags.
+    """
+    students, skills, correct = [], [], []
+    seen = set()
+
+    with open(path) as f:
+        for line in f:
+            timestamp, kind, items = json.loads(line)
+
+            for item in items:
+                if kind == 'messages' and item.get('message_name') not in message_names:
+                    continue
+                elif kind not in ('messages', 'transactions'):
+                    continue
+
+                if item['message_id'] in seen:
+                    continue
+                seen.add(item['message_id'])
+
+                payload = item['message']
+                skill = payload.get('skill', payload.get('skill_name'))
+                is_correct = _is_correct(payload)
+
+                if skill is None or is_correct is None:
+                    continue
+
+                students.append(item['sender_entity_id'])
+                skills.append(skill)
+                correct.append(is_correct)
+
+    return students, skills, correct
+
+
+def _sequences(students, correct):
+    """
+    Lay out each student's observations as a row of a padded matrix.
+
+    Returns: tuple - The distinct students, an (students, steps) boolean matrix
+    of observations and a matching mask of which cells hold one.
+    """
+    index_of = {}
+    student_index = np.fromiter(
+        (index_of.setdefault(student, len(index_of)) for student in students), dtype=np.int64, count=len(students))
+
+    by_student = np.argsort(student_index, kind='stable')
+    sorted_index = student_index[by_student]
+    group_start = np.r_[0, np.nonzero(np.diff(sorted_index))[0] + 1]
+    group_sizes = np.diff(np.r_[group_start, len(sorted_index)])
+    step = np.empty(len(students), dtype=np.int64)
+    step[by_student] = np.arange(len(sorted_index)) - np.repeat(group_start, group_sizes)
+
+    observations = np.zeros((len(index_of), group_sizes.max()), dtype=bool)
+    mask = np.zeros(observations.shape, dtype=bool)
+    observations[student_index, step] = np.asarray(correct, dtype=bool)
+    mask[student_index, step] = True
+
+    return list(index_of), observations, mask
+
+
+def _forward(observations, mask, prior, learned, guess, mistake):
+    """
+    Run knowledge tracing over every sequence at once. Parameters may be scalars
+    or column vectors, to trace several parameter sets side by side.
+
+    Returns: tuple - The log likelihood of each sequence and the probability
+    known after its last observation.
+    """
+    known = np.broadcast_to(prior, np.broadcast(prior, observations[:, 0]).shape).astype(float)
+    log_likelihood = np.zeros(known.shape)
+
+    for step in range(observations.shape[1]):
+        correct = observations[:, step]
+        present = mask[:, step]
+
+        p_correct = known * (1 - mistake) + (1 - known) * guess
+        log_likelihood += np.where(present, np.log(np.where(correct, p_correct, 1 - p_correct)), 0.0)
+
+        numer = np.where(correct, known * (1 - mistake), known * mistake)
+        p_known_prime = numer / np.where(correct, p_correct, 1 - p_correct)
+        known = np.where(present, p_known_prime + (1 - p_known_prime) * learned, known)
+
+    return log_likelihood, known
+
+
+def fit_skill_grid(observations, mask, grid=None):
+    """
+    Fit one skill's parameters by evaluating every combination of the grid's
+    values against all of the skill's sequences.
+
+    Returns: tuple - The best (prior, learned, guess, mistake) and its log likelihood.
+    """
+    grid = grid or DEFAULT_GRID
+    combinations = np.array(list(itertools.product(
+        grid['probability_known'], grid['probability_learned'],
+        grid['probability_guess'], grid['probability_mistake'])))
+
+    best, best_ll = None, -np.inf
+
+    #Bound the size of the (combinations, students) working arrays
+    chunk = max(1, 4000000 // max(1, observations.shape[0]))
+
+    for start in range(0, len(combinations), chunk):
+        params = combinations[start:start + chunk]
+        columns = [params[:, i:i + 1] for i in range(4)]
+
+        log_likelihood, _ = _forward(observations, mask, *columns)
+
+        totals = log_likelihood.sum(axis=1)
+        i = int(np.argmax(totals))
+        if totals[i] > best_ll:
+            best, best_ll = tuple(float(p) for p in params[i]), float(totals[i])
+
+    return best, best_ll
+
+
+def fit_skill_em(observations, mask, initial=(0.3, 0.1, 0.2, 0.05), max_iterations=100, tolerance=1e-6,
+                 max_guess=DEFAULT_MAX_GUESS, max_slip=DEFAULT_MAX_SLIP):
+    """
+    Fit one skill's parameters with expectation maximization (Baum-Welch) on the
+    two state knowledge tracing model, with the forward and backward passes
+    vectorized across students. Guess and slip are capped after each step.
+
+    Returns: tuple - The fitted (prior, learned, guess, mistake) and its log likelihood.
+    """
+    prior, learned, guess, mistake = initial
+    steps = observations.shape[1]
+    last_ll = -np.inf
+
+    for iteration in range(max_iterations):
+        #Emission probabilities, 1 where a sequence has already ended
+        emit_known = np.where(mask, np.where(observations, 1 - mistake, mistake), 1.0)
+        emit_unknown = np.where(mask, np.where(observations, guess, 1 - guess), 1.0)
+
+        alpha_known = np.empty(observations.shape)
+        alpha_unknown = np.empty(observations.shape)
+        scale = np.ones(observations.shape)
+
+        a_known = prior * emit_known[:, 0]
+        a_unknown = (1 - prior) * emit_unknown[:, 0]
+        for step in range(steps):
+            if step:
+                present = mask[:, step]
+                a_known = np.where(present, (alpha_unknown[:, step - 1] * learned + alpha_known[:, step - 1]) * emit_known[:, step], alpha_known[:, step - 1])
+                a_unknown = np.where(present, alpha_unknown[:, step - 1] * (1 - learned) * emit_unknown[:, step], alpha_unknown[:, step - 1])
+
+            scale[:, step] = a_known + a_unknown
+            alpha_known[:, step] = a_known / scale[:, step]
+            alpha_unknown[:, step] = a_unknown / scale[:, step]
+
+        beta_known = np.ones(observations.shape)
+        beta_unknown = np.ones(observations.shape)
+        learning = np.zeros(observations.shape)
+
+        for step in range(steps - 2, -1, -1):
+            present = mask[:, step + 1]
+            next_known = emit_known[:, step + 1] * beta_known[:, step + 1] / scale[:, step + 1]
+            next_unknown = emit_unknown[:, step + 1] * beta_unknown[:, step + 1] / scale[:, step + 1]
+
+            beta_known[:, step] = np.where(present, next_known, beta_known[:, step + 1])
+            beta_unknown[:, step] = np.where(present, (1 - learned) * next_unknown + learned * next_known, beta_unknown[:, step + 1])
+            learning[:, step] = np.where(present, alpha_unknown[:, step] * learned * next_known, 0.0)
+
+        gamma_known = alpha_known * beta_known
+        gamma_known /= gamma_known + alpha_unknown * beta_unknown
+        gamma_unknown = 1 - gamma_known
+
+        log_likelihood = float(np.log(scale).sum())
+
+        #Transitions out of the unknown state can only happen before a sequence's last observation
+        has_next = np.zeros(mask.shape, dtype=bool)
+        has_next[:, :-1] = mask[:, 1:]
+
+        prior = gamma_known[:, 0].mean()
+        learned = learning.sum() / max(EPSILON, (gamma_unknown * has_next).sum())
+        guess = (gamma_unknown * (observations & mask)).sum() / max(EPSILON, (gamma_unknown * mask).sum())
+        mistake = (gamma_known * (~observations & mask)).sum() / max(EPSILON, (gamma_known * mask).sum())
+
+        prior = float(np.clip(prior, EPSILON, 1 - EPSILON))
+        learned = float(np.clip(learned, EPSILON, 1 - EPSILON))
+        guess = float(np.clip(guess, EPSILON, max_guess))
+        mistake = float(np.clip(mistake, EPSILON, max_slip))
+
+        if log_likelihood - last_ll < tolerance:
+            break
+        last_ll = log_likelihood
+
+    log_likelihood, _ = _forward(observations, mask, prior, learned, guess, mistake)
+    return (prior, learned, guess, mistake), float(log_likelihood.sum())
+
+
+def fit(students, skills, correct, method='em', **options):
+    """
+    Fit parameters for every skill in a set of observations.
+
+    Input:
+        students, skills, correct - Parallel sequences with one observation each,
+        in the order they happened.
+        method - 'em' or 'grid'. Options are passed to fit_skill_em or fit_skill_grid.
+
+    Returns: tuple -
+        skill_params - A dictionary of skill to its fitted parameters.
+        student_params - A dictionary of (sender_entity_id, skill) to the fitted
+        parameters with probability_known traced through that student's history,
+        which is what the plugin would hold had it used the fitted parameters.
+    """
+    if method not in ('em', 'grid'):
+        raise ValueError('Unknown fitting method: ' + str(method))
+
+    fit_skill = fit_skill_em if method == 'em' else fit_skill_grid
+
+    by_skill = {}
+    for student, skill, is_correct in zip(students, skills, correct):
+        by_skill.setdefault(skill, ([], []))
+        by_skill[skill][0].append(student)
+        by_skill[skill][1].append(is_correct)
+
+    skill_params = {}
+    student_params = {}
+
+    for skill, (skill_students, skill_correct) in by_skill.items():
+        distinct, observations, mask = _sequences(skill_students, skill_correct)
+        (prior, learned, guess, mistake), log_likelihood = fit_skill(observations, mask, **options)
+
+        skill_params[skill] = {
+            'probability_known': prior,
+            'probability_learned': learned,
+            'probability_guess': guess,
+            'probability_mistake': mistake,
+            'log_likelihood': log_likelihood,
+            'observations': len(skill_correct),
+        }
+
+        _, known = _forward(observations, mask, prior, learned, guess, mistake)
+        for student, p_known in zip(distinct, known):
+            student_params[(student, skill)] = {
+                'probability_known': float(p_known),
+                'probability_learned': learned,
+                'probability_guess': guess,
+                'probability_mistake': mistake,
+            }
+
+    return skill_params, student_params
+
+
+def write_parameters(path, skill_params, student_params):
+    """
+    Write fitted parameters to a JSON file that load_parameters() can read.
+    """
+    with open(path, 'w') as f:
+        json.dump({
+            'skills': skill_params,
+            'students': [[student, skill, params] for (student, skill), params in student_params.items()],
+        }, f)
+
+
+def load_parameters(path):
+    """
+    Returns: tuple - The skill and student parameters from a file written by
+    write_parameters(), with students keyed by (sender_entity_id, skill).
+    """
+    with open(path) as f:
+        data = json.load(f)
+
+    return data['skills'], {(student, skill): params for student, skill, params in data['students']}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Fit knowledge tracing parameters from a recording.')
+    parser.add_argument('recording')
+    parser.add_argument('output')
+    parser.add_argument('--method', choices=['em', 'grid'], default='em')
+    parser.add_argument('--storage', choices=['mongo', 'sqlite', 'memory'])
+    parser.add_argument('--storage-path', help='The database file for sqlite, or the server url for mongo.')
+    args = parser.parse_args(argv)
+
+    students, skills, correct = read_observations(args.recording)
+    if not students:
+        print('No kt_trace observations found in ' + args.recording)
+        return 1
+
+    skill_params, student_params = fit(students, skills, correct, method=args.method)
+    write_parameters(args.output, skill_params, student_params)
+
+    for skill, params in sorted(skill_params.items(), key=lambda item: str(item[0])):
+        print('%-24s known=%.3f learned=%.3f guess=%.3f mistake=%.3f (%d observations)' % (
+            skill, params['probability_known'], params['probability_learned'],
+            params['probability_guess'], params['probability_mistake'], params['observations']))
+
+    if args.storage:
+        from kt_storage import create_storage
+
+        options = {}
+        if args.storage_path:
+            options['url' if args.storage == 'mongo' else 'path'] = args.storage_path
+
+        storage = create_storage(args.storage, **options)
+        storage.save_many(student_params)
+        storage.close()
+
+        print('Loaded ' + str(len(student_params)) + ' students into ' + args.storage)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
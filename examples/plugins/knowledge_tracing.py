@@ -1,14 +1,51 @@
+import json
+
+import numpy as np
+
 from client import Plugin
 
-from pymongo import MongoClient
+from .bkt_engine import BKTState, VectorizedBKT, VECTOR_MIN_BATCH, bkt_update, trace_scalar
+from .bkt_fitting import load_parameters as read_parameters
+from .kt_state_cache import KTStateCache
+from .kt_storage import KT_FIELDS, KTStorage, create_storage
+
+MISSING_INITIAL_SETTINGS_RESPONSE = {
+    'error': 'No initial settings for plugin (KnowledgeTracingPlugin).',
+    'send': {
+        'event_name': 'kt_set_initial',
+        'probability_known': 'float(0.0-1.0)', 
+        'probability_learned': 'float(0.0-1.0)',
+        'probability_guess': 'float(0.0-1.0)',
+        'probability_mistake': 'float(0.0-1.0)'
+    }
+}
 
 class KnowledgeTracingPlugin(Plugin):
 
-    def __init__(self, entity_id, api_key, logger, args = None):
+    def __init__(self, entity_id, api_key, logger, args = None, storage = None):
         super().__init__(entity_id, api_key)
         self.logger = logger
-        self.mongo = MongoClient('mongodb://localhost:27017/')
-        self.db = self.mongo.hpit.hpit_knowledge_tracing
+
+        if args:
+            self.args = json.loads(args[1:-1])
+        else:
+            self.args = {}
+
+        #storage may be a KTStorage, or the name of one: mongo (the default), sqlite or memory
+        if storage is None:
+            storage = self.args.get('storage', 'mongo')
+
+        if not isinstance(storage, KTStorage):
+            storage = create_storage(storage, **self.args.get('storage_options', {}))
+
+        self.storage = storage
+        self.cache = KTStateCache(self.storage)
+        self.engine = VectorizedBKT()
+
+        #Parameters of the students and skills traced by large batches, kept in
+        #arrays for the vectorized engine. Changes made outside those batches
+        #go through _put so the arrays never hold stale parameters.
+        self.state = BKTState()
 
 
     def post_connect(self):
@@ -16,33 +53,59 @@ class KnowledgeTracingPlugin(Plugin):
         
         self.subscribe(
             kt_set_initial=self.kt_set_initial_callback,
-            kt_reset=self.kt_reset,
-            kt_trace=self.kt_trace)
+            kt_reset=self.kt_reset)
+
+        self.subscribe_batch(kt_trace=self.kt_trace_batch)
+
+    def start(self):
+        try:
+            return super().start()
+        finally:
+            #Don't lose traced parameters if the loop dies with an exception
+            self.cache.flush()
+
+    def drain(self, timeout=30):
+        try:
+            return super().drain(timeout)
+        finally:
+            self.cache.flush()
+
+    def post_dispatch_messages(self):
+        self.cache.maybe_flush()
+        return True
+
+    def pre_disconnect(self):
+        self.cache.flush()
+        self.storage.close()
+
+    def load_parameters(self, path):
+        """
+        Bulk-load students' parameters from a file written by bkt_fitting.py,
+        replacing any they already have. They are written back with the next flush.
+        """
+        skill_params, student_params = read_parameters(path)
+
+        for key, params in student_params.items():
+            self._put(key, params)
+
+        self.cache.flush()
+        self.logger.debug("Loaded fitted parameters for " + str(len(student_params)) + " students and skills")
+
+        return len(student_params)
 
     #Knowledge Tracing Plugin
     def kt_trace(self, message):
         self.send_log_entry("RECV: kt_trace with message: " + str(message))
         self.logger.debug("RECV: kt_trace with message: " + str(message))
 
-        kt_config = self.db.find_one({
-            'sender_entity_id': message['sender_entity_id'],
-            'skill': message['skill']
-        })
+        key = (message['sender_entity_id'], message['skill'])
+        kt_config = self.cache.get(key)
 
         if not kt_config:
             self.send_log_entry("ERROR: Could not find inital setting for knowledge tracer.")
             self.logger.debug("ERROR: Could not find inital setting for knowledge tracer.")
 
-            self.send_response(message['message_id'], {
-                'error': 'No initial settings for plugin (KnowledgeTracingPlugin).',
-                'send': {
-                    'event_name': 'kt_set_initial',
-                    'probability_known': 'float(0.0-1.0)', 
-                    'probability_learned': 'float(0.0-1.0)',
-                    'probability_guess': 'float(0.0-1.0)',
-                    'probability_mistake': 'float(0.0-1.0)'
-                }
-            })
+            self.send_response(message['message_id'], MISSING_INITIAL_SETTINGS_RESPONSE)
 
             return True
 
@@ -51,62 +114,111 @@ class KnowledgeTracingPlugin(Plugin):
         p_guess = kt_config['probability_guess']
         p_mistake = kt_config['probability_mistake']
 
-        correct = message['correct']
+        p_known = bkt_update(p_known, p_learned, p_guess, p_mistake, message['correct'])
 
-        numer = 0
-        denom = 1
-
-        if correct:
-            numer = p_known * (1 - p_mistake)
-            denom = numer + (1 - p_known) * p_guess
-        else:
-            numer = p_known * p_mistake
-            denom = numer + (1 - p_known) * (1 - p_guess)
-
-        p_known_prime = numer / denom if denom != 0 else 0
-        p_known = p_known_prime + (1 - p_known_prime) * p_learned
-
-        self.db.update({'_id': kt_config['_id']}, {'$set': {
-            'probability_known': p_known
-        }})
+        self._put(key, dict(kt_config, probability_known=p_known))
 
         self.send_log_entry("SUCCESS: kt_trace with new data: " + str(kt_config))
         self.logger.debug("SUCCESS: kt_trace with new data: " + str(kt_config))
 
         self.send_response(message['message_id'], {
-            'skill': kt_config['skill'],
+            'skill': message['skill'],
             'probability_known': p_known,
             'probability_learned': p_learned,
             'probability_guess': p_guess,
             'probability_mistake': p_mistake
             })
 
+    def kt_trace_batch(self, messages):
+        """
+        Batch version of kt_trace. Traces every kt_trace message from a poll with
+        at most one database query for uncached students and skills. Batches of
+        VECTOR_MIN_BATCH or more are traced in vectorized updates on the
+        parameters held in self.state. Repeated observations of the same student
+        and skill are applied in order. The results are written back by the
+        state cache.
+        """
+        self.send_log_entry("RECV: kt_trace batch of " + str(len(messages)) + " messages")
+        self.logger.debug("RECV: kt_trace batch of " + str(len(messages)) + " messages")
+
+        keys = [(message['sender_entity_id'], message['skill']) for message in messages]
+        correct = [message['correct'] for message in messages]
+
+        if len(keys) < VECTOR_MIN_BATCH:
+            kt_configs = self.cache.get_many(keys)
+            params = {key: tuple(kt_config[field] for field in KT_FIELDS) for key, kt_config in kt_configs.items()}
+
+            posteriors, known = trace_scalar(keys, correct, params)
+
+            for key, p_known in known.items():
+                self._put(key, dict(kt_configs[key], probability_known=p_known))
+        else:
+            posteriors, kt_configs = self._trace_held(keys, correct)
+
+        responses = []
+        for message, key, p_known in zip(messages, keys, posteriors):
+            kt_config = kt_configs.get(key)
+
+            if not kt_config:
+                self.send_log_entry("ERROR: Could not find inital setting for knowledge tracer.")
+                self.logger.debug("ERROR: Could not find inital setting for knowledge tracer.")
+                responses.append((message['message_id'], MISSING_INITIAL_SETTINGS_RESPONSE))
+                continue
+
+            responses.append((message['message_id'], {
+                'skill': message['skill'],
+                'probability_known': float(p_known),
+                'probability_learned': kt_config['probability_learned'],
+                'probability_guess': kt_config['probability_guess'],
+                'probability_mistake': kt_config['probability_mistake']
+                }))
+
+        self.send_responses(responses)
+
+    def _trace_held(self, keys, correct):
+        """
+        Trace a batch with the vectorized engine on the parameters in self.state,
+        loading any it doesn't hold from the state cache first.
+
+        Returns: tuple - The probability known after each observation, NaN where
+        there are no parameters, and the new parameters of each key traced.
+        """
+        unheld = [key for key in set(keys) if key not in self.state]
+        if unheld:
+            self.state.load({
+                key: tuple(kt_config[field] for field in KT_FIELDS)
+                for key, kt_config in self.cache.get_many(unheld).items()})
+
+        observation_index = self.state.indices(keys)
+        observations = np.nonzero(observation_index >= 0)[0]
+
+        posteriors = np.full(len(keys), np.nan)
+        posteriors[observations] = self.engine.trace_indexed(
+            observation_index[observations],
+            np.asarray(correct, dtype=bool)[observations],
+            *self.state.columns())
+
+        kt_configs = {}
+        for index in np.unique(observation_index[observations]).tolist():
+            key = self.state.keys[index]
+            kt_configs[key] = dict(zip(KT_FIELDS, self.state.params(index)))
+            self.cache.put(key, kt_configs[key])
+
+        return posteriors, kt_configs
+
+    def _put(self, key, params):
+        """
+        Set key's parameters in the state cache, and in self.state if it holds them.
+        """
+        self.cache.put(key, params)
+        if key in self.state:
+            self.state.load({key: tuple(params[field] for field in KT_FIELDS)})
+
     def kt_set_initial_callback(self, message):
         self.send_log_entry("RECV: kt_set_initial with message: " + str(message))
         self.logger.debug("RECV: kt_set_initial with message: " + str(message))
 
-        kt_config = self.db.find_one({
-            'sender_entity_id': message['sender_entity_id'],
-            'skill': message['skill']
-        })
-
-        if not kt_config:
-            self.db.insert({
-                'sender_entity_id': message['sender_entity_id'],
-                'skill': message['skill'],
-                'probability_known': message['probability_known'],
-                'probability_learned': message['probability_learned'],
-                'probability_guess': message['probability_guess'],
-                'probability_mistake': message['probability_mistake']
-                })
-        else:
-            self.db.update({'_id': kt_config['_id']},
-                {'$set': {
-                    'probability_known' : message['probability_known'],
-                    'probability_learned' : message['probability_learned'],
-                    'probability_guess' : message['probability_guess'],
-                    'probability_mistake' : message['probability_mistake']
-                }})
+        self._put((message['sender_entity_id'], message['skill']), message)
 
         self.send_response(message['message_id'], {
             'skill': message['skill'],
@@ -120,21 +232,18 @@ class KnowledgeTracingPlugin(Plugin):
         self.send_log_entry("RECV: kt_reset with message: " + str(message))
         self.logger.debug("RECV: kt_reset with message: " + str(message))
 
-        kt_config = self.db.find_one({
-            'sender_entity_id': message['sender_entity_id'],
-            'skill': message['skill']
-        })
+        key = (message['sender_entity_id'], message['skill'])
 
-        if kt_config:
-            self.db.update({'_id': kt_config['_id']}, {'$set': {
+        if self.cache.get(key):
+            self._put(key, {
                 'probability_known': 0.0,
                 'probability_learned': 0.0,
                 'probability_guess': 0.0,
                 'probability_mistake': 0.0
-            }})
+            })
 
         self.send_response(message['message_id'], {
-            'skill': kt_config['skill'],
+            'skill': message['skill'],
             'probability_known': 0.0,
             'probability_learned': 0.0,
             'probability_guess': 0.0,
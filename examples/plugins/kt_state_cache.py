@@ -0,0 +1,152 @@
+import time
+from collections import OrderedDict
+
+from .kt_storage import KT_FIELDS
+
+#Cached in place of parameters for students and skills with no initial settings
+MISSING = object()
+
+
+class KTStateCache:
+    """
+    Keeps knowledge tracing parameters in memory, keyed by
+    (sender_entity_id, skill), so tracing a student doesn't cost a database
+    round trip per message.
+
+    Parameters live in a KTStorage backend. Reads go to the storage only on a
+    miss, and several misses can be read in one round trip with get_many().
+    Keys the storage has no parameters for are remembered for missing_ttl
+    seconds, then looked up again. Writes are held as dirty entries and written
+    back in bulk by flush(), which maybe_flush() calls once flush_size entries
+    are dirty or flush_interval seconds have passed. The least recently used
+    entries are evicted past max_size; dirty entries stay queued for the next
+    flush even if evicted. Whoever owns the cache flushes it before shutting
+    down; the knowledge tracing plugin does so when it stops, even on an error.
+    """
+    def __init__(self, storage, max_size=100000, flush_size=500, flush_interval=5.0, missing_ttl=60.0):
+        self.storage = storage
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.missing_ttl = missing_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+        self._entries = OrderedDict()
+        self._dirty = {}
+        self._missing_until = {}
+        self._last_flush = time.time()
+
+
+    def get(self, key):
+        """
+        Returns: dict - The parameters for key, or None if it has none.
+        """
+        return self.get_many([key]).get(key)
+
+
+    def get_many(self, keys):
+        """
+        Returns: dict - The parameters for each of keys that has them. Every key
+        missing from the cache is read from the storage in a single call.
+        """
+        found = {}
+        missing = []
+
+        for key in set(keys):
+            params = self._lookup(key)
+            if params is None:
+                missing.append(key)
+            elif params is not MISSING:
+                found[key] = params
+
+        if missing:
+            self.misses += len(missing)
+            loaded = self.storage.load_many(missing)
+
+            missing_until = time.time() + self.missing_ttl
+
+            for key in missing:
+                params = loaded.get(key)
+                if params is None:
+                    self._store(key, MISSING)
+                    self._missing_until[key] = missing_until
+                else:
+                    self._store(key, params)
+                    found[key] = params
+
+        return found
+
+
+    def put(self, key, params):
+        """
+        Set the parameters for key. The change is written back on the next flush.
+        """
+        params = {field: params[field] for field in KT_FIELDS}
+        self._store(key, params)
+        self._dirty[key] = params
+
+
+    def maybe_flush(self):
+        if len(self._dirty) >= self.flush_size or time.time() - self._last_flush >= self.flush_interval:
+            return self.flush()
+        return 0
+
+
+    def flush(self):
+        """
+        Write every dirty entry back to the storage in one batch.
+
+        Returns: int - The number of entries written.
+        """
+        self._last_flush = time.time()
+
+        if not self._dirty:
+            return 0
+
+        dirty, self._dirty = self._dirty, {}
+
+        try:
+            self.storage.save_many(dirty)
+        except Exception:
+            #Keep the writes for the next flush, without clobbering newer ones
+            dirty.update(self._dirty)
+            self._dirty = dirty
+            raise
+
+        self.flushes += 1
+        return len(dirty)
+
+
+    def _lookup(self, key):
+        params = self._entries.get(key)
+
+        if params is MISSING and self._missing_until[key] <= time.time():
+            #Look again, the parameters may have been set since
+            del self._entries[key]
+            del self._missing_until[key]
+            params = None
+
+        if params is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return params
+
+        params = self._dirty.get(key)
+        if params is not None:
+            self.hits += 1
+            self._store(key, params)
+
+        return params
+
+
+    def _store(self, key, params):
+        self._entries[key] = params
+        self._entries.move_to_end(key)
+        self._missing_until.pop(key, None)
+
+        while len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            self._missing_until.pop(evicted, None)
@@ -0,0 +1,160 @@
+import sqlite3
+from abc import ABC, abstractmethod
+
+KT_FIELDS = ('probability_known', 'probability_learned', 'probability_guess', 'probability_mistake')
+
+
+class KTStorage(ABC):
+    """
+    Where the knowledge tracing plugin keeps its parameters. Parameters are
+    dictionaries of KT_FIELDS keyed by (sender_entity_id, skill). Backends read
+    and write many keys at once so callers can batch their round trips.
+    """
+    @abstractmethod
+    def load_many(self, keys):
+        """
+        Returns: dict - The parameters for each of keys that has them.
+        """
+
+    @abstractmethod
+    def save_many(self, params_by_key):
+        """
+        Insert or replace the parameters for every key in params_by_key.
+        """
+
+    def close(self):
+        pass
+
+
+class MemoryKTStorage(KTStorage):
+    """
+    Keeps parameters in a dictionary. Nothing survives a restart.
+    """
+    def __init__(self):
+        self.params = {}
+
+    def load_many(self, keys):
+        return {key: dict(self.params[key]) for key in keys if key in self.params}
+
+    def save_many(self, params_by_key):
+        for key, params in params_by_key.items():
+            self.params[key] = {field: params[field] for field in KT_FIELDS}
+
+
+class MongoKTStorage(KTStorage):
+    """
+    Keeps parameters in a MongoDB collection, with a unique compound index on
+    (sender_entity_id, skill) so lookups don't scan the collection.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index([('sender_entity_id', 1), ('skill', 1)], unique=True)
+
+    @classmethod
+    def from_url(cls, url='mongodb://localhost:27017/', database='hpit', collection='hpit_knowledge_tracing'):
+        from pymongo import MongoClient
+        return cls(MongoClient(url)[database][collection])
+
+    def load_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        found = {}
+        for document in self.collection.find({'$or': [
+            {'sender_entity_id': sender_entity_id, 'skill': skill} for sender_entity_id, skill in keys
+        ]}):
+            found[(document['sender_entity_id'], document['skill'])] = {field: document[field] for field in KT_FIELDS}
+
+        return found
+
+    def save_many(self, params_by_key):
+        if not params_by_key:
+            return
+
+        from pymongo import UpdateOne
+
+        self.collection.bulk_write([
+            UpdateOne(
+                {'sender_entity_id': sender_entity_id, 'skill': skill},
+                {'$set': {field: params[field] for field in KT_FIELDS}},
+                upsert=True)
+            for (sender_entity_id, skill), params in params_by_key.items()
+        ], ordered=False)
+
+    def close(self):
+        self.collection.database.client.close()
+
+
+class SQLiteKTStorage(KTStorage):
+    """
+    Keeps parameters in a local SQLite database in WAL mode, keyed by a
+    (sender_entity_id, skill) primary key. Statements are parameterized so
+    SQLite reuses their prepared forms.
+    """
+    LOAD_SQL = ('SELECT sender_entity_id, skill, probability_known, probability_learned, probability_guess, '
+                'probability_mistake FROM kt_params WHERE (sender_entity_id, skill) IN (VALUES {})')
+
+    #Keys read per query. Each takes two variables, and older SQLite builds allow 999.
+    LOAD_CHUNK_SIZE = 499
+
+    SAVE_SQL = ('INSERT OR REPLACE INTO kt_params (sender_entity_id, skill, probability_known, '
+                'probability_learned, probability_guess, probability_mistake) VALUES (?, ?, ?, ?, ?, ?)')
+
+    def __init__(self, path='knowledge_tracing.db'):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS kt_params ('
+            'sender_entity_id TEXT NOT NULL, skill TEXT NOT NULL, '
+            'probability_known REAL, probability_learned REAL, '
+            'probability_guess REAL, probability_mistake REAL, '
+            'PRIMARY KEY (sender_entity_id, skill))')
+        self.connection.commit()
+
+    def load_many(self, keys):
+        keys = list(keys)
+        found = {}
+
+        for start in range(0, len(keys), self.LOAD_CHUNK_SIZE):
+            chunk = keys[start:start + self.LOAD_CHUNK_SIZE]
+            sql = self.LOAD_SQL.format(', '.join(['(?, ?)'] * len(chunk)))
+
+            for row in self.connection.execute(sql, [value for key in chunk for value in key]):
+                found[(row[0], row[1])] = dict(zip(KT_FIELDS, row[2:]))
+
+        return found
+
+    def save_many(self, params_by_key):
+        if not params_by_key:
+            return
+
+        with self.connection:
+            self.connection.executemany(self.SAVE_SQL, [
+                (sender_entity_id, skill) + tuple(params[field] for field in KT_FIELDS)
+                for (sender_entity_id, skill), params in params_by_key.items()
+            ])
+
+    def close(self):
+        self.connection.close()
+
+
+STORAGE_BACKENDS = {
+    'memory': MemoryKTStorage,
+    'mongo': MongoKTStorage.from_url,
+    'sqlite': SQLiteKTStorage,
+}
+
+
+def create_storage(kind='mongo', **options):
+    """
+    Create a storage backend by name: 'mongo', 'sqlite' or 'memory'. Options are
+    passed to the backend, eg. url for mongo or path for sqlite.
+    """
+    try:
+        backend = STORAGE_BACKENDS[kind]
+    except KeyError:
+        raise ValueError('Unknown knowledge tracing storage: ' + str(kind))
+
+    return backend(**options)
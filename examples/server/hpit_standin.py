@@ -0,0 +1,294 @@
+"""
+A small in-memory stand-in for the HPIT server, for running plugins and tutors
+locally and for benchmarking the client's wire formats.
+
+It implements the endpoints the Python client uses, identifies entities by a
+session cookie set on connect, and speaks both JSON and MessagePack: request
+bodies are decoded by their Content-Type and responses are encoded in the
+format the Accept header prefers. Compressed request bodies are accepted, and
+large responses are gzipped for clients that accept it. Nothing is persisted and nothing is
+authenticated.
+
+Usage: python hpit_standin.py [port] [--json-only]
+"""
+import sys
+import gzip
+import json
+import uuid
+import zlib
+import socket
+import threading
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_TYPE = 'application/json'
+
+#Responses at least this long are gzipped for clients that accept it
+GZIP_THRESHOLD = 1024
+
+DECOMPRESSORS = {'gzip': gzip.decompress, 'deflate': zlib.decompress}
+if zstandard is not None:
+    DECOMPRESSORS['zstd'] = lambda body: zstandard.ZstdDecompressor().decompress(body)
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+
+class StandInState:
+    """
+    Everything the stand-in server knows, shared by its request handlers.
+    """
+    def __init__(self, msgpack_enabled=True):
+        self.msgpack_enabled = msgpack_enabled and msgpack is not None
+        self.lock = threading.Lock()
+
+        self.subscriptions = {}
+        self.messages = {}
+        self.transactions = {}
+        self.responses = {}
+        self.senders = {}
+
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = self.bytes_in = self.bytes_out = 0
+
+
+    def _take(self, queues, entity_id, limit):
+        queue = queues.get(entity_id, [])
+        if limit is None:
+            limit = len(queue)
+
+        taken, queues[entity_id] = queue[:limit], queue[limit:]
+        return taken
+
+
+    def handle(self, method, path, query, entity_id, data):
+        """
+        Returns: tuple - The status code and the body to send back.
+        """
+        limit = int(query['limit'][0]) if 'limit' in query else None
+
+        with self.lock:
+            if path == 'connect':
+                return 200, {'entity_id': data['entity_id']}
+
+            if entity_id is None:
+                return 403, {'error': 'not connected'}
+
+            if path == 'disconnect' or path == 'log':
+                return 200, {}
+
+            if path == 'message' or path == 'transaction':
+                name = data.get('name', 'transaction')
+                message_id = uuid.uuid4().hex
+                item = {
+                    'message_id': message_id,
+                    'sender_entity_id': entity_id,
+                    'message_name': name,
+                    'time_created': datetime.now(timezone.utc).isoformat(),
+                    'message': data['payload'],
+                }
+
+                self.senders[message_id] = (entity_id, name)
+                queues = self.transactions if path == 'transaction' else self.messages
+                for subscriber in self.subscriptions.get(name, ()):
+                    queues.setdefault(subscriber, []).append(item)
+
+                return 200, {'message_id': message_id}
+
+            if path == 'response':
+                sender = self.senders.get(data['message_id'])
+                if sender is None:
+                    return 404, {'error': 'unknown message'}
+
+                self.responses.setdefault(sender[0], []).append({
+                    'message': {
+                        'message_id': data['message_id'],
+                        'sender_entity_id': sender[0],
+                        'receiver_entity_id': entity_id,
+                        'message_name': sender[1],
+                    },
+                    'response': data['payload'],
+                })
+                return 200, {}
+
+            if path == 'plugin/subscribe':
+                self.subscriptions.setdefault(data['message_name'], set()).add(entity_id)
+                return 200, {}
+
+            if path == 'plugin/unsubscribe':
+                self.subscriptions.get(data['message_name'], set()).discard(entity_id)
+                return 200, {}
+
+            if path == 'plugin/subscription/list':
+                return 200, {'subscriptions': [name for name, subscribers in self.subscriptions.items() if entity_id in subscribers]}
+
+            if path == 'plugin/message/list':
+                return 200, {'messages': self._take(self.messages, entity_id, limit)}
+
+            if path == 'plugin/transaction/list':
+                return 200, {'transactions': self._take(self.transactions, entity_id, limit)}
+
+            if path == 'response/list':
+                return 200, {'responses': self._take(self.responses, entity_id, limit)}
+
+            if path.startswith('message-owner/'):
+                subscribers = sorted(self.subscriptions.get(path.split('/', 1)[1], ()))
+                if not subscribers:
+                    return 404, {'error': 'no owner'}
+                return 200, {'owner': subscribers[0]}
+
+        return 404, {'error': 'not found'}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        #Headers and body are written separately; don't let Nagle hold the body back
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_GET(self):
+        self._handle('GET')
+
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+    def _handle(self, method):
+        state = self.server.state
+        url = urlparse(self.path)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        wire_length = len(body)
+
+        content_encoding = self.headers.get('Content-Encoding')
+        if body and content_encoding:
+            if content_encoding not in DECOMPRESSORS:
+                return self._send(415, {'error': 'unsupported content encoding'}, JSON_TYPE)
+            body = DECOMPRESSORS[content_encoding](body)
+
+        content_type = (self.headers.get('Content-Type') or JSON_TYPE).split(';')[0].strip()
+        if not body:
+            data = {}
+        elif content_type == JSON_TYPE:
+            data = json.loads(body.decode('utf-8'))
+        elif content_type in MSGPACK_TYPES and state.msgpack_enabled:
+            data = msgpack.unpackb(body, raw=False)
+        else:
+            return self._send(415, {'error': 'unsupported content type'}, JSON_TYPE)
+
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        entity_id = cookie['entity_id'].value if 'entity_id' in cookie else None
+
+        status, result = state.handle(method, url.path.strip('/'), parse_qs(url.query), entity_id, data)
+
+        with state.lock:
+            state.requests += 1
+            state.bytes_in += wire_length
+
+        set_cookie = None
+        if url.path.strip('/') == 'connect' and status == 200:
+            set_cookie = 'entity_id=' + str(data['entity_id']) + '; Path=/'
+
+        self._send(status, result, self._response_type(), set_cookie)
+
+
+    def _response_type(self):
+        accept = self.headers.get('Accept') or JSON_TYPE
+
+        #Take the first listed type we can produce; clients list their preference first
+        for media_range in accept.split(','):
+            media_type = media_range.split(';')[0].strip()
+            if media_type in MSGPACK_TYPES and self.server.state.msgpack_enabled:
+                return MSGPACK_TYPES[0]
+            if media_type in (JSON_TYPE, '*/*', 'application/*'):
+                return JSON_TYPE
+
+        return JSON_TYPE
+
+
+    def _send(self, status, result, content_type, set_cookie=None):
+        if content_type == JSON_TYPE:
+            body = json.dumps(result).encode('utf-8')
+        else:
+            body = msgpack.packb(result, use_bin_type=True)
+
+        content_encoding = None
+        if len(body) >= GZIP_THRESHOLD and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body)
+            content_encoding = 'gzip'
+
+        with self.server.state.lock:
+            self.server.state.bytes_out += len(body)
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
+        self.send_header('Content-Length', str(len(body)))
+        if set_cookie:
+            self.send_header('Set-Cookie', set_cookie)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer:
+    """
+    Runs the stand-in on a background thread. Port 0 picks a free port; the
+    server's address is in root_url once started.
+    """
+    def __init__(self, host='127.0.0.1', port=0, msgpack_enabled=True):
+        self.state = StandInState(msgpack_enabled)
+        self.httpd = ThreadingHTTPServer((host, port), StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self.root_url = 'http://%s:%d' % self.httpd.server_address
+        self._thread = None
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 8000
+    server = StandInServer(port=port, msgpack_enabled='--json-only' not in sys.argv)
+
+    print('HPIT stand-in listening on ' + server.root_url + (' (msgpack)' if server.state.msgpack_enabled else ''))
+
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
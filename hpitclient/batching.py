@@ -0,0 +1,75 @@
+import time
+
+from .exceptions import InvalidParametersError
+
+
+class MessageBatcher:
+    """
+    Accumulates the payloads of one message name so they can be handed to a
+    batch callback as a list.
+
+    With max_wait of 0 everything received in a poll is delivered at the end of
+    that poll. With a positive max_wait payloads are held across polls until
+    either max_batch_size of them have accumulated or the oldest has waited
+    max_wait seconds. Batches never exceed max_batch_size when it is set.
+    """
+    def __init__(self, callback, max_batch_size=None, max_wait=0):
+        if max_batch_size is not None and max_batch_size <= 0:
+            raise InvalidParametersError('max_batch_size must be positive or None')
+
+        if max_wait < 0:
+            raise InvalidParametersError('max_wait cannot be negative')
+
+        self.callback = callback
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches_delivered = 0
+
+        self._pending = []
+        self._enqueued = []
+
+
+    def __len__(self):
+        return len(self._pending)
+
+
+    @property
+    def _oldest(self):
+        return self._enqueued[0] if self._enqueued else None
+
+
+    def add(self, payload):
+        self._pending.append(payload)
+        self._enqueued.append(time.time())
+
+
+    def flush(self, force=False, now=None):
+        """
+        Deliver every batch that is due to the callback. With force, everything
+        pending is delivered regardless of max_wait.
+
+        Returns: int - The number of payloads delivered.
+        """
+        if not self._pending:
+            return 0
+
+        if now is None:
+            now = time.time()
+
+        size = self.max_batch_size
+        delivered = 0
+
+        #Payloads left over from a batch keep the time they were added, so they
+        #wait no longer than max_wait however the batches before them were cut
+        while self._pending and (force or (size is not None and len(self._pending) >= size)
+                                 or now - self._enqueued[0] >= self.max_wait):
+            count = size or len(self._pending)
+            batch = self._pending[:count]
+            del self._pending[:count]
+            del self._enqueued[:count]
+
+            self.callback(batch)
+            self.batches_delivered += 1
+            delivered += len(batch)
+
+        return delivered
@@ -0,0 +1,188 @@
+import time
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from .exceptions import InvalidParametersError
+
+
+class TTLCache:
+    """
+    A small thread safe cache whose entries expire after a time-to-live and
+    which evicts the least recently used entry once max_size is reached.
+
+    None is treated as a negative result. When negative_ttl is set, negative
+    results are cached for that long instead of ttl, so lookups that failed are
+    retried sooner than ones that succeeded.
+
+    When refresh_ahead is set to a fraction of the ttl (eg. 0.8), entries loaded
+    through get_or_load that are older than that fraction are still returned
+    from the cache, but are reloaded on a background thread so callers rarely
+    wait on an expired entry. refresh_context, if given, is called to get a
+    context manager that each background reload runs inside, eg. to give it a
+    session of its own. A reload whose key is invalidated while it is running
+    is discarded rather than cached.
+    """
+    def __init__(self, ttl=60, negative_ttl=None, max_size=1024, refresh_ahead=None, refresh_context=None):
+        if ttl <= 0:
+            raise InvalidParametersError('ttl must be positive')
+
+        if max_size <= 0:
+            raise InvalidParametersError('max_size must be positive')
+
+        if refresh_ahead is not None and not 0 < refresh_ahead < 1:
+            raise InvalidParametersError('refresh_ahead must be between 0 and 1')
+
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.max_size = max_size
+        self.refresh_ahead = refresh_ahead
+        self.refresh_context = refresh_context
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        #Keys being reloaded in the background, mapped to False once invalidated
+        self._refreshing = {}
+        self._lock = threading.RLock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, key):
+        found, value = self._lookup(key, count=False)
+        return found
+
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key, or default if it is missing or expired.
+        """
+        found, value = self._lookup(key)
+        return value if found else default
+
+
+    def set(self, key, value, ttl=None):
+        """
+        Cache value under key. The ttl defaults to the cache's ttl, or its
+        negative_ttl when value is None.
+        """
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+
+        now = time.time()
+
+        with self._lock:
+            self._entries[key] = (value, now, now + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key. On a miss loader() is called and its
+        result cached.
+        """
+        found, value = self._lookup(key)
+        if found:
+            if self.refresh_ahead is not None:
+                self._maybe_refresh(key, loader)
+            return value
+
+        value = loader()
+        self.set(key, value)
+        return value
+
+
+    def invalidate(self, *keys):
+        """
+        Remove the given keys from the cache, or everything if no keys are given.
+        """
+        with self._lock:
+            if not keys:
+                self._entries.clear()
+                keys = list(self._refreshing)
+
+            for key in keys:
+                self._entries.pop(key, None)
+                if key in self._refreshing:
+                    self._refreshing[key] = False
+
+
+    def invalidate_matching(self, predicate):
+        """
+        Remove every key for which predicate(key) is true.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+            for key in [key for key in self._refreshing if predicate(key)]:
+                self._refreshing[key] = False
+
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+    def _lookup(self, key, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[2] <= time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return True, entry[0]
+
+
+    def _maybe_refresh(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or key in self._refreshing:
+                return
+
+            value, stored_at, expires_at = entry
+            if time.time() < stored_at + (expires_at - stored_at) * self.refresh_ahead:
+                return
+
+            self._refreshing[key] = True
+
+        def refresh():
+            loaded = False
+            try:
+                with (self.refresh_context or nullcontext)():
+                    value = loader()
+                loaded = True
+            except Exception:
+                #Leave the current entry to expire normally
+                pass
+            finally:
+                with self._lock:
+                    #A value invalidated while it was loading is stale, so drop it
+                    if self._refreshing.pop(key) and loaded:
+                        self.set(key, value)
+
+        threading.Thread(target=refresh, daemon=True).start()
@@ -0,0 +1,98 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .message import json_default
+from .exceptions import InvalidParametersError
+
+
+class JSONCodec:
+    """
+    The wire format every HPIT server understands.
+    """
+    name = 'json'
+    content_type = 'application/json'
+
+    def encode(self, data):
+        return json.dumps(data, default=json_default).encode('utf-8')
+
+    def decode(self, body):
+        if isinstance(body, (bytes, bytearray)):
+            body = body.decode('utf-8')
+        return json.loads(body)
+
+
+class MessagePackCodec:
+    """
+    MessagePack, a binary format that is smaller and faster to encode and decode
+    than JSON. Needs the msgpack package.
+    """
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def encode(self, data):
+        return msgpack.packb(data, default=json_default, use_bin_type=True)
+
+    def decode(self, body):
+        return msgpack.unpackb(body, raw=False)
+
+
+JSON_CODEC = JSONCodec()
+
+CODECS = {'json': JSON_CODEC}
+if msgpack is not None:
+    CODECS['msgpack'] = MessagePackCodec()
+
+#Other names servers use for the same formats
+CONTENT_TYPE_ALIASES = {
+    'application/x-msgpack': 'application/msgpack',
+    'application/vnd.msgpack': 'application/msgpack',
+}
+
+
+def get_codec(name):
+    """
+    Returns: The codec called name.
+
+    Throws:
+        InvalidParametersError - There is no such codec, or the package it needs
+        isn't installed.
+    """
+    if name == 'msgpack' and msgpack is None:
+        raise InvalidParametersError('The msgpack wire format needs the msgpack package installed.')
+
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise InvalidParametersError('Unknown wire format: ' + str(name))
+
+
+def codec_for_content_type(content_type):
+    """
+    Returns: The codec for a Content-Type header value, or None if there is no
+    codec for it.
+    """
+    if not isinstance(content_type, str):
+        return None
+
+    content_type = content_type.split(';')[0].strip().lower()
+    content_type = CONTENT_TYPE_ALIASES.get(content_type, content_type)
+
+    for codec in CODECS.values():
+        if codec.content_type == content_type:
+            return codec
+
+    return None
+
+
+def accept_header(codec):
+    """
+    Returns: string - An Accept header preferring codec, with JSON as the fallback.
+    """
+    if codec is JSON_CODEC:
+        return JSON_CODEC.content_type
+
+    return codec.content_type + ', ' + JSON_CODEC.content_type + ';q=0.5'
@@ -0,0 +1,178 @@
+import gzip
+import time
+import threading
+import zlib
+from urllib.parse import urlparse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .rate_limit import endpoint_class
+from .exceptions import InvalidParametersError
+
+#Applies to every endpoint without a policy of its own
+ALL_ENDPOINTS = '*'
+
+
+def _zstd_compress(body, level):
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compress(body)
+
+
+def _zstd_decompress(body):
+    return zstandard.ZstdDecompressor().decompress(body)
+
+
+COMPRESSORS = {
+    'gzip': lambda body, level: gzip.compress(body, 6 if level is None else level),
+    'deflate': lambda body, level: zlib.compress(body, 6 if level is None else level),
+}
+
+DECOMPRESSORS = {
+    'gzip': gzip.decompress,
+    'deflate': zlib.decompress,
+}
+
+if zstandard is not None:
+    COMPRESSORS['zstd'] = _zstd_compress
+    DECOMPRESSORS['zstd'] = _zstd_decompress
+
+
+def decompress(body, encoding):
+    """
+    Undo a Content-Encoding applied by RequestCompressor.
+    """
+    try:
+        return DECOMPRESSORS[encoding](body)
+    except KeyError:
+        raise InvalidParametersError('Unsupported content encoding: ' + str(encoding))
+
+
+class RequestCompressor:
+    """
+    Compresses request bodies sent to HPIT, by policy per endpoint.
+
+    A policy names an encoding ('gzip', 'deflate' or, with the zstandard package
+    installed, 'zstd') and a threshold in bytes; bodies smaller than the threshold
+    are sent as they are, since compressing them costs more than it saves. A
+    policy can be set for an endpoint path such as 'transaction', an endpoint
+    class such as 'send' (see rate_limit.ENDPOINT_CLASSES) or ALL_ENDPOINTS, and
+    the most specific one applies.
+
+    Compression ratio and the CPU time spent compressing are kept per encoding
+    to help tune the thresholds, along with the ratio of compressed responses.
+    The stats are updated under a lock, since _post_many compresses on several
+    threads at once.
+    """
+    def __init__(self):
+        self.policies = {}
+        self.rejected = set()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+
+    def set_policy(self, endpoint=ALL_ENDPOINTS, encoding='gzip', threshold=1024, level=None):
+        if encoding == 'zstd' and zstandard is None:
+            raise InvalidParametersError('zstd compression needs the zstandard package installed.')
+
+        if encoding not in COMPRESSORS:
+            raise InvalidParametersError('Unknown compression encoding: ' + str(encoding))
+
+        if not isinstance(threshold, int) or threshold < 0:
+            raise InvalidParametersError('threshold must be a number of bytes, not negative')
+
+        self.policies[endpoint] = (encoding, threshold, level)
+        self.rejected.discard(encoding)
+
+
+    def remove_policy(self, endpoint=ALL_ENDPOINTS):
+        self.policies.pop(endpoint, None)
+
+
+    def policy_for(self, url):
+        """
+        Returns: tuple - The (encoding, threshold, level) policy for url, or None.
+        """
+        for endpoint in (urlparse(url).path.strip('/'), endpoint_class(url), ALL_ENDPOINTS):
+            if endpoint in self.policies:
+                return self.policies[endpoint]
+
+        return None
+
+
+    def compress(self, url, body):
+        """
+        Compress a request body for url if its policy calls for it.
+
+        Returns: tuple - The body to send and its Content-Encoding, or None if it
+        was left uncompressed.
+        """
+        policy = self.policy_for(url)
+        if policy is None:
+            return body, None
+
+        encoding, threshold, level = policy
+
+        if encoding in self.rejected or len(body) < threshold:
+            with self._stats_lock:
+                self._encoding_stats(encoding)['skipped'] += 1
+            return body, None
+
+        start = time.thread_time()
+        compressed = COMPRESSORS[encoding](body, level)
+        cpu_time = time.thread_time() - start
+
+        with self._stats_lock:
+            stats = self._encoding_stats(encoding)
+            stats['cpu_time'] += cpu_time
+            stats['compressed'] += 1
+            stats['bytes_in'] += len(body)
+            stats['bytes_out'] += len(compressed)
+
+        return compressed, encoding
+
+
+    def reject(self, encoding):
+        """
+        Stop using encoding, after the server refused a body compressed with it.
+        """
+        self.rejected.add(encoding)
+
+
+    def record_response(self, response):
+        """
+        Note the compression ratio of a response HPIT sent compressed.
+        """
+        headers = getattr(response, 'headers', None) or {}
+        encoding = headers.get('content-encoding')
+        wire_length = headers.get('content-length')
+
+        if not encoding or not wire_length:
+            return
+
+        with self._stats_lock:
+            stats = self._encoding_stats('response ' + encoding.lower())
+            stats['compressed'] += 1
+            stats['bytes_in'] += len(response.content)
+            stats['bytes_out'] += int(wire_length)
+
+
+    def stats(self):
+        """
+        Returns: dict - For each encoding (and each 'response <encoding>'), how many
+        bodies were compressed and skipped, the bytes before and after, the ratio of
+        compressed to original size and the CPU seconds spent compressing.
+        """
+        result = {}
+        with self._stats_lock:
+            for encoding, stats in self._stats.items():
+                result[encoding] = dict(stats,
+                    ratio=stats['bytes_out'] / stats['bytes_in'] if stats['bytes_in'] else None)
+        return result
+
+
+    def _encoding_stats(self, encoding):
+        if encoding not in self._stats:
+            self._stats[encoding] = {'compressed': 0, 'skipped': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_time': 0.0}
+        return self._stats[encoding]
@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict
+
+from .exceptions import InvalidParametersError
+
+
+class MessageDeduplicator:
+    """
+    Remembers the ids of recently seen messages so that messages redelivered by
+    HPIT after a reconnect or retry are only handled once.
+
+    The seen-set is bounded both in time and in size. Ids older than window
+    seconds are forgotten, and once max_size ids are held the oldest are
+    forgotten first. A redelivery that arrives after its id has been forgotten
+    will be handled again, so window should comfortably exceed the longest
+    expected reconnection time.
+    """
+    def __init__(self, window=600, max_size=100000):
+        if window <= 0:
+            raise InvalidParametersError('window must be positive')
+
+        if max_size <= 0:
+            raise InvalidParametersError('max_size must be positive')
+
+        self.window = window
+        self.max_size = max_size
+        self.accepted = 0
+        self.duplicates = 0
+        self._seen = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._seen)
+
+
+    def check(self, key, now=None):
+        """
+        Record key as seen.
+
+        Returns: boolean - True if key is new and should be handled, False if it
+        was already seen within the window.
+        """
+        if now is None:
+            now = time.time()
+
+        self._expire(now)
+
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+
+        self._seen[key] = now
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+        self.accepted += 1
+        return True
+
+
+    def forget(self, key):
+        """
+        Remove key from the seen-set so a later delivery is handled again.
+        """
+        self._seen.pop(key, None)
+
+
+    def clear(self):
+        self._seen.clear()
+
+
+    def stats(self):
+        return {
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'tracked': len(self._seen),
+        }
+
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        seen = self._seen
+
+        while seen:
+            key, seen_at = next(iter(seen.items()))
+            if seen_at >= cutoff:
+                break
+            seen.popitem(last=False)
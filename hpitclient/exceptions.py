@@ -61,3 +61,8 @@ class BadCallbackException(Exception):
     Raised when a callback is not callable
     """
     
+
+class RateLimitExceededError(Exception):
+    """
+    Raised when a request would exceed a rate limit configured with mode 'raise'.
+    """
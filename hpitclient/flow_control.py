@@ -0,0 +1,57 @@
+from .exceptions import InvalidParametersError
+
+
+class FlowController:
+    """
+    Decides whether a plugin should keep polling HPIT based on how much polled
+    work is still waiting to be handled.
+
+    Once the backlog reaches high_water polling is paused, and it stays paused
+    until the backlog drains down to low_water. The gap between the two marks
+    stops the plugin from flapping between polling and not polling.
+    """
+    def __init__(self, high_water, low_water=None):
+        if high_water <= 0:
+            raise InvalidParametersError('high_water must be positive')
+
+        if low_water is None:
+            low_water = high_water // 2
+
+        if not 0 <= low_water < high_water:
+            raise InvalidParametersError('low_water must be at least 0 and below high_water')
+
+        self.high_water = high_water
+        self.low_water = low_water
+        self.paused = False
+        self.pause_count = 0
+        self.depth = 0
+        self.max_depth = 0
+
+
+    def update(self, depth):
+        """
+        Record the current backlog depth.
+
+        Returns: boolean - True if the plugin may poll for more work.
+        """
+        self.depth = depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+        if self.paused:
+            if depth <= self.low_water:
+                self.paused = False
+        elif depth >= self.high_water:
+            self.paused = True
+            self.pause_count += 1
+
+        return not self.paused
+
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'paused': self.paused,
+            'pause_count': self.pause_count,
+        }
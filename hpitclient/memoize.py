@@ -0,0 +1,208 @@
+import functools
+
+from .cache import TTLCache
+from .message import METADATA_FIELDS
+from .response_cache import payload_digest
+from .exceptions import InvalidParametersError
+
+
+def memoize_response(*fields, ttl=300, max_size=1024, invalidate_on=()):
+    """
+    Decorates a Plugin callback method that computes its response from a few
+    fields of the payload, so repeated messages are answered from a cache.
+
+    The decorated method returns its response payload instead of sending it. The
+    decorator sends it with send_response and caches it, keyed on the values of
+    fields (or the whole payload if no fields are given). When a later message
+    has the same values the cached response is sent and the method isn't called.
+    A method that returns None has nothing cached and is expected to have sent
+    its own response.
+
+        class SkillPlugin(Plugin):
+
+            @memoize_response('student_id', 'skill', ttl=60, invalidate_on=('kt_reset',))
+            def kt_get_skill(self, message):
+                return {'probability_known': self.lookup(message['student_id'], message['skill'])}
+
+    Input:
+        fields - The payload fields the response depends on.
+        ttl - How long in seconds a response is cached.
+        max_size - The most responses to hold before evicting the least recently used.
+        invalidate_on - Message names that change the cached results. When the plugin
+        receives one, the response for its field values is dropped, or every
+        response if it doesn't carry all of the fields.
+
+    Each plugin instance has its own cache, which can be reached through the
+    method, eg. self.kt_get_skill.invalidate(student_id='1', skill='addition'),
+    self.kt_get_skill.clear() and self.kt_get_skill.stats(). Under a
+    PreforkRunner every worker has its own cache too. invalidate_on messages are
+    passed to every worker so each drops its copy, but calls to invalidate() or
+    clear() only reach the cache of the process they are made in.
+    """
+    if ttl <= 0:
+        raise InvalidParametersError('ttl must be positive')
+
+    if max_size <= 0:
+        raise InvalidParametersError('max_size must be positive')
+
+    if isinstance(invalidate_on, str):
+        invalidate_on = (invalidate_on,)
+
+    def decorator(handler):
+        return MemoizedHandler(handler, fields, ttl, max_size, tuple(invalidate_on))
+
+    return decorator
+
+
+class MemoizedHandler:
+    """
+    The descriptor memoize_response() replaces a method with. Looking it up on a
+    plugin binds a HandlerMemo to that plugin, which is stored on the instance
+    so later lookups find it directly.
+    """
+    def __init__(self, handler, fields, ttl, max_size, invalidate_on):
+        functools.update_wrapper(self, handler)
+        self.handler = handler
+        self.fields = fields
+        self.ttl = ttl
+        self.max_size = max_size
+        self.invalidate_on = invalidate_on
+        self.name = handler.__name__
+
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        memo = HandlerMemo(self, instance)
+        instance.__dict__[self.name] = memo
+        return memo
+
+
+class HandlerMemo:
+    """
+    A memoized handler bound to a plugin. Calling it handles a message.
+    """
+    def __init__(self, memoized, plugin):
+        functools.update_wrapper(self, memoized.handler)
+        self.handler = memoized.handler.__get__(plugin)
+        self.plugin = plugin
+        self.fields = memoized.fields
+        self.cache = TTLCache(memoized.ttl, max_size=memoized.max_size)
+        self.uncached = 0
+
+        self.invalidate_on = frozenset(memoized.invalidate_on)
+        if self.invalidate_on:
+            plugin.use_middleware('message', self._invalidation_middleware, name='memoize ' + memoized.name)
+
+
+    def __call__(self, message):
+        key = self.key(message)
+
+        if key is None:
+            self.uncached += 1
+            response = None
+        else:
+            response = self.cache.get(key)
+
+        if response is None:
+            response = self.handler(message)
+            if response is None:
+                return None
+
+            if key is not None:
+                self.cache.set(key, response)
+
+        self.plugin.send_response(message['message_id'], response)
+        return response
+
+
+    def key(self, message):
+        """
+        Returns: string - The cache key for message, or None if it lacks one of the
+        fields or their values can't be hashed.
+        """
+        if not self.fields:
+            return payload_digest({key: value for key, value in message.items() if key not in METADATA_FIELDS})
+
+        try:
+            return payload_digest([message[field] for field in self.fields])
+        except KeyError:
+            return None
+
+
+    def invalidate(self, **values):
+        """
+        Drop the cached response for the given field values.
+
+        Throws:
+            InvalidParametersError - The values aren't exactly the memoized fields.
+        """
+        if set(values) != set(self.fields):
+            raise InvalidParametersError('invalidate() needs a value for each of: ' + ', '.join(self.fields))
+
+        self.cache.invalidate(payload_digest([values[field] for field in self.fields]))
+
+
+    def clear(self):
+        self.cache.invalidate()
+
+
+    def stats(self):
+        """
+        Returns: dict - Hits, misses, evictions, size and hit rate of the cache, and
+        how many messages lacked the fields to be cached.
+        """
+        return dict(self.cache.stats(), uncached=self.uncached)
+
+
+    def invalidate_message(self, message):
+        """
+        Drop the cached response for the field values of a polled invalidate_on
+        message, or every response if it doesn't carry all of the fields.
+        """
+        key = self.key(message['message']) if self.fields else None
+        if key is None:
+            self.clear()
+        else:
+            self.cache.invalidate(key)
+
+
+    def _invalidation_middleware(self, next_handler):
+        def handler(message):
+            if message['message_name'] in self.invalidate_on:
+                self.invalidate_message(message)
+            return next_handler(message)
+        return handler
+
+
+def _memoized_handlers(plugin_class):
+    seen = set()
+    for cls in plugin_class.__mro__:
+        for name, value in vars(cls).items():
+            if name not in seen:
+                seen.add(name)
+                if isinstance(value, MemoizedHandler):
+                    yield name, value
+
+
+def invalidating_messages(plugin):
+    """
+    Returns: set - The names of the messages that invalidate one of plugin's
+    memoized handlers.
+    """
+    return set(message_name for _, memoized in _memoized_handlers(type(plugin)) for message_name in memoized.invalidate_on)
+
+
+def invalidate_memos(plugin, message):
+    """
+    Apply a polled message to the caches of every one of plugin's memoized handlers
+    it invalidates, without handling it.
+    """
+    for name, memoized in _memoized_handlers(type(plugin)):
+        if message['message_name'] in memoized.invalidate_on:
+            getattr(plugin, name).invalidate_message(message)
@@ -0,0 +1,107 @@
+from collections.abc import Mapping
+
+METADATA_FIELDS = ('message_id', 'sender_entity_id', 'time_created')
+
+
+def json_default(obj):
+    """
+    Passed as default to json.dumps so handlers can send any mapping, not just
+    dictionaries, as payloads.
+    """
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError('Object of type ' + type(obj).__name__ + ' is not JSON serializable')
+
+
+class Message(dict):
+    """
+    A message polled from HPIT, as handed to plugin callbacks.
+
+    A Message is a dictionary of the payload with the message's message_id,
+    sender_entity_id and time_created added, so handlers written against plain
+    dictionaries keep working. The metadata is also available as read-only
+    attributes, which changing the dictionary doesn't affect, and the payload as
+    it was polled, without the metadata, as message.payload.
+
+    The polled item is kept as it is, rather than having the metadata injected
+    into its payload, so the only allocation per message is the dictionary.
+    """
+    __slots__ = ('_item',)
+
+    @classmethod
+    def from_item(cls, item):
+        """
+        Build a Message from one item of a plugin/message/list or
+        plugin/transaction/list poll.
+        """
+        message = cls(item['message'])
+        message._item = item
+
+        message['message_id'] = item['message_id']
+        message['sender_entity_id'] = item['sender_entity_id']
+        message['time_created'] = item['time_created']
+
+        return message
+
+
+    @property
+    def message_id(self):
+        return self._item['message_id']
+
+
+    @property
+    def sender_entity_id(self):
+        return self._item['sender_entity_id']
+
+
+    @property
+    def time_created(self):
+        return self._item['time_created']
+
+
+    @property
+    def message_name(self):
+        return self._item.get('message_name')
+
+
+    @property
+    def payload(self):
+        """
+        The payload as sent, without the metadata fields.
+        """
+        return self._item['message']
+
+
+class Response:
+    """
+    A response polled from HPIT. The callback registered when the message was
+    sent is given the payload.
+
+    A response answered from the response cache carries the callback of the
+    query it answers instead, since its message_id is that of the query first
+    answered.
+    """
+    __slots__ = ('message_id', 'receiver_entity_id', 'message_name', 'payload', 'callback')
+
+    def __init__(self, message_id, payload, receiver_entity_id=None, message_name=None, callback=None):
+        self.message_id = message_id
+        self.receiver_entity_id = receiver_entity_id
+        self.message_name = message_name
+        self.payload = payload
+        self.callback = callback
+
+
+    @classmethod
+    def from_item(cls, item):
+        """
+        Build a Response from one item of a response/list poll.
+
+        Throws:
+            KeyError - The item has no message id or response payload.
+        """
+        message = item['message']
+        return cls(message['message_id'], item['response'], message.get('receiver_entity_id'), message.get('message_name'))
+
+
+    def __repr__(self):
+        return 'Response(' + repr(self.message_id) + ', ' + repr(self.payload) + ')'
@@ -1,4 +1,13 @@
+import signal
+import threading
+from urllib.parse import urlencode
+
 from .requests_mixin import RequestsMixin
+from .recorder import TrafficRecorder
+from .dedup import MessageDeduplicator
+from .cache import TTLCache
+from .response_cache import ResponseCache
+from .message import Response
 from .exceptions import ResponseDispatchError
 from .exceptions import InvalidMessageNameException
 from .exceptions import AuthenticationError, InvalidParametersError, AuthorizationError, ResourceNotFoundError
@@ -7,6 +16,12 @@ class MessageSenderMixin(RequestsMixin):
     def __init__(self):
         super().__init__()
         self.response_callbacks = {}
+        self.recorder = None
+        self.response_deduplicator = None
+        self.metadata_cache = None
+        self.response_cache = None
+        self.poll_limits = {}
+        self.poll_saturated = False
         
         self._add_hooks('pre_poll_responses', 'post_poll_responses', 'pre_dispatch_responses', 'post_dispatch_responses')
 
@@ -37,11 +52,42 @@ class MessageSenderMixin(RequestsMixin):
         
         if message_name == "transaction":
             raise InvalidMessageNameException("Cannot use message_name 'transaction'.  Use send_transaction() method for datashop transactions.")
-            
-        response = self._post_data('message', {
+
+        return self._send_message(message_name, payload, callback)
+
+
+    def _send_message(self, message_name, payload, callback=None):
+        """
+        Sends a message and registers callback for its response, answering it from
+        the response cache instead if one is enabled and holds the response.
+
+        Returns: dict - HPIT's acknowledgement of the message. Queries answered from the
+        cache return the message_id of the query first answered with 'cached': True and
+        their callback has already been called, through any 'response' middleware.
+        Queries waiting on an identical query still in flight return its message_id
+        with 'coalesced': True.
+        """
+        cache = self.response_cache
+        key = cache.key(message_name, payload) if cache is not None else None
+
+        if key is not None:
+            entry = cache.lookup(key)
+            if entry is not None:
+                if callback:
+                    self._handle_response(Response(entry[0], entry[1], message_name=message_name, callback=callback))
+                return {'message_id': entry[0], 'cached': True}
+
+            message_id = cache.inflight(key, callback)
+            if message_id is not None:
+                return {'message_id': message_id, 'coalesced': True}
+
+        response = self._response_data(self._post_data('message', {
             'name': message_name,
             'payload': payload
-        }).json()
+        }))
+
+        if key is not None:
+            callback = cache.sent(key, response['message_id'], callback)
 
         if callback:
             self.response_callbacks[response['message_id']] = callback
@@ -55,9 +101,9 @@ class MessageSenderMixin(RequestsMixin):
         See send() method for more details.
         """
         
-        response = self._post_data('transaction', {
+        response = self._response_data(self._post_data('transaction', {
             'payload': payload
-        }).json()
+        }))
 
         if callback:
             self.response_callbacks[response['message_id']] = callback
@@ -65,6 +111,185 @@ class MessageSenderMixin(RequestsMixin):
         return response
         
 
+    def start_recording(self, path):
+        """
+        Start capturing everything polled from HPIT into the append-only file at path.
+        The recording can be fed back through this client's handlers offline with
+        a TrafficReplayer.
+        """
+        self.stop_recording()
+        self.recorder = TrafficRecorder(path)
+
+
+    def stop_recording(self):
+        """
+        Stop capturing polled traffic and close the recording file.
+        """
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+
+
+    def enable_deduplication(self, window=600, max_size=100000):
+        """
+        Only dispatch each response once, even if HPIT delivers it more than once
+        after a reconnect or retry. Responses are remembered for window seconds, up
+        to max_size of them.
+        """
+        self.response_deduplicator = MessageDeduplicator(window, max_size)
+
+
+    def disable_deduplication(self):
+        self.response_deduplicator = None
+
+
+    def enable_metadata_cache(self, ttl=300, negative_ttl=60, max_size=1024, background_refresh=False):
+        """
+        Cache the results of metadata lookups such as get_message_owner() and
+        list_subscriptions() so they don't hit HPIT on every call.
+
+        Input:
+            ttl - How long in seconds a successful lookup is cached.
+            negative_ttl - How long in seconds a lookup that found nothing is cached.
+            max_size - The most lookups to hold before evicting the least recently used.
+            background_refresh - If True, entries near the end of their ttl are
+            refreshed on a background thread, through a session of its own, while
+            the cached value is returned.
+        """
+        refresh_ahead = 0.8 if background_refresh else None
+        self.metadata_cache = TTLCache(ttl, negative_ttl, max_size, refresh_ahead, self._own_session)
+
+
+    def disable_metadata_cache(self):
+        self.metadata_cache = None
+
+
+    def invalidate_metadata(self, *keys):
+        """
+        Drop cached metadata lookups so they are fetched from HPIT again. Keys are
+        tuples such as ('message-owner', message_name) or ('subscriptions',). With
+        no keys every cached lookup is dropped.
+        """
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(*keys)
+
+
+    def enable_response_cache(self, ttls=None, max_size=1024, inflight_timeout=30, **kwargs):
+        """
+        Answer repeated read-only queries sent with send() or send_blocking() from a
+        cache of earlier responses, instead of sending them through HPIT again. Only
+        the message names given a ttl are cached, since only plugins that answer the
+        same query the same way each time can be cached safely.
+
+        Input:
+            ttls - A dictionary of message name to how long in seconds its responses
+            are cached. Can also be given as keyword arguments.
+            max_size - The most responses to hold before evicting the least recently used.
+            inflight_timeout - How long in seconds an identical query waits on one
+            that is still in flight, rather than being sent itself.
+
+        Throws:
+            InvalidParametersError - A ttl or max_size is not positive.
+        """
+        ttls = dict(ttls or {}, **kwargs)
+        self.response_cache = ResponseCache(ttls, max_size, inflight_timeout)
+
+
+    def disable_response_cache(self):
+        self.response_cache = None
+
+
+    def invalidate_responses(self, message_name=None, payload=None):
+        """
+        Drop cached responses so the queries are sent to HPIT again: the response to
+        message_name with payload, every response to message_name if payload is None,
+        or every response if message_name is None.
+        """
+        if self.response_cache is not None:
+            self.response_cache.invalidate(message_name, payload)
+
+
+    def response_cache_stats(self):
+        """
+        Returns: dict - See ResponseCache.stats().
+        """
+        if self.response_cache is None:
+            return {}
+
+        return self.response_cache.stats()
+
+
+    def _get_metadata(self, key, loader):
+        """
+        Run loader, a blocking metadata lookup, through the metadata cache if
+        one is enabled.
+        """
+        if self.metadata_cache is None:
+            return loader()
+
+        return self.metadata_cache.get_or_load(key, loader)
+
+
+    def _install_sigterm_handler(self):
+        """
+        Make SIGTERM stop the event loop the same way stop() does, so the process
+        shuts down gracefully. Signal handlers can only be installed from the main
+        thread; elsewhere this does nothing.
+
+        Returns: The previous SIGTERM handler, to be restored afterwards.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return None
+
+        return signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+
+    def _restore_sigterm_handler(self, previous):
+        if previous is not None:
+            signal.signal(signal.SIGTERM, previous)
+
+
+    def set_poll_limits(self, messages=None, transactions=None, responses=None):
+        """
+        Ask HPIT for at most this many messages, transactions or responses per poll,
+        so the time and memory each poll takes is bounded. None leaves that kind
+        unbounded. Messages and transactions only apply to plugins.
+
+        A poll that comes back full probably left more waiting, so the event loop
+        polls again straight away instead of waiting poll_wait.
+
+        Throws:
+            InvalidParametersError - A limit is less than 1.
+        """
+        limits = {'messages': messages, 'transactions': transactions, 'responses': responses}
+
+        for kind, limit in limits.items():
+            if limit is not None and limit < 1:
+                raise InvalidParametersError('The ' + kind + ' poll limit must be at least 1')
+
+        self.poll_limits = {kind: limit for kind, limit in limits.items() if limit is not None}
+
+
+    def _poll_url(self, url, kind):
+        """
+        Returns: string - url with the poll limit for kind added, if it has one.
+        """
+        limit = self.poll_limits.get(kind)
+        if limit is None:
+            return url
+
+        return url + '?' + urlencode({'limit': limit})
+
+
+    def _check_page(self, kind, count):
+        """
+        Note that a poll of kind returned count items. A full page sets
+        self.poll_saturated so the event loop polls again without waiting.
+        """
+        limit = self.poll_limits.get(kind)
+        if limit is not None and count >= limit:
+            self.poll_saturated = True
+
 
     def _poll_responses(self):
         """
@@ -82,7 +307,11 @@ class MessageSenderMixin(RequestsMixin):
         if not self._try_hook('pre_poll_responses'):
             return False
 
-        responses = self._get_data('response/list')['responses']
+        responses = self._get_data(self._poll_url('response/list', 'responses'))['responses']
+        self._check_page('responses', len(responses))
+
+        if self.recorder:
+            self.recorder.record('responses', responses)
 
         if not self._try_hook('post_poll_responses'):
             return False
@@ -120,21 +349,64 @@ class MessageSenderMixin(RequestsMixin):
                 self.send_log_entry('Invalid response from HPIT. No response payload supplied.')
                 continue
 
-            if message_id not in self.response_callbacks:
-                self.send_log_entry('No callback registered for message id: ' + message_id)
-                continue
-
-            if not callable(self.response_callbacks[message_id]):
-                self.send_log_entry("Callback registered for transcation id: " + message_id + " is not a callable.")
-                continue
-                
-            self.response_callbacks[message_id](response_payload)
+            self._handle_response(Response(message_id, response_payload,
+                res['message'].get('receiver_entity_id'), res['message'].get('message_name')))
 
         if not self._try_hook('post_dispatch_responses'):
             return False
 
         return True
 
+    def _handle_response(self, response):
+        """
+        Deduplicate a Response and pass it through any 'response' middleware to its callback.
+        """
+        #Answers from the response cache are handed out once per query, so only
+        #responses HPIT may have delivered twice are checked
+        deduplicate = self.response_deduplicator is not None and response.callback is None
+        key = (response.message_id, response.receiver_entity_id)
+
+        if deduplicate and not self.response_deduplicator.check(key):
+            return
+
+        handler = self.middleware.handler('response') if self.middleware is not None else None
+
+        try:
+            if handler is not None:
+                handler(response)
+            else:
+                self._deliver_response(response)
+        except Exception:
+            #Handle the response again if HPIT redelivers it
+            if deduplicate:
+                self.response_deduplicator.forget(key)
+            raise
+
+    def _deliver_response(self, response):
+        """
+        Hand a Response to the callback registered when its message was sent.
+        """
+        if response.callback is not None:
+            return response.callback(response.payload)
+
+        message_id = response.message_id
+
+        if message_id not in self.response_callbacks:
+            self.send_log_entry('No callback registered for message id: ' + message_id)
+            return
+
+        if not callable(self.response_callbacks[message_id]):
+            self.send_log_entry("Callback registered for transcation id: " + message_id + " is not a callable.")
+            return
+
+        return self.response_callbacks[message_id](response.payload)
+
+
+    def _middleware_terminals(self):
+        terminals = super()._middleware_terminals()
+        terminals['response'] = self._deliver_response
+        return terminals
+
     #Plugin or Tutor can query Message Owner
     def get_message_owner(self, message_name):
         """
@@ -155,12 +427,15 @@ class MessageSenderMixin(RequestsMixin):
         if not isinstance(message_name, str):
             raise InvalidParametersError('message_name must be a string')
 
-        try:
-            response = self._get_data('/'.join(['message-owner', message_name]))
-        except ResourceNotFoundError:
-            return None
+        def load_owner():
+            try:
+                response = self._get_data('/'.join(['message-owner', message_name]))
+            except ResourceNotFoundError:
+                return None
+
+            return response['owner']
 
-        return response['owner']
+        return self._get_metadata(('message-owner', message_name), load_owner)
 
         
     #Plugin or Tutor can be Resource Owner
@@ -0,0 +1,215 @@
+import time
+import threading
+
+from .exceptions import InvalidParametersError
+
+#Requests posted to HPIT, messages dispatched to plugin callbacks and responses
+#dispatched to response callbacks
+PHASES = ('request', 'message', 'response')
+
+#The name stats() reports the client's own handling under
+TERMINAL = 'handler'
+
+
+class OutboundRequest:
+    """
+    A request about to be posted to HPIT, as handed to 'request' middleware.
+    Middleware can change url or data before passing it on.
+    """
+    __slots__ = ('url', 'data', 'retry')
+
+    def __init__(self, url, data=None, retry=True):
+        self.url = url
+        self.data = data
+        self.retry = retry
+
+
+    def __repr__(self):
+        return 'OutboundRequest(' + repr(self.url) + ', ' + repr(self.data) + ')'
+
+
+def middleware_name(middleware):
+    return getattr(middleware, '__name__', type(middleware).__name__)
+
+
+class MiddlewarePipeline:
+    """
+    Chains of middleware wrapped around the client's send and dispatch paths.
+
+    A middleware is a factory: it is called with the next handler in its chain
+    and returns a handler that takes one argument, an OutboundRequest for the
+    'request' phase, the polled message for 'message' (a dictionary holding the
+    message_name, message_id, sender_entity_id and time_created, and the payload
+    under 'message') and a Response for 'response'. The
+    handler can pass the argument on unchanged, transform it or replace it
+    before calling the next handler, or return without calling it at all to
+    short-circuit the rest of the chain. A replacement must have the same shape
+    as what it replaces; a message must still be a dictionary with
+    'message_name' and 'message' keys. Whatever the chain returns is returned
+    to the caller; for 'request' that is the requests.Response from HPIT.
+
+        def log_requests(next_handler):
+            def handler(request):
+                print('POST', request.url)
+                return next_handler(request)
+            return handler
+
+    Middleware added first runs first. Chains are compiled into nested handlers
+    once, when the client connects or the first time they are used after they
+    change, so there is no lookup per message. Phases without middleware
+    compile to None and the client skips them entirely.
+
+    When timed, every stage records how often it ran and the time spent in it.
+    Requests can be posted from several threads at once, so the counters are
+    updated under a lock.
+    """
+    def __init__(self, terminals, timed=True):
+        """
+        Input:
+            terminals - A dictionary of phase to the client's own handler for it,
+            which ends the chain.
+            timed - Record per-stage timings.
+        """
+        self.terminals = terminals
+        self.timed = timed
+        self.stages = {phase: [] for phase in terminals}
+        self._handlers = None
+        self._timings = {}
+        self._timings_lock = threading.Lock()
+
+
+    def add(self, phase, middleware, name=None):
+        """
+        Add middleware to the end of phase's chain. Middleware added under a name
+        already in the chain replaces it in place.
+
+        Throws:
+            InvalidParametersError - phase is unknown to this client or middleware isn't callable.
+        """
+        if phase not in PHASES:
+            raise InvalidParametersError('Unknown middleware phase: ' + str(phase))
+
+        if phase not in self.terminals:
+            raise InvalidParametersError('This client has no ' + phase + ' phase')
+
+        if not callable(middleware):
+            raise InvalidParametersError('middleware must be a callable')
+
+        if name is None:
+            name = middleware_name(middleware)
+
+        stages = self.stages[phase]
+        for index, (existing, _) in enumerate(stages):
+            if existing == name:
+                stages[index] = (name, middleware)
+                break
+        else:
+            stages.append((name, middleware))
+
+        self._handlers = None
+
+
+    def remove(self, phase, name=None):
+        """
+        Remove the middleware called name from phase, or all of phase's middleware
+        if name is None.
+        """
+        stages = self.stages.get(phase, [])
+        stages[:] = [stage for stage in stages if name is not None and stage[0] != name]
+
+        self._handlers = None
+
+
+    def compile(self):
+        """
+        Build the handler for every phase. Middleware factories are called again
+        each time the pipeline is compiled.
+        """
+        handlers = {}
+        timings = {}
+
+        for phase, terminal in self.terminals.items():
+            stages = self.stages[phase]
+            if not stages:
+                handlers[phase] = None
+                continue
+
+            phase_timings = [(TERMINAL, [0, 0.0, 0.0])]
+            handler = self._time(terminal, phase_timings[0][1])
+
+            for name, middleware in reversed(stages):
+                counters = [0, 0.0, 0.0]
+                phase_timings.append((name, counters))
+                handler = self._time(middleware(handler), counters)
+
+            handlers[phase] = handler
+            if self.timed:
+                timings[phase] = list(reversed(phase_timings))
+
+        self._handlers = handlers
+        self._timings = timings
+
+
+    def handler(self, phase):
+        """
+        Returns: callable - The compiled chain for phase, or None if it has no middleware.
+        """
+        if self._handlers is None:
+            self.compile()
+
+        return self._handlers.get(phase)
+
+
+    def stats(self):
+        """
+        Returns: dict - For each phase with middleware, the stages in the order they
+        run followed by 'handler', the client's own handling. Each gives how many
+        times it ran, its total and longest run in seconds including the stages
+        after it, and self_time, the time spent in the stage itself. Empty unless
+        the pipeline is timed.
+        """
+        result = {}
+
+        with self._timings_lock:
+            for phase, phase_timings in self._timings.items():
+                stages = result[phase] = {}
+
+                for index, (name, (calls, total, longest)) in enumerate(phase_timings):
+                    inner = phase_timings[index + 1][1][1] if index + 1 < len(phase_timings) else 0.0
+                    stages[name] = {
+                        'calls': calls,
+                        'total_time': total,
+                        'self_time': max(total - inner, 0.0),
+                        'max_time': longest,
+                    }
+
+        return result
+
+
+    def reset_stats(self):
+        with self._timings_lock:
+            for phase_timings in self._timings.values():
+                for _, counters in phase_timings:
+                    counters[:] = [0, 0.0, 0.0]
+
+
+    def _time(self, handler, counters):
+        if not self.timed:
+            return handler
+
+        perf_counter = time.perf_counter
+        lock = self._timings_lock
+
+        def timed(value):
+            start = perf_counter()
+            try:
+                return handler(value)
+            finally:
+                elapsed = perf_counter() - start
+                with lock:
+                    counters[0] += 1
+                    counters[1] += elapsed
+                    if elapsed > counters[2]:
+                        counters[2] = elapsed
+
+        return timed
@@ -1,6 +1,15 @@
 import time
+import itertools
+from collections import deque
 
 from .message_sender_mixin import MessageSenderMixin
+from .message import Message
+from .dedup import MessageDeduplicator
+from .router import MessageRouter, NO_ROUTE, validate_callback
+from .batching import MessageBatcher
+from .flow_control import FlowController
+from .shedding import LoadShedder
+from .priority_queue import PriorityDispatchQueue
 from .exceptions import PluginPollError, BadCallbackException
 from .exceptions import AuthenticationError, InvalidParametersError, AuthorizationError
 
@@ -13,11 +22,27 @@ class Plugin(MessageSenderMixin):
         self.run_loop = True
         self.entity_id = str(entity_id)
         self.api_key = str(api_key)
-        self.wildcard_callback = wildcard_callback
         self.transaction_callback = None
-        self.callbacks = {}
+        self.transaction_batcher = None
+        self.callbacks = MessageRouter()
+        self.batchers = {}
+
+        if wildcard_callback is not None:
+            validate_callback(wildcard_callback)
+        self.wildcard_callback = wildcard_callback
+        self.message_deduplicator = None
+        self.message_backlog = deque()
+        self.max_dispatch_per_tick = None
+        self.flow_controller = None
+        self.load_shedder = None
+        self.stream_batch_size = None
+        #Messages and transactions handed off to be handled elsewhere, such as PreforkRunner's workers
+        self.handoff_depth = 0
+        self._message_stream = None
+        self._stream_count = 0
 
         self.poll_wait = 100
+        self.drain_timeout = 30
         self.time_last_poll = time.time() * 1000
 
         self._add_hooks(
@@ -30,6 +55,125 @@ class Plugin(MessageSenderMixin):
         pass
 
 
+    def enable_deduplication(self, window=600, max_size=100000):
+        """
+        Only dispatch each message, transaction and response once, even if HPIT
+        delivers it more than once after a reconnect or retry. Ids are remembered
+        for window seconds, up to max_size of them.
+        """
+        super().enable_deduplication(window, max_size)
+        self.message_deduplicator = MessageDeduplicator(window, max_size)
+
+
+    def disable_deduplication(self):
+        super().disable_deduplication()
+        self.message_deduplicator = None
+
+
+    def enable_flow_control(self, high_water, low_water=None, max_dispatch_per_tick=None):
+        """
+        Stop polling HPIT for messages and transactions while the backlog of polled
+        but unhandled messages is at or above high_water, and resume once it has
+        drained to low_water (half of high_water by default).
+
+        max_dispatch_per_tick limits how many backlogged messages are dispatched on
+        each pass of the event loop. None dispatches the whole backlog every pass.
+        """
+        self.flow_controller = FlowController(high_water, low_water)
+        self.max_dispatch_per_tick = max_dispatch_per_tick
+
+
+    def disable_flow_control(self):
+        self.flow_controller = None
+        self.max_dispatch_per_tick = None
+
+
+    def enable_streaming(self, batch_size=1000, chunk_size=65536):
+        """
+        Decode polled messages and transactions while the poll's response is still
+        arriving, instead of reading the whole response into memory first. Useful
+        when a plugin reconnects to a very large backlog.
+
+        Messages are taken off the open response at most batch_size per pass of
+        the event loop, and no further than the flow control high water mark, so
+        dispatch starts straight away and the backlog held in memory stays
+        bounded. The response is kept open across passes until it is exhausted.
+        Transactions are handed to their callbacks as they are decoded.
+        """
+        if batch_size < 1:
+            raise InvalidParametersError('batch_size must be at least 1')
+
+        self.stream_batch_size = batch_size
+        self.stream_chunk_size = chunk_size
+
+
+    def disable_streaming(self):
+        self.stream_batch_size = None
+        self._close_message_stream()
+
+
+    @property
+    def backlog_depth(self):
+        """
+        The number of polled messages and transactions that have not reached their
+        callbacks yet, including those held for batch callbacks and those handed
+        off to be handled elsewhere, such as PreforkRunner's workers.
+        """
+        depth = len(self.message_backlog) + sum(len(batcher) for batcher in self.batchers.values())
+        depth += self.handoff_depth
+
+        if self.transaction_batcher is not None:
+            depth += len(self.transaction_batcher)
+
+        return depth
+
+
+    def set_priorities(self, priorities=None, starvation_timeout=5.0, **kwargs):
+        """
+        Dispatch backlogged messages by priority instead of in arrival order. Messages
+        with higher priorities are dispatched first, both within a single poll and
+        from the backlog left by flow control. Names without a priority get 0.
+
+        Input:
+            priorities - A dictionary of message names to priorities. Keyword
+            arguments are accepted as well.
+            starvation_timeout - Messages that have waited longer than this many
+            seconds are dispatched ahead of higher priority ones. None disables this.
+
+        Transactions are handled separately from messages and are not reordered.
+        """
+        priorities = dict(priorities or {}, **kwargs)
+
+        if isinstance(self.message_backlog, PriorityDispatchQueue):
+            self.message_backlog.set_priorities(priorities)
+            self.message_backlog.starvation_timeout = starvation_timeout
+            return
+
+        backlog = PriorityDispatchQueue(priorities, starvation_timeout=starvation_timeout)
+        backlog.extend(self.message_backlog)
+        self.message_backlog = backlog
+
+
+    def set_max_age(self, message_name, max_age, expired_response=None):
+        """
+        Shed messages named message_name that are more than max_age seconds old by
+        the time they would be dispatched, instead of passing them to their callback.
+        This keeps a backlogged plugin from spending time on messages whose senders
+        have long since given up waiting.
+
+        Input:
+            message_name - The message name the policy applies to.
+            max_age - The age in seconds, measured from time_created, past which the
+            message is shed. None removes the policy.
+            expired_response - If given, this payload is sent back as the response to
+            each shed message, eg. {'error': 'expired'}.
+        """
+        if self.load_shedder is None:
+            self.load_shedder = LoadShedder()
+
+        self.load_shedder.set_policy(message_name, max_age, expired_response)
+
+
     def register_transaction_callback(self,callback):
         """
         Set a callback for transactions and start listening for them.
@@ -37,22 +181,80 @@ class Plugin(MessageSenderMixin):
         if not hasattr(callback,"__call__"):
             raise BadCallbackException("The callback submitted is not callable.")
         self._post_data('plugin/subscribe', {'message_name' : "transaction"})
+        self.invalidate_metadata(('subscriptions',))
         self.transaction_callback = callback
         
         
+    def register_transaction_batch_callback(self, callback, max_batch_size=None, max_wait=0):
+        """
+        Set a batch callback for transactions and start listening for them. The
+        callback receives a list of transaction payloads, batched the same way as
+        subscribe_batch(), so sinks can write them in bulk.
+        """
+        validate_callback(callback)
+        batcher = MessageBatcher(callback, max_batch_size, max_wait)
+
+        self._post_data('plugin/subscribe', {'message_name' : "transaction"})
+        self.invalidate_metadata(('subscriptions',))
+        self.transaction_batcher = batcher
+
+
     def clear_transaction_callback(self):
         """
-        Clear the callback for transactions and stop listening for them.
+        Clear the callbacks for transactions and stop listening for them. Any
+        transactions held for the batch callback are delivered first.
         """
         self._post_data('plugin/unsubscribe', {'message_name': "transaction"})
+        self.invalidate_metadata(('subscriptions',))
         self.transaction_callback = None
-        
+
+        if self.transaction_batcher is not None:
+            self.transaction_batcher.flush(force=True)
+            self.transaction_batcher = None
+
+
+    def iter_transactions(self, batch_size=None):
+        """
+        Generator that yields datashop transaction payloads as they are polled from
+        HPIT, for use instead of a transaction callback.
+
+        HPIT is only polled once the transactions from the previous poll have been
+        consumed, and no more often than every self.poll_wait milliseconds, so a slow
+        consumer never has more than one poll of transactions waiting in memory.
+        The generator stops when the plugin is stopped.
+
+        Input:
+            batch_size - If set, lists of up to batch_size payloads are yielded
+            instead of one payload at a time.
+        """
+        self._post_data('plugin/subscribe', {'message_name' : "transaction"})
+        self.invalidate_metadata(('subscriptions',))
+
+        pending = deque()
+        time_last_poll = 0
+
+        while self.run_loop:
+            if not pending:
+                wait = (time_last_poll + self.poll_wait - time.time() * 1000) / 1000
+                if wait > 0:
+                    time.sleep(wait)
+
+                time_last_poll = time.time() * 1000
+                pending.extend(self._transaction_payloads(self._poll_transactions()))
+                continue
+
+            if batch_size:
+                yield [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+            else:
+                yield pending.popleft()
+
 
     def list_subscriptions(self):
         """
         Polls the HPIT server for a list of message names we currently subscribing to.
         """
-        subscriptions = self._get_data('plugin/subscription/list')['subscriptions']
+        subscriptions = self._get_metadata(('subscriptions',),
+            lambda: self._get_data('plugin/subscription/list')['subscriptions'])
 
         for sub in subscriptions:
             if sub not in self.callbacks:
@@ -61,25 +263,148 @@ class Plugin(MessageSenderMixin):
         return self.callbacks
 
 
-    def subscribe(self, messages):
+    def subscribe(self, messages=None, **kwargs):
         """
         Subscribe to messages, each argument is exepcted as a key value pair where
-        the key is the message's name and the value is the callback function.
+        the key is the message's name and the value is the callback function. Messages
+        can be passed as a dictionary, as keyword arguments or both. The subscription
+        requests are sent to HPIT concurrently. If some of them fail, the others still
+        take effect before the first error is raised.
         """
-        for message_name, callback in messages.items():
-            self._post_data('plugin/subscribe', {'message_name' : message_name})
-            self.callbacks[message_name] = callback
-            
+        messages = dict(messages or {}, **kwargs)
+        for callback in messages.values():
+            validate_callback(callback)
+
+        results = self._post_many('plugin/subscribe', [{'message_name': name} for name in messages], return_exceptions=True)
+        self.callbacks.update({name: callback for (name, callback), result in zip(messages.items(), results) if not isinstance(result, Exception)})
+
+        self.invalidate_metadata(('subscriptions',))
+        self._raise_first_error(results)
+
 
     def unsubscribe(self, *message_names):
         """
         Unsubscribe from messages. Pass each message name as a separate parameter.
+        The unsubscribe requests are sent to HPIT concurrently. If some of them fail,
+        the others still take effect before the first error is raised.
+        """
+        message_names = [name for name in message_names if name in self.callbacks]
+
+        results = self._post_many('plugin/unsubscribe', [{'message_name': name} for name in message_names], return_exceptions=True)
+        for message_name, result in zip(message_names, results):
+            if isinstance(result, Exception):
+                continue
+
+            del self.callbacks[message_name]
+
+            if message_name in self.batchers:
+                self.batchers.pop(message_name).flush(force=True)
+
+        self.invalidate_metadata(('subscriptions',))
+        self._raise_first_error(results)
+
+
+    def subscribe_batch(self, messages=None, max_batch_size=None, max_wait=0, **kwargs):
+        """
+        Subscribe to messages with batch callbacks. Like subscribe(), but each callback
+        receives a list of payloads instead of one payload at a time.
+
+        Input:
+            messages - A dictionary of message names to batch callbacks. Keyword
+            arguments are accepted as well.
+            max_batch_size - The most payloads passed to a callback at once. None
+            means no limit.
+            max_wait - How long in seconds payloads may be held across polls to build
+            up a larger batch. With 0, every poll's payloads are delivered at the end
+            of that poll.
         """
-        for message_name in message_names:
-            if message_name in self.callbacks:
-                self._post_data('plugin/unsubscribe', {'message_name': message_name})
+        messages = dict(messages or {}, **kwargs)
+        for callback in messages.values():
+            validate_callback(callback)
+
+        batchers = {name: MessageBatcher(callback, max_batch_size, max_wait) for name, callback in messages.items()}
+
+        try:
+            self.subscribe({name: batcher.add for name, batcher in batchers.items()})
+        finally:
+            self.batchers.update({name: batcher for name, batcher in batchers.items() if self.callbacks.get(name) == batcher.add})
+
+
+    def flush_batches(self, force=False):
+        """
+        Deliver any accumulated message and transaction batches that are due to their
+        batch callbacks. With force, everything accumulated is delivered now.
+
+        Returns: int - The number of payloads delivered.
+        """
+        delivered = sum(batcher.flush(force) for batcher in list(self.batchers.values()))
+
+        if self.transaction_batcher is not None:
+            delivered += self.transaction_batcher.flush(force)
+
+        return delivered
+
+
+    def subscribe_pattern(self, pattern, callback, priority=0):
+        """
+        Route messages whose names match the glob pattern (eg. 'kt_*') to callback.
+        Patterns are resolved locally and are not sent to HPIT, so the matching
+        messages must still reach this plugin through a subscription by name or by
+        being shared with it. A callback subscribed to the exact message name always
+        wins over a pattern, and higher priority patterns win over lower ones.
+        """
+        self.callbacks.add_pattern(pattern, callback, priority)
+
+
+    def unsubscribe_pattern(self, pattern):
+        """
+        Stop routing messages that match pattern.
+        """
+        self.callbacks.remove_pattern(pattern)
+
+
+    def sync_subscriptions(self, desired):
+        """
+        Make this plugin's subscriptions on HPIT match desired, a dictionary of
+        message names to callbacks. HPIT is asked for the current subscriptions once,
+        and only the message names that differ are subscribed or unsubscribed.
+        Transaction subscriptions are managed separately with
+        register_transaction_callback() and are left untouched.
+
+        Returns: dict - The message names that were 'subscribed' and 'unsubscribed'.
+        """
+        for callback in desired.values():
+            validate_callback(callback)
+
+        self.invalidate_metadata(('subscriptions',))
+        current = set(self._get_data('plugin/subscription/list')['subscriptions'])
+        current.discard('transaction')
+
+        to_subscribe = [name for name in desired if name not in current and name != 'transaction']
+        to_unsubscribe = [name for name in current if name not in desired]
+
+        subscribe_results = self._post_many('plugin/subscribe', [{'message_name': name} for name in to_subscribe], return_exceptions=True)
+        unsubscribe_results = self._post_many('plugin/unsubscribe', [{'message_name': name} for name in to_unsubscribe], return_exceptions=True)
+
+        #Leave the callbacks of subscriptions that couldn't be changed as they were
+        failed = set(name for name, result in zip(to_subscribe, subscribe_results) if isinstance(result, Exception))
+        failed.update(name for name, result in zip(to_unsubscribe, unsubscribe_results) if isinstance(result, Exception))
+
+        for message_name in list(self.callbacks):
+            if message_name not in desired and message_name not in failed:
                 del self.callbacks[message_name]
 
+                if message_name in self.batchers:
+                    self.batchers.pop(message_name).flush(force=True)
+        self.callbacks.update({name: callback for name, callback in desired.items() if name not in failed})
+
+        self._raise_first_error(subscribe_results + unsubscribe_results)
+
+        return {
+            'subscribed': to_subscribe,
+            'unsubscribed': to_unsubscribe,
+        }
+
 
     #Plugin Only
     def share_message(self, message_name, other_entity_ids):
@@ -156,8 +481,9 @@ class Plugin(MessageSenderMixin):
             'owner_id': owner_id
         })
 
-        if 'resource_id' in response.json():
-            return response.json()['resource_id']
+        data = self._response_data(response)
+        if 'resource_id' in data:
+            return data['resource_id']
 
         return False
 
@@ -165,32 +491,138 @@ class Plugin(MessageSenderMixin):
     def _poll(self):
         """
         Get a list of new messages from the server for messages we are listening 
-        to.
+        to. When streaming, this is the next batch from the open message stream.
         """
-        return self._get_data('plugin/message/list')['messages']
+        if self.stream_batch_size:
+            if self._message_stream is None:
+                self._message_stream = self._get_stream(self._poll_url('plugin/message/list', 'messages'), 'messages')
+            messages = self._read_message_stream()
+        else:
+            messages = self._get_data(self._poll_url('plugin/message/list', 'messages'))['messages']
+            self._check_page('messages', len(messages))
+
+        if self.recorder:
+            self.recorder.record('messages', messages)
 
+        return messages
 
-    def _handle_transactions(self):
+
+    def _poll_transactions(self):
         """
-        Get a list of datashop transactions from the server. 
+        Get a list of datashop transactions from the server. When streaming, this
+        is a generator over them instead.
         """
+        if self.stream_batch_size:
+            transactions = self._get_stream(self._poll_url('plugin/transaction/list', 'transactions'), 'transactions')
+            return self._record_stream('transactions', self._count_page('transactions', transactions))
 
-        transaction_data = self._get_data('plugin/transaction/list')['transactions']
+        transactions = self._get_data(self._poll_url('plugin/transaction/list', 'transactions'))['transactions']
+        self._check_page('transactions', len(transactions))
 
-        for item in transaction_data:
-            payload = item["message"]
-            
-            #Inject the message_id into the payload
-            payload['message_id'] = item['message_id']
-            payload['sender_entity_id'] = item['sender_entity_id']
-            payload['time_created'] = item['time_created']
-            
+        if self.recorder:
+            self.recorder.record('transactions', transactions)
+
+        return transactions
+
+
+    def _read_message_stream(self):
+        """
+        Take up to self.stream_batch_size messages off the open message stream,
+        without filling the backlog past the flow control high water mark. The
+        stream is closed once it runs out.
+
+        Returns: list - The messages read.
+        """
+        limit = self.stream_batch_size
+        if self.flow_controller is not None:
+            limit = max(0, min(limit, self.flow_controller.high_water - self.backlog_depth))
+
+        messages = list(itertools.islice(self._message_stream, limit))
+
+        if len(messages) < limit:
+            self._close_message_stream()
+            self._check_page('messages', self._stream_count + len(messages))
+        elif messages:
+            #More are waiting on the open stream
+            self._stream_count += len(messages)
+            self.poll_saturated = True
+
+        return messages
+
+
+    def _close_message_stream(self):
+        if self._message_stream is not None:
+            self._message_stream.close()
+            self._message_stream = None
+
+        self._stream_count = 0
+
+
+    def _count_page(self, kind, items):
+        """
+        Generator passing streamed items through, checking whether they filled a
+        page once they run out.
+        """
+        count = 0
+        for item in items:
+            count += 1
+            yield item
+
+        self._check_page(kind, count)
+
+
+    def _record_stream(self, kind, items):
+        """
+        Generator passing items through, recording them stream_batch_size at a time.
+        """
+        if not self.recorder:
+            yield from items
+            return
+
+        for batch in iter(lambda: list(itertools.islice(items, self.stream_batch_size)), []):
+            self.recorder.record(kind, batch)
+            yield from batch
+
+
+    def _handle_transactions(self, transaction_data=None):
+        """
+        Route datashop transactions to the transaction callback. If no transactions
+        are given they are polled from the server.
+        """
+        if transaction_data is None:
+            transaction_data = self._poll_transactions()
+
+        for payload in self._transaction_payloads(transaction_data):
             if self.transaction_callback:
-                self.transaction_callback(payload)
+                try:
+                    self.transaction_callback(payload)
+                except Exception:
+                    #Handle the transaction again if HPIT redelivers it
+                    if self.message_deduplicator is not None:
+                        self.message_deduplicator.forget(payload.message_id)
+                    raise
+
+            if self.transaction_batcher is not None:
+                self.transaction_batcher.add(payload)
+
+        if self.transaction_batcher is not None:
+            self.transaction_batcher.flush()
 
         return True
 
 
+    def _transaction_payloads(self, transaction_data):
+        """
+        Generator over polled transactions as Message objects. Transactions already
+        seen by the deduplicator are skipped.
+        """
+        for item in transaction_data:
+            if self.message_deduplicator is not None and not self.message_deduplicator.check(item['message_id']):
+                continue
+
+            yield Message.from_item(item)
+
+
     def _dispatch(self, message_data):
         """
         For each message recieved route it to the appropriate callback.
@@ -198,30 +630,34 @@ class Plugin(MessageSenderMixin):
         if not self._try_hook('pre_dispatch_messages'):
             return False
 
+        handler = self.middleware.handler('message') if self.middleware is not None else None
+
         for message_item in message_data:
+            if self.message_deduplicator is not None and not self.message_deduplicator.check(message_item['message_id']):
+                continue
+
             message = message_item['message_name']
-            payload = message_item['message']
 
-            #Inject the message_id into the payload
-            payload['message_id'] = message_item['message_id']
-            payload['sender_entity_id'] = message_item['sender_entity_id']
-            payload['time_created'] = message_item['time_created']
+            if self.load_shedder is not None:
+                shed, expired_response = self.load_shedder.check(message, message_item['time_created'])
+                if shed:
+                    if expired_response is not None:
+                        self.send_response(message_item['message_id'], expired_response)
+                    continue
 
             try:
-                self.callbacks[message](payload)
-            except KeyError:
-                #No callback registered try the wildcard
-                if self.wildcard_callback:
-                    try:
-                        self.wildcard_callback(payload)
-                    except TypeError:
-                        raise PluginPollError("Wildcard Callback is not a callable")
-            except TypeError as e:
-                #Callback isn't a function
-                if self.callbacks[message] is None:
-                    raise PluginPollError("No callback registered for message: <" + message + ">")
+                if handler is not None:
+                    handler(message_item)
                 else:
-                    raise e
+                    self._route_message(message_item)
+            except Exception:
+                #Handle the message again if HPIT redelivers it
+                if self.message_deduplicator is not None:
+                    self.message_deduplicator.forget(message_item['message_id'])
+                raise
+
+        if self.batchers:
+            self.flush_batches()
 
         if not self._try_hook('post_dispatch_messages'):
             return False
@@ -229,6 +665,36 @@ class Plugin(MessageSenderMixin):
         return True
 
 
+    def _route_message(self, message_item):
+        """
+        Hand a polled message, as a Message, to the callback subscribed to its name,
+        or to the wildcard callback.
+        """
+        message = message_item['message_name']
+        payload = Message.from_item(message_item)
+
+        callback = self.callbacks.resolve(message)
+
+        if callback is NO_ROUTE:
+            #No callback registered try the wildcard
+            if self.wildcard_callback:
+                if not callable(self.wildcard_callback):
+                    raise PluginPollError("Wildcard Callback is not a callable")
+                return self.wildcard_callback(payload)
+            return None
+
+        if callback is None:
+            raise PluginPollError("No callback registered for message: <" + message + ">")
+
+        return callback(payload)
+
+
+    def _middleware_terminals(self):
+        terminals = super()._middleware_terminals()
+        terminals['message'] = self._route_message
+        return terminals
+
+
     def start(self):
         """
         Start the plugin. Connect to the HPIT server. Then being polling and dispatching
@@ -237,37 +703,62 @@ class Plugin(MessageSenderMixin):
         self.connect()
         self.list_subscriptions()
 
+        previous_sigterm = self._install_sigterm_handler()
+
+        try:
+            if not self._run_loop():
+                return False
+        finally:
+            self._restore_sigterm_handler(previous_sigterm)
+
+        self.drain(self.drain_timeout)
+        self.disconnect()
+
+
+    def _run_loop(self):
+        """
+        The plugin's event loop. Runs until the plugin is stopped, a hook returns
+        False or the process is interrupted.
+
+        Returns: boolean - False if dispatching asked the plugin to abort without
+        disconnecting.
+        """
         try:
             while self.run_loop:
 
                 #A better timer
                 cur_time = time.time() * 1000
 
-                if cur_time - self.time_last_poll < self.poll_wait:
+                if cur_time - self.time_last_poll < self.poll_wait and not self.poll_saturated:
                     continue;
 
                 self.time_last_poll = cur_time
+                self.poll_saturated = False
 
                 #Handle messages submitted by tutors
-                if not self._try_hook('pre_poll_messages'):
-                    break;
+                if self._accepting_work():
+                    if not self._try_hook('pre_poll_messages'):
+                        break;
 
-                message_data = self._poll()
+                    message_data = self._poll()
 
-                if not self._try_hook('post_poll_messages'):
-                    break;
+                    if not self._try_hook('post_poll_messages'):
+                        break;
 
-                if not self._dispatch(message_data):
+                    self.message_backlog.extend(message_data)
+
+                if not self._dispatch(self._take_backlog()):
                     return False
 
-                if not self._try_hook('pre_handle_transactions'):
-                    break;
+                if self._accepting_work():
+                    if not self._try_hook('pre_handle_transactions'):
+                        break;
 
-                if not self._handle_transactions():
-                    return False
+                    if not self._handle_transactions():
+                        return False
 
-                if not self._try_hook('post_handle_transactions'):
-                    break;
+                    if not self._try_hook('post_handle_transactions'):
+                        break;
 
                 #Handle responses from other plugins
 
@@ -276,16 +767,81 @@ class Plugin(MessageSenderMixin):
                 if not self._dispatch_responses(responses):
                     break;
 
+                self.flush_rate_limited()
+
         except KeyboardInterrupt:
             pass
 
-        self.disconnect()
+        return True
 
 
     def stop(self):
+        """
+        Stop the event loop. Once it exits, the plugin drains its backlog for up to
+        self.drain_timeout seconds, or until it is empty if that is None, and
+        disconnects.
+        """
         self.run_loop = False
 
 
+    def drain(self, timeout=30):
+        """
+        Finish work already polled from HPIT without polling for more. Backlogged
+        messages are dispatched until timeout seconds have passed, or until the
+        backlog is empty if timeout is None, then anything held for batch callbacks
+        is delivered. Requests held by rate limits are sent when
+        the plugin disconnects.
+
+        Returns: int - The number of backlogged messages that could not be dispatched
+        before the timeout. They are dropped.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        while (self.message_backlog or self._message_stream is not None) and (deadline is None or time.time() < deadline):
+            if not self.message_backlog:
+                #HPIT counts the messages left on an open stream as delivered
+                messages = self._poll()
+                if not messages:
+                    break
+                self.message_backlog.extend(messages)
+
+            if not self._dispatch(self._take_backlog()):
+                break
+
+        self._close_message_stream()
+        self.flush_batches(force=True)
+
+        dropped = len(self.message_backlog)
+        if dropped:
+            self.message_backlog.clear()
+            self.send_log_entry('Plugin stopped with ' + str(dropped) + ' undispatched messages.')
+
+        return dropped
+
+
+    def _accepting_work(self):
+        """
+        Returns: boolean - False while flow control has paused polling.
+        """
+        if self.flow_controller is None:
+            return True
+
+        return self.flow_controller.update(self.backlog_depth)
+
+
+    def _take_backlog(self):
+        """
+        Remove and return the messages to dispatch on this pass of the event loop.
+        """
+        backlog = self.message_backlog
+        count = len(backlog)
+
+        if self.max_dispatch_per_tick is not None:
+            count = min(count, self.max_dispatch_per_tick)
+
+        return [backlog.popleft() for _ in range(count)]
+
+
     def send_response(self, message_id, payload):
         """
         Sends a response to HPIT upon handling a specific message.
@@ -297,6 +853,23 @@ class Plugin(MessageSenderMixin):
             'message_id': message_id,
             'payload': payload
         })
+
+
+    def send_responses(self, responses):
+        """
+        Sends many responses at once, typically from a batch callback. The requests
+        are sent to HPIT concurrently.
+
+        Input:
+            responses - A dictionary of message_id to response payload, or a list of
+            (message_id, payload) pairs.
+        """
+        if isinstance(responses, dict):
+            responses = responses.items()
+
+        self._post_many('response', [
+            {'message_id': message_id, 'payload': payload} for message_id, payload in responses
+        ])
         
     def get_shared_messages(self,args):
         shared_messages = None
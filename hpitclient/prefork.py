@@ -0,0 +1,294 @@
+import os
+import zlib
+import signal
+import queue
+import multiprocessing
+
+from .memoize import invalidating_messages, invalidate_memos
+from .exceptions import InvalidParametersError
+
+
+class FunneledResponse:
+    """
+    Returned to a worker's handlers in place of a requests.Response. The real
+    request is sent later by the supervisor, so HPIT's reply isn't available.
+    """
+    status_code = 200
+    text = '{}'
+
+    def json(self):
+        return {'message_id': None}
+
+
+def _worker_main(index, plugin_factory, tasks, results):
+    """
+    Runs in each worker process. Builds a plugin, registers its handlers and
+    dispatches the work the supervisor sends it until told to stop. After each
+    task of messages or transactions it reports how many items it handled, as
+    (None, (index, count)).
+    """
+    #The supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    plugin = plugin_factory()
+
+    #Register handlers locally. The supervisor owns the real subscriptions.
+    plugin._post_data = lambda url, data=None, retry=True: FunneledResponse()
+    plugin.post_connect()
+
+    def funnel(url, data=None, retry=True):
+        results.put((url, data))
+        return FunneledResponse()
+
+    plugin._post_data = funnel
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        kind, items = task
+        if kind == 'invalidate':
+            #Messages handled by another worker that change memoized responses
+            for item in items:
+                invalidate_memos(plugin, item)
+            continue
+
+        if kind == 'messages':
+            plugin._dispatch(items)
+        elif kind == 'transactions':
+            plugin._handle_transactions(items)
+
+        results.put((None, (index, len(items))))
+
+    plugin.flush_batches(force=True)
+
+
+class PreforkRunner:
+    """
+    Runs a plugin with its handlers spread across several worker processes, so
+    a single plugin entity can use more than one core.
+
+    A supervisor process connects to HPIT, polls it and owns the plugin's
+    subscriptions. Polled messages and transactions are handed to worker
+    processes over multiprocessing queues. Each worker builds its own plugin
+    with plugin_factory and calls its post_connect() to register handlers, but
+    never talks to HPIT directly: responses and log entries its handlers send
+    are funneled back and sent by the supervisor. Because of that, handlers
+    running in a worker can't wait on the reply to a request, so send() with a
+    callback and blocking lookups such as get_message_owner() won't work there.
+
+    With sticky routing every message from the same sender_entity_id goes to
+    the same worker, so per-student state can be kept in the worker. Workers
+    that die are restarted; the work they were in the middle of is lost.
+
+    Messages go through the supervising plugin's own dispatch first, so its
+    deduplication, load shedding, priorities and 'message' middleware apply
+    before they are handed to a worker in place of their callback. Items queued
+    for or being handled by a worker count towards the plugin's backlog_depth,
+    so flow control holds off polling while the workers are behind.
+
+    Each worker keeps its own memoize_response caches. A message named in a
+    handler's invalidate_on is handled by one worker as usual, and also passed
+    to every other worker to drop its cached responses.
+    """
+    def __init__(self, plugin_factory, workers=None, sticky=True):
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers < 1:
+            raise InvalidParametersError('workers must be at least 1')
+
+        self.plugin_factory = plugin_factory
+        self.worker_count = workers
+        self.sticky = sticky
+        self.restarts = 0
+        self.plugin = None
+
+        self._context = multiprocessing.get_context()
+        self._results = None
+        self._tasks = []
+        self._workers = []
+        self._shares = []
+        self._invalidations = []
+        self._invalidated_by = set()
+        self._in_flight = []
+        self._next_worker = 0
+        self._stopping = False
+
+
+    def start(self):
+        """
+        Start the workers and run the supervising plugin until it stops.
+        """
+        self.setup()
+        self.plugin.start()
+
+
+    def stop(self):
+        if self.plugin is not None:
+            self.plugin.stop()
+
+
+    def setup(self):
+        """
+        Build the supervising plugin and start the workers without starting the
+        plugin's event loop.
+        """
+        self.plugin = self.plugin_factory()
+        self._results = self._context.Queue()
+        self._tasks = [self._context.Queue() for _ in range(self.worker_count)]
+        self._workers = [self._spawn(index) for index in range(self.worker_count)]
+        self._shares = [[] for _ in range(self.worker_count)]
+        self._invalidations = [[] for _ in range(self.worker_count)]
+        self._invalidated_by = invalidating_messages(self.plugin)
+        self._in_flight = [0] * self.worker_count
+
+        original_pre_disconnect = getattr(self.plugin, 'pre_disconnect', None)
+
+        def pre_disconnect():
+            self.shutdown()
+            if original_pre_disconnect:
+                return original_pre_disconnect()
+            return True
+
+        original_dispatch = self.plugin._dispatch
+
+        def dispatch(message_data):
+            try:
+                return original_dispatch(message_data)
+            finally:
+                self._send_shares('messages')
+
+        #Messages reach the workers in place of their callbacks, at the end of the
+        #plugin's own dispatch
+        self.plugin._route_message = self._route_to_worker
+        if self.plugin.middleware is not None:
+            self.plugin.middleware.terminals['message'] = self._route_to_worker
+            self.plugin.middleware.compile()
+
+        self.plugin._dispatch = dispatch
+        self.plugin._handle_transactions = self._fan_out_transactions
+        self.plugin.pre_disconnect = pre_disconnect
+
+
+    def shutdown(self, timeout=30):
+        """
+        Let the workers finish their queued work, stop them, and send whatever they
+        funneled back.
+        """
+        self._stopping = True
+
+        for tasks in self._tasks:
+            tasks.put(None)
+
+        for worker in self._workers:
+            while worker.is_alive():
+                self.collect()
+                worker.join(0.1)
+                timeout -= 0.1
+                if timeout <= 0:
+                    worker.terminate()
+                    worker.join()
+
+        self.collect()
+        self._workers = []
+
+
+    def collect(self):
+        """
+        Send the requests workers have funneled back to HPIT.
+
+        Returns: int - The number of requests sent.
+        """
+        sent = 0
+        while True:
+            try:
+                url, data = self._results.get_nowait()
+            except queue.Empty:
+                return sent
+
+            if url is None:
+                #A worker finished a task
+                index, count = data
+                self._in_flight[index] = max(self._in_flight[index] - count, 0)
+                self.plugin.handoff_depth = sum(self._in_flight)
+                continue
+
+            self.plugin._post_data(url, data)
+            sent += 1
+
+
+    def _spawn(self, index):
+        worker = self._context.Process(
+            target=_worker_main,
+            args=(index, self.plugin_factory, self._tasks[index], self._results),
+            daemon=True)
+        worker.start()
+        return worker
+
+
+    def _check_workers(self):
+        if self._stopping:
+            return
+
+        for index, worker in enumerate(self._workers):
+            if not worker.is_alive():
+                worker.join()
+                self._workers[index] = self._spawn(index)
+                self.restarts += 1
+
+                #Its work in flight was lost with it
+                self._in_flight[index] = 0
+                self.plugin.handoff_depth = sum(self._in_flight)
+
+
+    def _route(self, item):
+        if self.sticky:
+            sender = str(item.get('sender_entity_id', ''))
+            return zlib.crc32(sender.encode('utf-8')) % self.worker_count
+
+        self._next_worker = (self._next_worker + 1) % self.worker_count
+        return self._next_worker
+
+
+    def _route_to_worker(self, message_item):
+        index = self._route(message_item)
+        self._shares[index].append(message_item)
+
+        if message_item.get('message_name') in self._invalidated_by:
+            for other, invalidations in enumerate(self._invalidations):
+                if other != index:
+                    invalidations.append(message_item)
+
+
+    def _send_shares(self, kind):
+        for index, invalidations in enumerate(self._invalidations):
+            if invalidations:
+                self._tasks[index].put(('invalidate', invalidations))
+                self._invalidations[index] = []
+
+        for index, share in enumerate(self._shares):
+            if share:
+                self._tasks[index].put((kind, share))
+                self._in_flight[index] += len(share)
+                self._shares[index] = []
+
+        self.plugin.handoff_depth = sum(self._in_flight)
+
+        self._check_workers()
+        self.collect()
+
+
+    def _fan_out_transactions(self, transaction_data=None):
+        if transaction_data is None:
+            transaction_data = self.plugin._poll_transactions()
+
+        if self.plugin.message_deduplicator is not None:
+            transaction_data = [t for t in transaction_data if self.plugin.message_deduplicator.check(t['message_id'])]
+
+        for item in transaction_data:
+            self._route_to_worker(item)
+
+        self._send_shares('transactions')
+        return True
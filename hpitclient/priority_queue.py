@@ -0,0 +1,146 @@
+import time
+import itertools
+from collections import deque
+
+from .exceptions import InvalidParametersError
+
+
+class PriorityDispatchQueue:
+    """
+    A queue of polled messages that hands out the highest priority message
+    first, and messages of equal priority in the order they arrived.
+
+    Priorities are assigned per message name. Higher numbers are dispatched
+    first, and names without a priority get default_priority. To keep bulk
+    messages from starving, a message that has waited longer than
+    starvation_timeout seconds is dispatched ahead of higher priority ones.
+
+    The time each message spends waiting is recorded per priority and reported
+    by stats().
+    """
+    def __init__(self, priorities=None, default_priority=0, starvation_timeout=5.0):
+        if starvation_timeout is not None and starvation_timeout < 0:
+            raise InvalidParametersError('starvation_timeout cannot be negative')
+
+        self.priorities = dict(priorities or {})
+        self.default_priority = default_priority
+        self.starvation_timeout = starvation_timeout
+
+        self._levels = {}
+        self._order = []
+        self._length = 0
+        self._latency = {}
+        self._arrivals = itertools.count()
+
+
+    def __len__(self):
+        return self._length
+
+
+    def set_priority(self, message_name, priority):
+        self.set_priorities({message_name: priority})
+
+
+    def set_priorities(self, priorities):
+        """
+        Change the priorities of some message names. Messages already queued move to
+        their new priority, keeping their place in arrival order and how long they
+        have waited.
+        """
+        self.priorities.update(priorities)
+
+        if not priorities or not self._length:
+            return
+
+        entries = [entry for level in self._levels.values() for entry in level]
+        entries.sort(key=lambda entry: entry[1])
+
+        self._levels = {}
+        self._order = []
+        for entry in entries:
+            self._level_for(entry[2]).append(entry)
+
+
+    def append(self, message_item, now=None):
+        if now is None:
+            now = time.time()
+
+        self._level_for(message_item).append((now, next(self._arrivals), message_item))
+        self._length += 1
+
+
+    def extend(self, message_items):
+        now = time.time()
+        for message_item in message_items:
+            self.append(message_item, now)
+
+
+    def popleft(self, now=None):
+        """
+        Remove and return the next message to dispatch.
+        """
+        if not self._length:
+            raise IndexError('pop from an empty PriorityDispatchQueue')
+
+        if now is None:
+            now = time.time()
+
+        priority = None
+        oldest = None
+
+        for level_priority in self._order:
+            level = self._levels[level_priority]
+            if not level:
+                continue
+
+            if priority is None:
+                priority = level_priority
+                oldest = level[0][0]
+                if self.starvation_timeout is None:
+                    break
+            elif level[0][0] < oldest and now - level[0][0] > self.starvation_timeout:
+                priority = level_priority
+                oldest = level[0][0]
+
+        enqueued, _, message_item = self._levels[priority].popleft()
+        self._length -= 1
+        self._record_latency(priority, now - enqueued)
+
+        return message_item
+
+
+    def clear(self):
+        for level in self._levels.values():
+            level.clear()
+        self._length = 0
+
+
+    def stats(self):
+        """
+        Returns: dict - For each priority, the number of messages dispatched and their
+        average and maximum wait in seconds.
+        """
+        return {
+            priority: {
+                'count': count,
+                'average_wait': total / count,
+                'max_wait': longest,
+            }
+            for priority, (count, total, longest) in self._latency.items()
+        }
+
+
+    def _level_for(self, message_item):
+        priority = self.priorities.get(message_item['message_name'], self.default_priority)
+
+        level = self._levels.get(priority)
+        if level is None:
+            level = self._levels[priority] = deque()
+            self._order = sorted(self._levels, reverse=True)
+
+        return level
+
+
+    def _record_latency(self, priority, waited):
+        count, total, longest = self._latency.get(priority, (0, 0.0, 0.0))
+        self._latency[priority] = (count + 1, total + waited, max(longest, waited))
@@ -0,0 +1,222 @@
+import time
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+from .exceptions import RateLimitExceededError, InvalidParametersError
+
+#Maps HPIT endpoints to the endpoint classes rate limits are configured for
+ENDPOINT_CLASSES = {
+    'message': 'send',
+    'transaction': 'send',
+    'response': 'response',
+    'log': 'log',
+    'plugin/message/list': 'poll',
+    'plugin/transaction/list': 'poll',
+    'response/list': 'poll',
+}
+
+RATE_LIMIT_MODES = ('block', 'raise', 'queue')
+
+#Only endpoints whose responses are never read can have their requests queued
+QUEUEABLE_CLASSES = ('response', 'log')
+
+#Buckets shared by every client in this process with the same entity id
+_entity_buckets = {}
+_entity_buckets_lock = threading.Lock()
+
+
+def endpoint_class(url):
+    """
+    Returns: string - The endpoint class of url, or None if it has none.
+    """
+    return ENDPOINT_CLASSES.get(urlparse(url).path.strip('/'))
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket. Tokens are added at rate per second up to
+    capacity, and each request takes one.
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise InvalidParametersError('rate must be positive')
+
+        if capacity is None:
+            capacity = max(1, rate)
+
+        if capacity < 1:
+            raise InvalidParametersError('capacity must be at least 1')
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def try_acquire(self):
+        """
+        Take a token if one is available.
+
+        Returns: float - 0 if a token was taken, otherwise the number of seconds
+        until one will be available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.
+        """
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Applies token bucket rate limits to requests by endpoint class.
+
+    Each limit has a mode that decides what happens to a request when its
+    bucket is empty:
+        block - Wait until a token is available.
+        raise - Raise RateLimitExceededError.
+        queue - Hold the request and send it later from flush(). Only allowed for
+        the 'response' and 'log' classes, whose responses are never read.
+
+    admit() can be called from several threads at once, as _post_many does.
+    """
+    def __init__(self):
+        self.limits = {}
+        self.queues = {}
+        self.throttled = {}
+        self._lock = threading.Lock()
+
+
+    def set_limit(self, endpoint_class, bucket, mode='block'):
+        if endpoint_class not in set(ENDPOINT_CLASSES.values()):
+            raise InvalidParametersError('Unknown endpoint class: ' + str(endpoint_class))
+
+        if mode not in RATE_LIMIT_MODES:
+            raise InvalidParametersError('mode must be one of ' + ', '.join(RATE_LIMIT_MODES))
+
+        if mode == 'queue' and endpoint_class not in QUEUEABLE_CLASSES:
+            raise InvalidParametersError('Only ' + ' and '.join(QUEUEABLE_CLASSES) + ' requests can be queued')
+
+        self.limits[endpoint_class] = (bucket, mode)
+        self.queues.setdefault(endpoint_class, deque())
+
+
+    def remove_limit(self, endpoint_class):
+        self.limits.pop(endpoint_class, None)
+
+
+    def admit(self, url):
+        """
+        Apply the rate limit for url's endpoint class.
+
+        Returns: boolean - True if the request may be sent now, False if it must be
+        queued with enqueue().
+        """
+        klass = endpoint_class(url)
+        limit = self.limits.get(klass)
+        if limit is None:
+            return True
+
+        bucket, mode = limit
+
+        if mode == 'queue':
+            if self.queues[klass]:
+                return False
+            if bucket.try_acquire():
+                self._count_throttled(klass)
+                return False
+            return True
+
+        wait = bucket.try_acquire()
+        if not wait:
+            return True
+
+        self._count_throttled(klass)
+
+        if mode == 'raise':
+            raise RateLimitExceededError('Rate limit exceeded for ' + klass + ' requests. Retry in ' + '%.3f' % wait + 's.')
+
+        time.sleep(wait)
+        bucket.acquire()
+        return True
+
+
+    def enqueue(self, url, request):
+        with self._lock:
+            self.queues[endpoint_class(url)].append(request)
+
+
+    def flush(self, send, block=False):
+        """
+        Send queued requests with send(request) as fast as their limits allow. With
+        block, waits until every queue is empty.
+
+        Returns: int - The number of queued requests sent.
+        """
+        sent = 0
+
+        for klass, queue in self.queues.items():
+            limit = self.limits.get(klass)
+
+            while queue:
+                if limit is not None:
+                    if block:
+                        limit[0].acquire()
+                    elif limit[0].try_acquire():
+                        break
+
+                send(queue.popleft())
+                sent += 1
+
+        return sent
+
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                'throttled': dict(self.throttled),
+                'queued': {klass: len(queue) for klass, queue in self.queues.items()},
+            }
+
+
+    def _count_throttled(self, klass):
+        with self._lock:
+            self.throttled[klass] = self.throttled.get(klass, 0) + 1
+
+
+def entity_bucket(entity_id, endpoint_class, rate, capacity=None):
+    """
+    Returns the token bucket shared by every client in this process acting as
+    entity_id, creating or replacing it if rate or capacity changed.
+    """
+    key = (entity_id, endpoint_class)
+
+    with _entity_buckets_lock:
+        bucket = _entity_buckets.get(key)
+
+        if bucket is None or bucket.rate != rate or (capacity is not None and bucket.capacity != capacity):
+            bucket = _entity_buckets[key] = TokenBucket(rate, capacity)
+
+        return bucket
@@ -0,0 +1,174 @@
+import json
+import time
+import uuid
+
+from .exceptions import InvalidParametersError, ResourceNotFoundError
+
+RECORD_KINDS = ('messages', 'transactions', 'responses')
+
+
+class TrafficRecorder:
+    """
+    Captures the traffic a Plugin or Tutor polls from HPIT into an append-only
+    file so it can be replayed later without a network connection.
+
+    Each poll is written as a single compact JSON line of the form:
+        [timestamp, kind, items]
+
+    Where kind is one of 'messages', 'transactions' or 'responses' and items is
+    the list exactly as it was received from HPIT.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.record_count = 0
+        self._file = open(path, 'a')
+
+
+    def record(self, kind, items):
+        """
+        Append a single poll of the given kind to the recording. Empty polls are
+        not recorded.
+        """
+        if kind not in RECORD_KINDS:
+            raise InvalidParametersError('Unknown record kind: ' + str(kind))
+
+        if not items:
+            return
+
+        line = json.dumps([time.time(), kind, items], separators=(',', ':'), default=str)
+        self._file.write(line + '\n')
+        self._file.flush()
+        self.record_count += 1
+
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class ReplayedResponse:
+    """
+    Stands in for a requests.Response while replaying. Anything the handlers
+    send to HPIT is acknowledged locally with a fresh message id.
+    """
+    status_code = 200
+
+    def __init__(self):
+        self._data = {'message_id': uuid.uuid4().hex}
+        self.text = json.dumps(self._data)
+
+    def json(self):
+        return self._data
+
+
+class TrafficReplayer:
+    """
+    Feeds a recording made by TrafficRecorder back through a Plugin or Tutor's
+    dispatch methods and reports how fast the handlers processed it.
+
+    Messages are fed to _dispatch, transactions to _handle_transactions and
+    responses to _dispatch_responses. A client that isn't connected has its
+    post_connect() called first so it registers its handlers. Any requests made
+    while replaying are acknowledged locally and never reach the network, and
+    lookups such as get_message_owner() find nothing.
+    """
+    def __init__(self, path):
+        self.path = path
+
+
+    def records(self):
+        """
+        Generator over (timestamp, kind, items) tuples in the recording.
+        """
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+
+                timestamp, kind, items = json.loads(line)
+                yield timestamp, kind, items
+
+
+    def replay(self, client, speed=None):
+        """
+        Replay the recording through client.
+
+        Input:
+            client - The Plugin or Tutor whose handlers will receive the traffic.
+            speed - 1.0 replays with the original timing, 10.0 replays ten times
+            faster than it was recorded. None replays as fast as possible.
+
+        Returns: dict - Counts of each kind of item replayed, the number of requests
+        and lookups the handlers attempted, the time spent in handlers and the
+        handler throughput in items per second.
+        """
+        if speed is not None and speed <= 0:
+            raise InvalidParametersError('speed must be positive or None')
+
+        stats = {kind: 0 for kind in RECORD_KINDS}
+        stats['outbound_requests'] = 0
+        stats['lookups'] = 0
+
+        def offline_post_data(url, data=None, retry=True):
+            stats['outbound_requests'] += 1
+            return ReplayedResponse()
+
+        def offline_get_data(url, retry=True):
+            stats['lookups'] += 1
+            raise ResourceNotFoundError('Nothing can be looked up while replaying: ' + url)
+
+        saved_recorder = client.recorder
+        saved = {name: client.__dict__.get(name) for name in ('_post_data', '_get_data')}
+        client.recorder = None
+        client._post_data = offline_post_data
+        client._get_data = offline_get_data
+
+        handler_time = 0.0
+        first_timestamp = None
+
+        try:
+            if not client.connected:
+                #Register the handlers, as connect() would
+                client._try_hook('post_connect')
+                stats['outbound_requests'] = 0
+                stats['lookups'] = 0
+
+            replay_start = time.time()
+
+            for timestamp, kind, items in self.records():
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+
+                if speed is not None:
+                    due = replay_start + (timestamp - first_timestamp) / speed
+                    delay = due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                dispatch_start = time.time()
+
+                if kind == 'messages':
+                    client._dispatch(items)
+                elif kind == 'transactions':
+                    client._handle_transactions(items)
+                elif kind == 'responses':
+                    client._dispatch_responses(items)
+
+                handler_time += time.time() - dispatch_start
+                stats[kind] += len(items)
+        finally:
+            for name, method in saved.items():
+                if method is None:
+                    del client.__dict__[name]
+                else:
+                    setattr(client, name, method)
+            client.recorder = saved_recorder
+
+        total = sum(stats[kind] for kind in RECORD_KINDS)
+
+        stats['elapsed'] = time.time() - replay_start
+        stats['handler_time'] = handler_time
+        stats['throughput'] = total / handler_time if handler_time > 0 else 0.0
+
+        return stats
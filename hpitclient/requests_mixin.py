@@ -1,20 +1,35 @@
-import json
 import time
 import requests
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from urllib.parse import urljoin
+from urllib3.util.request import ACCEPT_ENCODING
 
 from .exceptions import AuthenticationError, ResourceNotFoundError, InternalServerError, ConnectionError
-
-JSON_HTTP_HEADERS = {'content-type': 'application/json'}
+from .rate_limit import RateLimiter, entity_bucket
+from .codec import JSON_CODEC, get_codec, codec_for_content_type, accept_header
+from .streaming import iter_json_array
+from .compression import RequestCompressor, ALL_ENDPOINTS
+from .middleware import MiddlewarePipeline, OutboundRequest
 
 class RequestsMixin:
     def __init__(self):
         self.entity_id = ""
         self.api_key = ""
         self.session = requests.Session()
+        self._thread_local = threading.local()
         self.connected = False
+        self.max_concurrent_requests = 4
+        self.rate_limiter = None
+        self.stream_chunk_size = 65536
+        self.wire_format = JSON_CODEC
+        self.request_codec = JSON_CODEC
+        self._request_codec_rejected = False
+        self.request_compressor = None
+        self.middleware = None
 
         self.set_hpit_root_url('https://www.hpit-project.org')
         self.set_requests_log_level('debug')
@@ -39,6 +54,173 @@ class RequestsMixin:
         self._requests_log_level = log_level
 
 
+    def set_wire_format(self, name):
+        """
+        Choose the format to exchange data with HPIT in: 'json' (the default) or
+        'msgpack', which needs the msgpack package.
+
+        Responses are asked for in the chosen format with an Accept header, falling
+        back to JSON. Requests are sent as JSON until the server has answered in the
+        chosen format, so servers that only speak JSON keep working. If the server
+        later rejects a request body as unsupported, requests go back to JSON until
+        set_wire_format is called again.
+
+        Throws:
+            InvalidParametersError - The format is unknown or its package isn't installed.
+        """
+        codec = get_codec(name)
+
+        self.wire_format = codec
+        self.request_codec = JSON_CODEC
+        self._request_codec_rejected = False
+        self.session.headers['Accept'] = accept_header(codec)
+
+
+    def set_compression(self, encoding='gzip', threshold=1024, endpoint=ALL_ENDPOINTS, level=None):
+        """
+        Compress request bodies of at least threshold bytes before sending them to
+        HPIT, and ask for compressed responses with every encoding this client can
+        decode.
+
+        Input:
+            encoding - 'gzip', 'deflate' or 'zstd' (which needs the zstandard package).
+            threshold - Smaller bodies are sent uncompressed.
+            endpoint - An endpoint path such as 'transaction', an endpoint class
+            such as 'send' or 'response', or '*' for every endpoint. Policies can be
+            set for several endpoints; the most specific applies.
+            level - The compression level, or None for the encoding's default.
+
+        If the server refuses a compressed body the request is sent again
+        uncompressed. Only if that goes through is the encoding not used again;
+        otherwise it was the wire format that was refused (see set_wire_format).
+
+        Throws:
+            InvalidParametersError - The encoding is unknown or its package isn't installed,
+            or threshold isn't a non-negative number of bytes.
+        """
+        if self.request_compressor is None:
+            self.request_compressor = RequestCompressor()
+
+        self.request_compressor.set_policy(endpoint, encoding, threshold, level)
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+
+    def clear_compression(self, endpoint=None):
+        """
+        Stop compressing requests to endpoint, or to every endpoint if it is None.
+        """
+        if self.request_compressor is None:
+            return
+
+        if endpoint is None:
+            self.request_compressor.policies.clear()
+        else:
+            self.request_compressor.remove_policy(endpoint)
+
+
+    def compression_stats(self):
+        """
+        Returns: dict - See RequestCompressor.stats().
+        """
+        if self.request_compressor is None:
+            return {}
+
+        return self.request_compressor.stats()
+
+
+    def use_middleware(self, phase, middleware, name=None):
+        """
+        Add middleware around one of this client's paths, without subclassing:
+        'request' wraps every request posted to HPIT, 'response' wraps dispatching
+        each response to its callback and, for plugins, 'message' wraps dispatching
+        each message. See hpitclient.middleware.MiddlewarePipeline for how
+        middleware is written.
+
+        Input:
+            phase - 'request', 'message' or 'response'.
+            middleware - Called with the next handler, returns the handler to run.
+            name - Defaults to the middleware's __name__. Adding middleware under a
+            name already used in phase replaces it.
+
+        Throws:
+            InvalidParametersError - The phase is unknown or middleware isn't callable.
+        """
+        if self.middleware is None:
+            self.middleware = MiddlewarePipeline(self._middleware_terminals())
+
+        self.middleware.add(phase, middleware, name)
+
+
+    def remove_middleware(self, phase, name=None):
+        """
+        Remove the middleware called name from phase, or all of phase's middleware
+        if name is None.
+        """
+        if self.middleware is not None:
+            self.middleware.remove(phase, name)
+
+
+    def middleware_stats(self):
+        """
+        Returns: dict - See MiddlewarePipeline.stats().
+        """
+        if self.middleware is None:
+            return {}
+
+        return self.middleware.stats()
+
+
+    def _middleware_terminals(self):
+        """
+        Returns: dict - The phases this client supports, and the handler that ends each chain.
+        """
+        return {'request': self._send_request}
+
+
+    def set_rate_limit(self, endpoint_class, rate, burst=None, mode='block'):
+        """
+        Limit how fast requests of an endpoint class are sent to HPIT with a token
+        bucket. The bucket is shared by every client in this process with the same
+        entity id, so the limit applies per entity.
+
+        Input:
+            endpoint_class - One of 'send', 'response', 'log' or 'poll'.
+            rate - The sustained number of requests allowed per second.
+            burst - The number of requests that may be sent at once after a quiet
+            period. Defaults to one second's worth of rate.
+            mode - What to do when the limit is reached. 'block' waits, 'raise' raises
+            RateLimitExceededError and 'queue' holds the request to be sent later by
+            flush_rate_limited(). Only 'response' and 'log' requests can be queued.
+        """
+        if self.rate_limiter is None:
+            self.rate_limiter = RateLimiter()
+
+        bucket = entity_bucket(self.entity_id, endpoint_class, rate, burst)
+        self.rate_limiter.set_limit(endpoint_class, bucket, mode)
+
+
+    def clear_rate_limit(self, endpoint_class):
+        """
+        Remove the rate limit on an endpoint class. Requests already queued are still
+        sent by flush_rate_limited().
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.remove_limit(endpoint_class)
+
+
+    def flush_rate_limited(self, block=False):
+        """
+        Send requests held by rate limits in 'queue' mode, as fast as the limits
+        allow. With block, waits until all of them have been sent.
+
+        Returns: int - The number of queued requests sent.
+        """
+        if self.rate_limiter is None:
+            return 0
+
+        return self.rate_limiter.flush(lambda request: self._send_post(*request), block)
+
+
     def connect(self, retry=True):
         """
         Register a connection with the HPIT Server.
@@ -47,6 +229,10 @@ class RequestsMixin:
         the system. This is mostly used to track plugin use with the site.
         """
         self._try_hook('pre_connect')
+
+        if self.middleware is not None:
+            self.middleware.compile()
+
         self._post_data('connect', {
                 'entity_id': self.entity_id, 
                 'api_key': self.api_key
@@ -66,6 +252,7 @@ class RequestsMixin:
         with the HPIT server.
         """
         self._try_hook('pre_disconnect')
+        self.flush_rate_limited(block=True)
         
         self._post_data('disconnect', {
                 'entity_id': self.entity_id,
@@ -84,23 +271,87 @@ class RequestsMixin:
         Sends arbitrary data to the HPIT server. This is mainly a thin
         wrapper ontop of requests that ensures we are using sessions properly.
 
+        If a rate limit in 'queue' mode holds the request, it is sent later and
+        None is returned.
+
         Returns: requests.Response : class - The response from HPIT. Normally a 200:OK.
         """
+        handler = self.middleware.handler('request') if self.middleware is not None else None
+        if handler is not None:
+            return handler(OutboundRequest(url, data, retry))
+
+        return self._queue_or_send(url, data, retry)
+
+
+    def _send_request(self, request):
+        return self._queue_or_send(request.url, request.data, request.retry)
+
+
+    def _queue_or_send(self, url, data, retry):
+        """
+        Sends a request unless a rate limit holds it. See _post_data.
+        """
+        if self.rate_limiter is not None and not self.rate_limiter.admit(url):
+            self.rate_limiter.enqueue(url, (url, data, retry))
+            return None
+
+        return self._send_post(url, data, retry)
+
+
+    def _send_post(self, url, data=None, retry=True):
+        """
+        Posts to HPIT without applying rate limits. See _post_data.
+        """
         url = urljoin(self._hpit_root_url, url)
 
+        session = self._current_session()
+
+        #The (encoding, codec) of a compressed request refused with a 415, while it
+        #is sent again uncompressed to find out which of the two was refused
+        suspect = None
+
         failure_count = 0
         while failure_count < 3:
             try:
+                codec = self.request_codec
+                content_encoding = None
+
                 if data:
-                    response = self.session.post(url, data=json.dumps(data), headers=JSON_HTTP_HEADERS)
+                    body = codec.encode(data)
+                    headers = {'content-type': codec.content_type}
+
+                    if self.request_compressor is not None and suspect is None:
+                        body, content_encoding = self.request_compressor.compress(url, body)
+                        if content_encoding:
+                            headers['content-encoding'] = content_encoding
+
+                    response = session.post(url, data=body, headers=headers)
                 else:
-                    response = self.session.post(url)
+                    response = session.post(url)
 
                 if response is None:
                     raise ConnectionError("Connection was reset by a peer or the server rebooted.")
                 
                 if response.status_code == 200:
+                    if suspect is not None and suspect[1] is codec:
+                        #The same request went through uncompressed, so the server
+                        #doesn't take compressed bodies after all
+                        self.request_compressor.reject(suspect[0])
+                    self._negotiate_wire_format(response)
+                    if self.request_compressor is not None:
+                        self.request_compressor.record_response(response)
                     return response
+                elif response.status_code == 415 and content_encoding:
+                    #Either the compression or the format was refused; send it
+                    #uncompressed to tell which
+                    suspect = (content_encoding, codec)
+                    continue
+                elif response.status_code == 415 and codec is not JSON_CODEC:
+                    #The server doesn't take this format after all
+                    suspect = None
+                    self.request_codec = JSON_CODEC
+                    self._request_codec_rejected = True
+                    continue
                 elif response.status_code == 403:
                     raise AuthenticationError("Request could not be authenticated")
                 elif response.status_code == 404:
@@ -119,11 +370,103 @@ class RequestsMixin:
 
         #It looks like the server went down. Wait 5 minutes and try again
         if retry:
-            return self._attempt_reconnection(lambda: self._post_data(url, data))
+            return self._attempt_reconnection(lambda: self._send_post(url, data))
 
         raise ConnectionError("Connection was reset by a peer or the server stopped responding.")
 
 
+    def _post_many(self, url, datas, retry=True, return_exceptions=False):
+        """
+        Sends several payloads to the same HPIT endpoint, up to
+        self.max_concurrent_requests of them at a time. Each worker thread posts
+        through its own copy of the session, since sessions can't be shared
+        between threads, and cookies HPIT sets on them are copied back after.
+        Every payload is sent even if some of them fail.
+
+        Returns: list - The requests.Response for each payload, in the same order as datas.
+        With return_exceptions, a payload whose request raised has the exception in its
+        place; otherwise the first exception is raised once every payload has been sent.
+        """
+        datas = list(datas)
+
+        def post(data):
+            try:
+                return self._post_data(url, data, retry=retry)
+            except Exception as e:
+                return e
+
+        if len(datas) <= 1 or self.max_concurrent_requests <= 1:
+            results = [post(data) for data in datas]
+        else:
+            sessions = []
+
+            def start_worker():
+                session = self._copy_session()
+                sessions.append(session)
+                self._thread_local.session = session
+
+            workers = min(self.max_concurrent_requests, len(datas))
+            with ThreadPoolExecutor(max_workers=workers, initializer=start_worker) as executor:
+                results = list(executor.map(post, datas))
+
+            for session in sessions:
+                self.session.cookies.update(session.cookies)
+                session.close()
+
+        if not return_exceptions:
+            self._raise_first_error(results)
+
+        return results
+
+
+    def _raise_first_error(self, results):
+        """
+        Raise the first exception among results returned by _post_many, if any.
+        """
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+
+    def _copy_session(self):
+        """
+        Returns: requests.Session - A new session with the headers, cookies and
+        settings of self.session.
+        """
+        session = requests.Session()
+        session.headers.update(self.session.headers)
+        session.cookies.update(self.session.cookies)
+        session.auth = self.session.auth
+        session.proxies.update(self.session.proxies)
+        session.verify = self.session.verify
+        session.cert = self.session.cert
+        return session
+
+
+    def _current_session(self):
+        """
+        Returns: requests.Session - The session requests on this thread go through.
+        _post_many's workers and background refreshes each have one of their own.
+        """
+        return getattr(self._thread_local, 'session', None) or self.session
+
+
+    @contextmanager
+    def _own_session(self):
+        """
+        Send the requests made on this thread inside the with block through a
+        copy of self.session, so they don't race with the main loop's.
+        """
+        session = self._copy_session()
+        self._thread_local.session = session
+        try:
+            yield session
+        finally:
+            self._thread_local.session = None
+            self.session.cookies.update(session.cookies)
+            session.close()
+
+
     def _get_data(self, url, retry=True):
         """
         Gets arbitrary data from the HPIT server. This is mainly a thin
@@ -131,18 +474,24 @@ class RequestsMixin:
 
         Returns: dict() - A Python dictionary representing the JSON recieved in the request.
         """
+        if self.rate_limiter is not None:
+            self.rate_limiter.admit(url)
+
         url = urljoin(self._hpit_root_url, url)
 
         failure_count = 0
         while failure_count < 3:
             try:
-                response = self.session.get(url)
+                response = self._current_session().get(url)
 
                 if response is None:
                     raise ConnectionError("Connection was reset by a peer or the server rebooted.")
 
                 if response.status_code == 200:
-                    return response.json()
+                    self._negotiate_wire_format(response)
+                    if self.request_compressor is not None:
+                        self.request_compressor.record_response(response)
+                    return self._response_data(response)
                 elif response.status_code == 403:
                     raise AuthenticationError("Request could not be authenticated")
                 elif response.status_code == 404:
@@ -166,6 +515,108 @@ class RequestsMixin:
         raise ConnectionError("Connection was reset by a peer or the server stopped responding.")
 
 
+    def _get_stream(self, url, key, retry=True, interruptions=0):
+        """
+        Like _get_data, but for a JSON object holding a long list under key. The
+        response body is read self.stream_chunk_size bytes at a time and the
+        list's items are yielded as they are decoded, so the whole body is never
+        held in memory. The connection is held until the generator is exhausted
+        or closed.
+
+        If the body is cut off part way, the items already yielded stand and url is
+        polled again, up to twice before trying to reconnect.
+
+        Returns: generator - The items of the list under key.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.admit(url)
+
+        full_url = urljoin(self._hpit_root_url, url)
+
+        response = None
+        failure_count = 0
+        while failure_count < 3:
+            try:
+                #Only JSON bodies can be decoded as they arrive
+                response = self.session.get(full_url, stream=True, headers={'Accept': JSON_CODEC.content_type})
+
+                if response is None:
+                    raise ConnectionError("Connection was reset by a peer or the server rebooted.")
+
+                if response.status_code == 403:
+                    raise AuthenticationError("Request could not be authenticated")
+                elif response.status_code == 404:
+                    raise ResourceNotFoundError("Requested resource not found")
+                elif response.status_code == 500:
+                    raise InternalServerError("Internal server error")
+
+                break
+
+            except requests.exceptions.ConnectionError as e:
+                if failure_count == 3:
+                    raise e
+
+                response = None
+                failure_count += 1
+                continue
+
+        if response is None:
+            #It looks like the server went down. Wait 5 minutes and try again
+            if retry:
+                yield from self._attempt_reconnection(lambda: self._get_stream(url, key, retry=False))
+                return
+
+            raise ConnectionError("Connection was reset by a peer or the server stopped responding.")
+
+        try:
+            if response.status_code == 200:
+                yield from iter_json_array(response.iter_content(self.stream_chunk_size), key)
+            return
+        except (requests.exceptions.RequestException, ValueError) as e:
+            #The body was cut off. HPIT counts what it sent as delivered, so the rest
+            #can only be had by polling again.
+            error = e
+        finally:
+            response.close()
+
+        self.send_log_entry('Streamed poll of ' + url + ' was cut off (' + str(error) + '). Polling again.')
+
+        if interruptions < 2:
+            yield from self._get_stream(url, key, retry, interruptions + 1)
+        elif retry:
+            yield from self._attempt_reconnection(lambda: self._get_stream(url, key, retry=False))
+        else:
+            raise ConnectionError("Connection was reset by a peer or the server stopped responding.")
+
+
+    def _response_data(self, response):
+        """
+        Decode the body of a response from HPIT in whichever format it was sent.
+
+        Returns: The decoded body.
+        """
+        headers = getattr(response, 'headers', None) or {}
+        codec = codec_for_content_type(headers.get('content-type'))
+
+        if codec is None or codec is JSON_CODEC:
+            return response.json()
+
+        return codec.decode(response.content)
+
+
+    def _negotiate_wire_format(self, response):
+        """
+        Once the server has answered in the preferred wire format, send requests
+        in it too, unless it has already refused a request in it.
+        """
+        if self.wire_format is JSON_CODEC or self.request_codec is self.wire_format or self._request_codec_rejected:
+            return
+
+        headers = getattr(response, 'headers', None) or {}
+        if codec_for_content_type(headers.get('content-type')) is self.wire_format:
+            self.request_codec = self.wire_format
+
+
     def _attempt_reconnection(self, callback):
         self.connected = False
         print("Looks like the server went down. Waiting 5 minutes...")
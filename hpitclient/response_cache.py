@@ -0,0 +1,217 @@
+import json
+import time
+import hashlib
+import threading
+
+from .cache import TTLCache
+from .message import json_default
+from .exceptions import InvalidParametersError
+
+
+def payload_digest(payload):
+    """
+    Returns: string - A hash of payload that is the same for equal payloads,
+    whatever order their keys are in, or None if payload can't be encoded.
+    """
+    try:
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=json_default)
+    except (TypeError, ValueError):
+        return None
+
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Remembers plugins' responses to read-only queries so a message sender can
+    answer a repeated query without sending it through HPIT again.
+
+    Only message names given a ttl are cached. Responses are keyed by message
+    name and a canonical hash of the payload, kept for their name's ttl and
+    evicted least recently used first once max_size is reached.
+
+    A query that is identical to one still waiting on its response isn't sent
+    again; its callback waits on the first query's response instead. A query
+    only waits on one sent less than inflight_timeout seconds ago, so a lost
+    response doesn't hold up later queries. Once a query has been in flight
+    that long the callbacks waiting on it are dropped; the query's own callback
+    is still called if its response turns up.
+
+    Cached responses are shared between every callback they are handed to, so
+    callbacks should treat them as read-only.
+    """
+    def __init__(self, ttls, max_size=1024, inflight_timeout=30):
+        self.ttls = {}
+        self.inflight_timeout = inflight_timeout
+        self.coalesced = 0
+        self.by_name = {}
+
+        self._entries = TTLCache(ttl=60, max_size=max_size)
+        self._inflight = {}
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+        for message_name, ttl in ttls.items():
+            self.set_ttl(message_name, ttl)
+
+
+    def set_ttl(self, message_name, ttl):
+        """
+        Cache responses to message_name for ttl seconds, or stop caching them if
+        ttl is None.
+
+        Throws:
+            InvalidParametersError - ttl is not positive.
+        """
+        if ttl is None:
+            self.ttls.pop(message_name, None)
+            self.invalidate(message_name)
+            return
+
+        if ttl <= 0:
+            raise InvalidParametersError('The response cache ttl for ' + message_name + ' must be positive')
+
+        self.ttls[message_name] = ttl
+
+
+    def key(self, message_name, payload):
+        """
+        Returns: tuple - The cache key for a query, or None if it isn't cached.
+        """
+        if message_name not in self.ttls:
+            return None
+
+        digest = payload_digest(payload)
+        if digest is None:
+            return None
+
+        return (message_name, digest)
+
+
+    def lookup(self, key):
+        """
+        Returns: tuple - (message_id, response) of the cached response for key, or None.
+        """
+        entry = self._entries.get(key)
+        self._count(key[0], 'hits' if entry is not None else 'misses')
+        return entry
+
+
+    def inflight(self, key, callback):
+        """
+        If a query for key is waiting on its response, add callback to the
+        callbacks the response is handed to.
+
+        Returns: string - The message id of the query waited on, or None if there
+        is none and the query should be sent.
+        """
+        with self._lock:
+            self._expire(time.time())
+            pending = self._inflight.get(key)
+
+            if pending is None:
+                return None
+
+            message_id = pending[0]
+            if callback is not None:
+                self._waiters[message_id].append(callback)
+            self.coalesced += 1
+
+        self._count(key[0], 'coalesced')
+        return message_id
+
+
+    def sent(self, key, message_id, callback):
+        """
+        Note that a query for key was sent as message_id.
+
+        Returns: callable - The callback to register for message_id's response.
+        """
+        now = time.time()
+
+        with self._lock:
+            self._expire(now)
+
+            #Kept in the order they were sent, so _expire() only looks at the oldest
+            self._inflight.pop(key, None)
+            self._inflight[key] = (message_id, now)
+            self._waiters[message_id] = []
+
+        return lambda response: self.complete(key, message_id, response, callback)
+
+
+    def complete(self, key, message_id, response, callback=None):
+        """
+        Cache the response to message_id and hand it to callback and every callback
+        waiting on it.
+        """
+        with self._lock:
+            if self._inflight.get(key, (None,))[0] == message_id:
+                del self._inflight[key]
+            waiters = self._waiters.pop(message_id, [])
+            ttl = self.ttls.get(key[0])
+
+        if ttl is not None:
+            self._entries.set(key, (message_id, response), ttl)
+
+        if callback is not None:
+            callback(response)
+
+        for waiter in waiters:
+            waiter(response)
+
+
+    def _expire(self, now):
+        """
+        Forget queries in flight for inflight_timeout seconds or more, along with the
+        callbacks waiting on them. Called with the lock held.
+        """
+        inflight = self._inflight
+
+        while inflight:
+            key = next(iter(inflight))
+            message_id, sent_at = inflight[key]
+            if sent_at + self.inflight_timeout > now:
+                break
+
+            del inflight[key]
+            self._waiters.pop(message_id, None)
+
+
+    def invalidate(self, message_name=None, payload=None):
+        """
+        Drop cached responses to message_name with payload, every cached response
+        to message_name if payload is None, or everything if message_name is None.
+        """
+        if message_name is None:
+            self._entries.invalidate()
+        elif payload is not None:
+            self._entries.invalidate((message_name, payload_digest(payload)))
+        else:
+            self._entries.invalidate_matching(lambda key: key[0] == message_name)
+
+
+    def stats(self):
+        """
+        Returns: dict - Hits, misses, queries coalesced onto one in flight, evictions,
+        size and hit rate overall and, under 'messages', per message name. The hit rate
+        counts coalesced queries as hits.
+        """
+        stats = self._entries.stats()
+        stats['coalesced'] = self.coalesced
+        stats['inflight'] = len(self._inflight)
+        stats['hit_rate'] = self._hit_rate(stats)
+        stats['messages'] = {name: dict(counts, hit_rate=self._hit_rate(counts)) for name, counts in self.by_name.items()}
+        return stats
+
+
+    def _hit_rate(self, counts):
+        lookups = counts['hits'] + counts['misses']
+        return (counts['hits'] + counts['coalesced']) / lookups if lookups else 0.0
+
+
+    def _count(self, message_name, counter):
+        counts = self.by_name.get(message_name)
+        if counts is None:
+            counts = self.by_name[message_name] = {'hits': 0, 'misses': 0, 'coalesced': 0}
+        counts[counter] += 1
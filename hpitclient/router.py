@@ -0,0 +1,131 @@
+import re
+import fnmatch
+
+from .exceptions import BadCallbackException
+
+#Returned by MessageRouter.resolve() when nothing is registered for a message name
+NO_ROUTE = object()
+
+
+class MessagePattern:
+    """
+    A glob pattern, eg. 'kt_*', routed to a callback with a priority.
+    """
+    __slots__ = ('pattern', 'callback', 'priority', 'order', '_match')
+
+    def __init__(self, pattern, callback, priority, order):
+        self.pattern = pattern
+        self.callback = callback
+        self.priority = priority
+        self.order = order
+        self._match = re.compile(fnmatch.translate(pattern)).match
+
+    def matches(self, message_name):
+        return self._match(message_name) is not None
+
+
+class MessageRouter(dict):
+    """
+    Maps message names to the callbacks that handle them.
+
+    A MessageRouter is a dictionary of exact message names to callbacks, so it
+    can be used anywhere Plugin.callbacks was used as a plain dictionary. On top
+    of that it holds glob patterns with priorities. Each message name is resolved
+    to a single callback the first time it is seen and the resolution is cached
+    until the routes change.
+
+    Resolution order is:
+        1. A callable registered for the exact message name.
+        2. The highest priority matching pattern. Ties go to the pattern added first.
+        3. None, if the exact name is subscribed without a callback.
+        4. NO_ROUTE.
+    """
+    max_resolved = 4096
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.patterns = []
+        self._pattern_count = 0
+        self._resolved = {}
+
+
+    def add_pattern(self, pattern, callback, priority=0):
+        """
+        Route every message name matching the glob pattern to callback, unless a
+        callback is registered for the exact name or a higher priority pattern
+        also matches.
+        """
+        validate_callback(callback)
+
+        self.remove_pattern(pattern)
+        self._pattern_count += 1
+        self.patterns.append(MessagePattern(pattern, callback, priority, self._pattern_count))
+        self.patterns.sort(key=lambda p: (-p.priority, p.order))
+        self._resolved.clear()
+
+
+    def remove_pattern(self, pattern):
+        self.patterns = [p for p in self.patterns if p.pattern != pattern]
+        self._resolved.clear()
+
+
+    def resolve(self, message_name):
+        """
+        Returns the callback for message_name, None if it is subscribed without a
+        callback, or NO_ROUTE if nothing handles it.
+        """
+        try:
+            return self._resolved[message_name]
+        except KeyError:
+            pass
+
+        callback = self.get(message_name, NO_ROUTE)
+
+        if callback is None or callback is NO_ROUTE:
+            for pattern in self.patterns:
+                if pattern.matches(message_name):
+                    callback = pattern.callback
+                    break
+
+        if len(self._resolved) >= self.max_resolved:
+            self._resolved.clear()
+
+        self._resolved[message_name] = callback
+        return callback
+
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._resolved.clear()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._resolved.clear()
+
+    def pop(self, *args):
+        self._resolved.clear()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._resolved.clear()
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self._resolved.clear()
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._resolved.clear()
+
+    def clear(self):
+        super().clear()
+        self._resolved.clear()
+
+
+def validate_callback(callback):
+    """
+    Raises BadCallbackException if callback isn't callable.
+    """
+    if not callable(callback):
+        raise BadCallbackException("The callback submitted is not callable.")
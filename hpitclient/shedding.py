@@ -0,0 +1,103 @@
+import math
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from .exceptions import InvalidParametersError
+
+
+class LoadShedder:
+    """
+    Holds per message name max-age policies and decides which messages are too
+    old to be worth handling.
+
+    A message is shed when more than its policy's max_age seconds have passed
+    since HPIT created it. Message names without a policy are never shed, and
+    neither are messages whose time_created can't be understood.
+    """
+    def __init__(self):
+        self.policies = {}
+        self.shed_counts = {}
+
+
+    def set_policy(self, message_name, max_age, expired_response=None):
+        """
+        Shed message_name once it is older than max_age seconds. If expired_response
+        is given, it is sent back to the message's sender as the response to each
+        message that is shed. A max_age of None removes the policy.
+        """
+        if max_age is None:
+            self.policies.pop(message_name, None)
+            return
+
+        if max_age < 0:
+            raise InvalidParametersError('max_age cannot be negative')
+
+        self.policies[message_name] = (max_age, expired_response)
+
+
+    def check(self, message_name, time_created, now=None):
+        """
+        Returns: tuple - (True, expired_response) if the message should be shed,
+        otherwise (False, None).
+        """
+        policy = self.policies.get(message_name)
+        if policy is None:
+            return False, None
+
+        created = parse_time(time_created)
+        if created is None:
+            return False, None
+
+        if now is None:
+            now = time.time()
+
+        max_age, expired_response = policy
+        if now - created <= max_age:
+            return False, None
+
+        self.shed_counts[message_name] = self.shed_counts.get(message_name, 0) + 1
+        return True, expired_response
+
+
+    def stats(self):
+        return dict(self.shed_counts)
+
+
+def parse_time(value):
+    """
+    Converts a time_created value from HPIT to seconds since the epoch. HPIT
+    times are UTC, so datetimes and strings without a timezone are read as UTC.
+
+    Returns: float - The time, or None if value can't be understood.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    if isinstance(value, (int, float)):
+        #'nan' and 'inf' parse as floats but give no age
+        if not math.isfinite(value):
+            return None
+
+        #Millisecond timestamps are well past any plausible seconds value
+        return value / 1000 if value > 1e11 else float(value)
+
+    if not isinstance(value, str):
+        return None
+
+    try:
+        return parse_time(float(value))
+    except ValueError:
+        pass
+
+    try:
+        return parse_time(datetime.fromisoformat(value))
+    except ValueError:
+        pass
+
+    try:
+        return parse_time(parsedate_to_datetime(value))
+    except (TypeError, ValueError, IndexError):
+        return None
@@ -0,0 +1,260 @@
+import re
+import json
+import codecs
+
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789.eE+-'
+
+_DECODER = json.JSONDecoder()
+
+#The characters that open or close strings, objects and arrays, or escape within strings
+_STRUCTURAL = re.compile(r'[\\"\[\]{}]')
+
+
+class _ValueScanner:
+    """
+    Finds where a JSON object, array or string that arrives in pieces ends, without
+    decoding it, so a value longer than one chunk is only decoded once.
+    """
+    __slots__ = ('depth', 'in_string', 'escaped')
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+
+    def feed(self, text, pos=0):
+        """
+        Scan the next piece of the value.
+
+        Returns: int - The index in text just past the end of the value, or -1 if it
+        carries on past text.
+        """
+        if self.escaped and pos < len(text):
+            self.escaped = False
+            pos += 1
+
+        search = _STRUCTURAL.search
+
+        while True:
+            match = search(text, pos)
+            if match is None:
+                return -1
+
+            char = match.group()
+            pos = match.end()
+
+            if self.in_string:
+                if char == '\\':
+                    if pos >= len(text):
+                        self.escaped = True
+                        return -1
+                    pos += 1
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 0:
+                        return pos
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char != '\\':
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos
+
+
+class JSONArrayStream:
+    """
+    Decodes the items of the array under one key of a JSON object, such as the
+    messages in a plugin/message/list body, while the body is still being read.
+
+    chunks is any iterable of bytes or strings, for example
+    requests.Response.iter_content(). Items are yielded as soon as they have been
+    read in full, and text that has been decoded is discarded, so only the item
+    being decoded and the current chunk are held in memory however long the body is.
+    Other keys of the object are decoded and ignored. If the object has no such
+    key nothing is yielded.
+
+    Throws:
+        json.JSONDecodeError - The body is not a JSON object or is truncated.
+    """
+    def __init__(self, chunks, key, encoding='utf-8'):
+        self.key = key
+        self.bytes_read = 0
+        self.max_buffered = 0
+
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+
+
+    def __iter__(self):
+        return self._items()
+
+
+    def _items(self):
+        self._expect('{')
+
+        if self._peek() == '}':
+            return
+
+        while True:
+            name = self._value()
+            self._expect(':')
+
+            if name == self.key and self._peek() == '[':
+                self._pos += 1
+
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._separator(']'):
+                            break
+            else:
+                self._value()
+
+            if self._separator('}'):
+                return
+
+
+    def _next_chunk(self):
+        """
+        Returns: string - The next chunk of the body decoded, or None if there is
+        nothing left to read.
+        """
+        if self._exhausted:
+            return None
+
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._exhausted = True
+            return self._decoder.decode(b'', final=True) or None
+
+        if isinstance(chunk, (bytes, bytearray)):
+            self.bytes_read += len(chunk)
+            chunk = self._decoder.decode(chunk)
+
+        return chunk
+
+
+    def _read(self):
+        """
+        Append the next chunk to the buffer, dropping what has been decoded.
+
+        Returns: boolean - False if there was nothing left to read.
+        """
+        chunk = self._next_chunk()
+        if chunk is None:
+            return False
+
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        self.max_buffered = max(self.max_buffered, len(self._buffer))
+        return True
+
+
+    def _read_value(self):
+        """
+        Read on until the value starting at the current position has been read in
+        full. Objects, arrays and strings are scanned for their end as chunks arrive
+        and joined once, rather than decoded again after every chunk; anything
+        else just reads one more chunk.
+
+        Returns: boolean - False if nothing more could be read, or the value was
+        already there in full.
+        """
+        first = self._buffer[self._pos:self._pos + 1]
+        if not first or first not in '{["':
+            return self._read()
+
+        scanner = _ValueScanner()
+        if scanner.feed(self._buffer, self._pos) >= 0:
+            return False
+
+        parts = [self._buffer[self._pos:]]
+        while True:
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+
+            parts.append(chunk)
+            if scanner.feed(chunk) >= 0:
+                break
+
+        if len(parts) == 1:
+            return False
+
+        self._buffer = ''.join(parts)
+        self._pos = 0
+        self.max_buffered = max(self.max_buffered, len(self._buffer))
+        return True
+
+
+    def _peek(self):
+        """
+        Returns: string - The next character that isn't whitespace, or '' at the
+        end of the body.
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._read():
+                return ''
+
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise json.JSONDecodeError('Expecting ' + repr(char), self._buffer, self._pos)
+        self._pos += 1
+
+
+    def _separator(self, closing):
+        """
+        Consume a ',' or the closing character.
+
+        Returns: boolean - True if it was the closing character.
+        """
+        char = self._peek()
+        if char not in (',', closing):
+            raise json.JSONDecodeError('Expecting \',\' or ' + repr(closing), self._buffer, self._pos)
+
+        self._pos += 1
+        return char == closing
+
+
+    def _value(self):
+        while True:
+            self._peek()
+
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._read_value():
+                    continue
+                raise
+
+            #A number at the end of the buffer may carry on in the next chunk
+            if isinstance(value, (int, float)) and not self._buffer[end:].strip(NUMBER_CHARS) and self._read():
+                continue
+
+            self._pos = end
+            return value
+
+
+def iter_json_array(chunks, key, encoding='utf-8'):
+    """
+    Generator over the items of the array under key in a JSON object read from
+    chunks. See JSONArrayStream.
+    """
+    return iter(JSONArrayStream(chunks, key, encoding))
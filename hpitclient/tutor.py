@@ -16,8 +16,6 @@ class Tutor(MessageSenderMixin):
         self.poll_wait = 500
         self.time_last_poll = time.time() * 1000
         self.block_timeout_time = 5
-        
-        self.blocking_store = {}
 
         for k, v in kwargs.items():
             setattr(self, k, v)
@@ -26,31 +24,22 @@ class Tutor(MessageSenderMixin):
         """
         This is a special variant of the send message that will halt a tutor until
         a response is received.  It will time out after a set amount of time.
+
+        With a response cache enabled, cached responses are returned straight away.
         """
         
-        def get_blocking_callback(message_id):
-            def blocking_callback(response):
-                self.blocking_store[message_id] = response
-            
-            self.blocking_store[message_id] = None
-            return blocking_callback
-        
         if message_name == "transaction":
             raise InvalidMessageNameException("Cannot use message_name 'transaction'.  Use send_transaction() method for datashop transactions.")
-            
-        response = self._post_data('message', {
-            'name': message_name,
-            'payload': payload
-        }).json()
-        
-        self.response_callbacks[response['message_id']] = get_blocking_callback(response["message_id"])
-        
+
+        received = []
+        self._send_message(message_name, payload, received.append)
+
         block_start_time = time.time()
         block_current_time = block_start_time
         
-        while not self.blocking_store[response["message_id"]]:
+        while not received:
             cur_time = time.time() * 1000
-            if cur_time - self.time_last_poll < self.poll_wait:
+            if cur_time - self.time_last_poll < self.poll_wait and not self.poll_saturated:
                 continue;
                 
             block_current_time = time.time()
@@ -58,6 +47,7 @@ class Tutor(MessageSenderMixin):
                 return None
 
             self.time_last_poll = cur_time
+            self.poll_saturated = False
 
             responses = self._poll_responses()
             
@@ -66,15 +56,15 @@ class Tutor(MessageSenderMixin):
                 break;
                 
             
-        rv = self.blocking_store[response["message_id"]]
-        del self.blocking_store[response["message_id"]]
-        return rv
+        return received[0] if received else None
 
     def start(self):
         """
         Starts the tutor in event-driven mode.
         """
         self.connect()
+
+        previous_sigterm = self._install_sigterm_handler()
         
         try:
             while self.run_loop:
@@ -84,18 +74,23 @@ class Tutor(MessageSenderMixin):
                 #A better timer
                 cur_time = time.time() * 1000
 
-                if cur_time - self.time_last_poll < self.poll_wait:
+                if cur_time - self.time_last_poll < self.poll_wait and not self.poll_saturated:
                     continue;
 
                 self.time_last_poll = cur_time
+                self.poll_saturated = False
 
                 responses = self._poll_responses()
 
                 if not self._dispatch_responses(responses):
                     break;
 
+                self.flush_rate_limited()
+
         except KeyboardInterrupt:
             pass
+        finally:
+            self._restore_sigterm_handler(previous_sigterm)
 
         self.disconnect()
 
@@ -40,4 +40,8 @@ setup(name='hpitclient',
     packages=['hpitclient'],
     classifiers=classifiers,
     install_requires=requirements,
+    extras_require={
+        'msgpack': ['msgpack>=0.6'],
+        'zstd': ['zstandard'],
+    },
 )
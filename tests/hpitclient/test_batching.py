@@ -0,0 +1,114 @@
+import sure
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.batching import MessageBatcher
+from unittest.mock import MagicMock
+
+class TestMessageBatcher(unittest.TestCase):
+
+    def test_flush(self):
+        """
+        MessageBatcher.flush() Test plan:
+            -ensure full batches are delivered immediately
+            -ensure partial batches are held until max_wait passes
+            -ensure force delivers everything
+        """
+        callback = MagicMock()
+        subject = MessageBatcher(callback, max_batch_size=2, max_wait=10)
+
+        for i in range(5):
+            subject.add(i)
+
+        subject.flush(now=subject._oldest).should.equal(4)
+        callback.assert_called_with([2, 3])
+        len(subject).should.equal(1)
+
+        subject.flush(now=subject._oldest + 1).should.equal(0)
+        subject.flush(force=True).should.equal(1)
+        callback.assert_called_with([4])
+        subject.batches_delivered.should.equal(3)
+
+    def test_flush_leftover_age(self):
+        """
+        MessageBatcher.flush() Test plan:
+            -ensure payloads left over from a full batch keep their own age
+        """
+        callback = MagicMock()
+        subject = MessageBatcher(callback, max_batch_size=2, max_wait=10)
+
+        for i in range(3):
+            subject.add(i)
+        added = subject._oldest
+
+        subject.flush(now=added + 5).should.equal(2)
+        subject.flush(now=added + 11).should.equal(1)
+        callback.assert_called_with([2])
+
+    def test_flush_unlimited_size(self):
+        """
+        MessageBatcher.flush() Test plan:
+            -ensure max_wait holds payloads when there is no max_batch_size
+            -ensure everything pending goes out as one batch once it has waited
+        """
+        callback = MagicMock()
+        subject = MessageBatcher(callback, max_batch_size=None, max_wait=10)
+
+        subject.add(1)
+        subject.add(2)
+        added = subject._oldest
+
+        subject.flush(now=added).should.equal(0)
+        callback.called.should.equal(False)
+
+        subject.flush(now=added + 11).should.equal(2)
+        callback.assert_called_once_with([1, 2])
+
+    def test_plugin_subscribe_batch(self):
+        """
+        Plugin.subscribe_batch() Test plan:
+            -ensure a poll's messages of one name reach the callback as one list
+            -ensure send_responses posts a response per message
+        """
+        plugin = Plugin(1234, 4567)
+        plugin._post_data = MagicMock()
+
+        def batch_callback(payloads):
+            plugin.send_responses([(p['message_id'], {'ok': True}) for p in payloads])
+
+        plugin.subscribe_batch(test_event=batch_callback)
+
+        plugin._dispatch([
+            {"message_id": str(i), "sender_entity_id": '2', "message_name": "test_event", "time_created": "now", "message": {}}
+            for i in range(3)
+        ])
+
+        plugin._post_data.assert_any_call('response', {'message_id': '2', 'payload': {'ok': True}}, retry=True)
+        plugin._post_data.call_count.should.equal(4)
+
+    def test_transaction_batches(self):
+        """
+        Plugin.register_transaction_batch_callback() and iter_transactions() Test plan:
+            -ensure a poll's transactions reach the batch callback as one list
+            -ensure iter_transactions yields batches of at most batch_size
+        """
+        transactions = {"transactions": [
+            {"message_id": str(i), "sender_entity_id": '2', "message_name": "transaction", "time_created": "now", "message": {"i": i}}
+            for i in range(3)
+        ]}
+
+        plugin = Plugin(1234, 4567)
+        plugin._post_data = MagicMock()
+        plugin._get_data = MagicMock(return_value=transactions)
+
+        callback = MagicMock()
+        plugin.register_transaction_batch_callback(callback)
+        plugin._handle_transactions()
+        callback.call_count.should.equal(1)
+        len(callback.call_args[0][0]).should.equal(3)
+
+        plugin.poll_wait = 0
+        stream = plugin.iter_transactions(batch_size=2)
+        [p['i'] for p in next(stream)].should.equal([0, 1])
+        [p['i'] for p in next(stream)].should.equal([2])
+        plugin._get_data.call_count.should.equal(2)
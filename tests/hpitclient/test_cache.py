@@ -0,0 +1,133 @@
+import sure
+import time
+import unittest
+import threading
+from contextlib import contextmanager
+
+from hpitclient.cache import TTLCache
+from hpitclient.message_sender_mixin import MessageSenderMixin
+from hpitclient.exceptions import ResourceNotFoundError
+from unittest.mock import MagicMock
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_get_or_load(self):
+        """
+        TTLCache.get_or_load() Test plan:
+            -ensure the loader is only called on a miss
+            -ensure hits and misses are counted
+            -ensure invalidate forces a reload
+            -ensure least recently used entries are evicted past max_size
+        """
+        subject = TTLCache(ttl=60, max_size=2)
+        loader = MagicMock(return_value='4')
+
+        subject.get_or_load('a', loader).should.equal('4')
+        subject.get_or_load('a', loader).should.equal('4')
+        loader.call_count.should.equal(1)
+        subject.hits.should.equal(1)
+        subject.misses.should.equal(1)
+
+        subject.invalidate('a')
+        subject.get_or_load('a', loader)
+        loader.call_count.should.equal(2)
+
+        subject.set('b', 1)
+        subject.get('a')
+        subject.set('c', 1)
+        ('a' in subject).should.equal(True)
+        ('b' in subject).should.equal(False)
+
+    def test_negative_ttl(self):
+        """
+        TTLCache.set() Test plan:
+            -ensure None results expire after negative_ttl
+        """
+        subject = TTLCache(ttl=60, negative_ttl=0.01)
+        subject.set('missing', None)
+        subject.set('found', 1)
+        time.sleep(0.02)
+        ('missing' in subject).should.equal(False)
+        ('found' in subject).should.equal(True)
+
+    def test_get_message_owner_cached(self):
+        """
+        MessageSenderMixin.get_message_owner() with a metadata cache Test plan:
+            -ensure repeated lookups only hit HPIT once
+            -ensure a missing owner is cached as None
+        """
+        subject = MessageSenderMixin()
+        subject.enable_metadata_cache()
+        subject._get_data = MagicMock(return_value={'owner': '4'})
+
+        subject.get_message_owner('thing').should.equal('4')
+        subject.get_message_owner('thing').should.equal('4')
+        subject._get_data.call_count.should.equal(1)
+
+        subject._get_data = MagicMock(side_effect=ResourceNotFoundError)
+        subject.get_message_owner('other').should.equal(None)
+        subject.get_message_owner('other').should.equal(None)
+        subject._get_data.call_count.should.equal(1)
+        subject.metadata_cache.stats()['hits'].should.equal(2)
+
+    def test_refresh_ahead(self):
+        """
+        TTLCache.get_or_load() with refresh_ahead Test plan:
+            -ensure an ageing entry is returned and reloaded in the background
+            -ensure the reload runs inside refresh_context
+            -ensure a reload whose key is invalidated while it runs is dropped
+        """
+        started = threading.Event()
+        release = threading.Event()
+        contexts = []
+
+        @contextmanager
+        def refresh_context():
+            contexts.append(threading.current_thread())
+            yield
+
+        def slow_loader():
+            started.set()
+            release.wait(1)
+            return 'new'
+
+        subject = TTLCache(ttl=0.1, refresh_ahead=0.5, refresh_context=refresh_context)
+        subject.set('a', 'old')
+        time.sleep(0.06)
+
+        subject.get_or_load('a', slow_loader).should.equal('old')
+        started.wait(1).should.equal(True)
+        subject.invalidate('a')
+        release.set()
+
+        contexts[0].join(1)
+
+        contexts.should.have.length_of(1)
+        contexts[0].should_not.equal(threading.current_thread())
+        ('a' in subject).should.equal(False)
+
+        subject.set('b', 'old')
+        time.sleep(0.06)
+        subject.get_or_load('b', MagicMock(return_value='new')).should.equal('old')
+        for _ in range(100):
+            if subject.get('b') == 'new':
+                break
+            time.sleep(0.01)
+
+        subject.get('b').should.equal('new')
+
+    def test_metadata_refresh_session(self):
+        """
+        MessageSenderMixin.enable_metadata_cache() with background_refresh Test plan:
+            -ensure background reloads go through a session other than self.session
+            -ensure the thread's session is cleared afterwards
+        """
+        subject = MessageSenderMixin()
+        subject.enable_metadata_cache(background_refresh=True)
+        sessions = []
+
+        with subject.metadata_cache.refresh_context():
+            sessions.append(subject._current_session())
+
+        sessions[0].should_not.equal(subject.session)
+        subject._current_session().should.equal(subject.session)
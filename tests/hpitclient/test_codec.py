@@ -0,0 +1,91 @@
+import sure
+import unittest
+import httpretty
+
+from hpitclient import Plugin
+from hpitclient.codec import CODECS, JSON_CODEC, get_codec, codec_for_content_type, accept_header, msgpack
+from hpitclient.exceptions import InvalidParametersError
+
+class TestCodec(unittest.TestCase):
+
+    def test_codec_for_content_type(self):
+        """
+        codec_for_content_type() Test plan:
+            -ensure JSON is found with or without parameters
+            -ensure unknown or missing content types give None
+            -ensure unknown wire formats are rejected
+        """
+        codec_for_content_type('application/json; charset=utf-8').should.equal(JSON_CODEC)
+        codec_for_content_type('text/html').should.equal(None)
+        codec_for_content_type(None).should.equal(None)
+        accept_header(JSON_CODEC).should.equal('application/json')
+
+        get_codec.when.called_with('xml').should.throw(InvalidParametersError)
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    @httpretty.activate
+    def test_negotiation(self):
+        """
+        RequestsMixin.set_wire_format() Test plan:
+            -ensure requests are sent as JSON until the server answers in msgpack
+            -ensure msgpack responses are decoded
+            -ensure a 415 sends requests back to JSON
+        """
+        codec = CODECS['msgpack']
+
+        httpretty.register_uri(httpretty.POST, "https://www.hpit-project.org/message",
+                                responses=[
+                                    httpretty.Response(body=codec.encode({"message_id": "1"}), content_type=codec.content_type),
+                                    httpretty.Response(body=codec.encode({"message_id": "2"}), content_type=codec.content_type),
+                                    httpretty.Response(body='', status=415),
+                                    httpretty.Response(body='{"message_id": "3"}', content_type='application/json'),
+                                ])
+
+        subject = Plugin(1234, 4567)
+        subject.set_wire_format('msgpack')
+
+        subject.send('test_event', {'thing': 1}).should.equal({"message_id": "1"})
+        httpretty.last_request().headers['content-type'].should.equal('application/json')
+        httpretty.last_request().headers['accept'].should.equal('application/msgpack, application/json;q=0.5')
+        subject.request_codec.should.equal(codec)
+
+        subject.send('test_event', {'thing': 2}).should.equal({"message_id": "2"})
+        codec.decode(httpretty.last_request().body).should.equal({'name': 'test_event', 'payload': {'thing': 2}})
+
+        subject.send('test_event', {'thing': 3}).should.equal({"message_id": "3"})
+        httpretty.last_request().headers['content-type'].should.equal('application/json')
+        subject.request_codec.should.equal(JSON_CODEC)
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    @httpretty.activate
+    def test_rejected_codec(self):
+        """
+        RequestsMixin._negotiate_wire_format() Test plan:
+            -ensure a server that answers in msgpack but refuses msgpack bodies only
+             costs one 415
+            -ensure set_wire_format() negotiates again
+        """
+        codec = CODECS['msgpack']
+        sent = []
+
+        def message_endpoint(request, uri, headers):
+            sent.append(request.headers['content-type'])
+            headers['content-type'] = codec.content_type
+            if request.headers['content-type'] == codec.content_type:
+                return (415, headers, b'')
+            return (200, headers, codec.encode({"message_id": "1"}))
+
+        httpretty.register_uri(httpretty.POST, "https://www.hpit-project.org/message", body=message_endpoint)
+
+        subject = Plugin(1234, 4567)
+        subject.set_wire_format('msgpack')
+
+        for i in range(4):
+            subject.send('test_event', {'thing': i}).should.equal({"message_id": "1"})
+
+        sent.should.equal(['application/json', codec.content_type] + ['application/json'] * 3)
+        subject.request_codec.should.equal(JSON_CODEC)
+
+        subject.set_wire_format('msgpack')
+        subject.send('test_event', {'thing': 5})
+        subject.request_codec.should.equal(codec)
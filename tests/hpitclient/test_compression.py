@@ -0,0 +1,135 @@
+import gzip
+import json
+import sure
+import unittest
+import httpretty
+from concurrent.futures import ThreadPoolExecutor
+
+from hpitclient import Plugin
+from hpitclient.codec import CODECS, msgpack
+from hpitclient.compression import RequestCompressor, decompress
+from hpitclient.exceptions import InvalidParametersError
+
+class TestRequestCompressor(unittest.TestCase):
+
+    def test_compress(self):
+        """
+        RequestCompressor.compress() Test plan:
+            -ensure bodies under the threshold are left alone
+            -ensure the most specific policy applies
+            -ensure ratio and CPU time are reported
+            -ensure unknown encodings are rejected
+        """
+        subject = RequestCompressor()
+        subject.set_policy('*', 'gzip', threshold=100)
+        subject.set_policy('response', 'deflate', threshold=0)
+
+        body = b'{"text": "' + b'a' * 1000 + b'"}'
+
+        subject.compress('https://www.hpit-project.org/message', b'{}').should.equal((b'{}', None))
+
+        compressed, encoding = subject.compress('https://www.hpit-project.org/message', body)
+        encoding.should.equal('gzip')
+        decompress(compressed, 'gzip').should.equal(body)
+
+        subject.compress('https://www.hpit-project.org/response', body)[1].should.equal('deflate')
+
+        stats = subject.stats()['gzip']
+        stats['compressed'].should.equal(1)
+        stats['skipped'].should.equal(1)
+        (stats['ratio'] < 0.1).should.equal(True)
+        (stats['cpu_time'] >= 0).should.equal(True)
+
+        subject.set_policy.when.called_with('*', 'lzma').should.throw(InvalidParametersError)
+
+    def test_compress_threads(self):
+        """
+        RequestCompressor.compress() Test plan:
+            -ensure stats add up when several threads compress at once
+        """
+        subject = RequestCompressor()
+        subject.set_policy('*', 'gzip', threshold=100)
+        body = b'{"text": "' + b'a' * 1000 + b'"}'
+
+        def compress_many():
+            for _ in range(200):
+                subject.compress('https://www.hpit-project.org/message', body)
+                subject.compress('https://www.hpit-project.org/message', b'{}')
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(8):
+                executor.submit(compress_many)
+
+        stats = subject.stats()['gzip']
+        stats['compressed'].should.equal(1600)
+        stats['skipped'].should.equal(1600)
+        stats['bytes_in'].should.equal(1600 * len(body))
+
+    @httpretty.activate
+    def test_plugin_compression(self):
+        """
+        RequestsMixin.set_compression() Test plan:
+            -ensure large bodies are sent compressed with a Content-Encoding
+            -ensure a 415 sends the request again uncompressed
+        """
+        httpretty.register_uri(httpretty.POST, "https://www.hpit-project.org/response",
+                                responses=[
+                                    httpretty.Response(body='{}'),
+                                    httpretty.Response(body='', status=415),
+                                    httpretty.Response(body='{}'),
+                                ])
+
+        subject = Plugin(1234, 4567)
+        subject.set_compression('gzip', threshold=10, endpoint='response')
+
+        subject.send_response('1', {'text': 'a' * 100})
+        httpretty.last_request().headers['content-encoding'].should.equal('gzip')
+        json.loads(gzip.decompress(httpretty.last_request().body)).should.equal({'message_id': '1', 'payload': {'text': 'a' * 100}})
+
+        subject.send_response('2', {'text': 'a' * 100})
+        httpretty.last_request().headers.get('content-encoding').should.equal(None)
+        json.loads(httpretty.last_request().body).should.equal({'message_id': '2', 'payload': {'text': 'a' * 100}})
+
+        subject.send_response('3', {'text': 'a' * 100})
+        httpretty.last_request().headers.get('content-encoding').should.equal(None)
+
+    def test_set_policy_threshold(self):
+        """
+        RequestCompressor.set_policy() Test plan:
+            -ensure a missing or negative threshold is rejected
+        """
+        subject = RequestCompressor()
+        subject.set_policy.when.called_with('*', 'gzip', threshold=None).should.throw(InvalidParametersError)
+        subject.set_policy.when.called_with('*', 'gzip', threshold=-1).should.throw(InvalidParametersError)
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    @httpretty.activate
+    def test_refused_format_with_compression(self):
+        """
+        RequestsMixin._send_post() Test plan:
+            -ensure a 415 for the format of a compressed body doesn't stop compression
+            -ensure the request falls back to JSON, still compressed
+        """
+        codec = CODECS['msgpack']
+        sent = []
+
+        def response_endpoint(request, uri, headers):
+            sent.append((request.headers['content-type'], request.headers.get('content-encoding')))
+            if request.headers['content-type'] == codec.content_type:
+                return (415, headers, '')
+            return (200, headers, '{}')
+
+        httpretty.register_uri(httpretty.POST, "https://www.hpit-project.org/response", body=response_endpoint)
+
+        subject = Plugin(1234, 4567)
+        subject.set_compression('gzip', threshold=10, endpoint='response')
+        subject.request_codec = codec
+
+        subject.send_response('1', {'text': 'a' * 100})
+
+        sent.should.equal([
+            (codec.content_type, 'gzip'),
+            (codec.content_type, None),
+            ('application/json', 'gzip'),
+        ])
+        subject.request_compressor.rejected.should.equal(set())
@@ -0,0 +1,77 @@
+import sure
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.dedup import MessageDeduplicator
+from unittest.mock import MagicMock
+
+class TestMessageDeduplicator(unittest.TestCase):
+
+    def test_check(self):
+        """
+        MessageDeduplicator.check() Test plan:
+            -ensure new ids are accepted and repeats are rejected
+            -ensure ids are forgotten after the window passes
+            -ensure the seen-set never grows past max_size
+        """
+        subject = MessageDeduplicator(window=10, max_size=2)
+
+        subject.check('1', now=0).should.equal(True)
+        subject.check('1', now=5).should.equal(False)
+        subject.check('1', now=11).should.equal(True)
+
+        subject.check('2', now=12)
+        subject.check('3', now=12)
+        len(subject).should.equal(2)
+
+        subject.stats().should.equal({'accepted': 4, 'duplicates': 1, 'tracked': 2})
+
+    def test_plugin_dispatch(self):
+        """
+        Plugin._dispatch() with deduplication Test plan:
+            -ensure a redelivered message only reaches its callback once
+            -ensure a redelivered response only reaches its callback once
+        """
+        plugin = Plugin(1234, 4567)
+        plugin.enable_deduplication()
+        plugin.callbacks["test_event"] = MagicMock()
+
+        message = {"message_id": '1', "sender_entity_id": '2', "message_name": "test_event", "time_created": "now", "message": {}}
+        plugin._dispatch([message, dict(message, message={})])
+        plugin.callbacks["test_event"].call_count.should.equal(1)
+
+        plugin.response_callbacks["1"] = MagicMock()
+        response = {"message": {"message_id": "1", "receiver_entity_id": "9"}, "response": {}}
+        plugin._dispatch_responses([response, response])
+        plugin.response_callbacks["1"].call_count.should.equal(1)
+        plugin.response_deduplicator.duplicates.should.equal(1)
+
+    def test_failed_callback(self):
+        """
+        Plugin._dispatch() with deduplication Test plan:
+            -ensure a message whose callback raised is handled when redelivered
+            -ensure the same for transactions and responses
+        """
+        plugin = Plugin(1234, 4567)
+        plugin.enable_deduplication()
+        plugin.callbacks["test_event"] = MagicMock(side_effect=[ValueError, None])
+
+        message = {"message_id": '1', "sender_entity_id": '2', "message_name": "test_event", "time_created": "now", "message": {}}
+        with self.assertRaises(ValueError):
+            plugin._dispatch([message])
+        plugin._dispatch([message])
+        plugin.callbacks["test_event"].call_count.should.equal(2)
+
+        plugin.transaction_callback = MagicMock(side_effect=[ValueError, None])
+        transaction = dict(message, message_id='3', message_name="transaction")
+        with self.assertRaises(ValueError):
+            plugin._handle_transactions([transaction])
+        plugin._handle_transactions([transaction])
+        plugin.transaction_callback.call_count.should.equal(2)
+
+        plugin.response_callbacks["1"] = MagicMock(side_effect=[ValueError, None])
+        response = {"message": {"message_id": "1", "receiver_entity_id": "9"}, "response": {}}
+        with self.assertRaises(ValueError):
+            plugin._dispatch_responses([response])
+        plugin._dispatch_responses([response])
+        plugin.response_callbacks["1"].call_count.should.equal(2)
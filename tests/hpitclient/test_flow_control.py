@@ -0,0 +1,41 @@
+import sure
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.flow_control import FlowController
+from hpitclient.exceptions import InvalidParametersError
+
+class TestFlowController(unittest.TestCase):
+
+    def test_update(self):
+        """
+        FlowController.update() Test plan:
+            -ensure polling pauses at the high water mark
+            -ensure polling stays paused until the low water mark
+        """
+        subject = FlowController(10, 4)
+
+        subject.update(9).should.equal(True)
+        subject.update(10).should.equal(False)
+        subject.update(5).should.equal(False)
+        subject.update(4).should.equal(True)
+        subject.stats().should.equal({'depth': 4, 'max_depth': 10, 'paused': False, 'pause_count': 1})
+
+        with self.assertRaises(InvalidParametersError):
+            FlowController(10, 10)
+
+    def test_plugin_backlog(self):
+        """
+        Plugin flow control Test plan:
+            -ensure only max_dispatch_per_tick messages are taken from the backlog
+            -ensure the plugin stops accepting work when the backlog is full
+        """
+        plugin = Plugin(1234, 4567)
+        plugin.enable_flow_control(high_water=3, max_dispatch_per_tick=2)
+        plugin.message_backlog.extend(range(5))
+
+        plugin._accepting_work().should.equal(False)
+        plugin._take_backlog().should.equal([0, 1])
+        plugin._take_backlog().should.equal([2, 3])
+        plugin.backlog_depth.should.equal(1)
+        plugin._accepting_work().should.equal(True)
@@ -0,0 +1,73 @@
+import sure
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.memoize import memoize_response
+from hpitclient.exceptions import InvalidParametersError
+from unittest.mock import MagicMock
+
+class SkillPlugin(Plugin):
+
+    def __init__(self):
+        super().__init__(1234, 4567)
+        self.lookups = 0
+        self.send_response = MagicMock()
+
+    @memoize_response('student_id', 'skill', ttl=60, invalidate_on='kt_reset')
+    def kt_get_skill(self, message):
+        self.lookups += 1
+        return {'probability_known': 0.5}
+
+    def kt_reset(self, message):
+        pass
+
+
+def make_message(message_id, message_name='kt_get_skill', **payload):
+    return {'message_id': message_id, 'sender_entity_id': '2', 'message_name': message_name, 'time_created': 'now', 'message': payload}
+
+
+class TestMemoizeResponse(unittest.TestCase):
+
+    def test_memoize_response(self):
+        """
+        memoize_response() Test plan:
+            -ensure a repeated message is answered from the cache without calling the handler
+            -ensure messages lacking a field aren't cached
+            -ensure invalidate() and invalidate_on messages drop cached responses
+            -ensure hits and misses are counted
+        """
+        subject = SkillPlugin()
+        subject.callbacks['kt_get_skill'] = subject.kt_get_skill
+        subject.callbacks['kt_reset'] = subject.kt_reset
+
+        subject._dispatch([
+            make_message('1', student_id='1', skill='addition', extra=1),
+            make_message('2', student_id='1', skill='addition', extra=2),
+            make_message('3', student_id='2', skill='addition'),
+            make_message('4', student_id='2'),
+        ])
+
+        subject.lookups.should.equal(3)
+        subject.send_response.assert_any_call('2', {'probability_known': 0.5})
+        subject.send_response.call_count.should.equal(4)
+
+        subject.kt_get_skill.invalidate(student_id='1', skill='addition')
+        subject._dispatch([make_message('5', student_id='1', skill='addition')])
+        subject.lookups.should.equal(4)
+
+        subject._dispatch([
+            make_message('6', 'kt_reset', student_id='1', skill='addition'),
+            make_message('7', student_id='1', skill='addition'),
+            make_message('8', student_id='2', skill='addition'),
+        ])
+        subject.lookups.should.equal(5)
+
+        stats = subject.kt_get_skill.stats()
+        stats['hits'].should.equal(2)
+        stats['misses'].should.equal(4)
+        stats['uncached'].should.equal(1)
+
+        subject.kt_get_skill.clear()
+        len(subject.kt_get_skill.cache).should.equal(0)
+        subject.kt_get_skill.invalidate.when.called_with(student_id='1').should.throw(InvalidParametersError)
+        memoize_response.when.called_with('student_id', ttl=0).should.throw(InvalidParametersError)
@@ -0,0 +1,54 @@
+import json
+import sure
+import unittest
+from types import MappingProxyType
+
+from hpitclient.message import Message, Response, json_default
+
+class TestMessage(unittest.TestCase):
+
+    def test_from_item(self):
+        """
+        Message.from_item() Test plan:
+            -ensure the message reads as a dict of the payload with the metadata added
+            -ensure the metadata attributes are read-only and unaffected by the dict
+            -ensure the polled payload isn't changed
+        """
+        item = {"message_id": '1234', "sender_entity_id": '4567', "message_name": "test_event",
+                "time_created": 'now', "message": {"thing": "test message"}}
+        subject = Message.from_item(item)
+
+        isinstance(subject, dict).should.equal(True)
+        subject.should.equal({"thing": "test message", "message_id": '1234', "sender_entity_id": '4567', "time_created": 'now'})
+        json.loads(json.dumps(subject)).should.equal(subject)
+        subject.message_name.should.equal("test_event")
+
+        subject['message_id'] = 'changed'
+        subject.message_id.should.equal('1234')
+        with self.assertRaises(AttributeError):
+            subject.message_id = 'changed'
+
+        subject.payload.should.equal({"thing": "test message"})
+        item['message'].should.equal({"thing": "test message"})
+
+class TestResponse(unittest.TestCase):
+
+    def test_from_item(self):
+        """
+        Response.from_item() Test plan:
+            -ensure the message id, receiver and payload are read from the item
+            -ensure items without a message id raise KeyError
+        """
+        subject = Response.from_item({"message": {"message_id": "4", "receiver_entity_id": "9"}, "response": {"ok": True}})
+        subject.message_id.should.equal("4")
+        subject.receiver_entity_id.should.equal("9")
+        subject.payload.should.equal({"ok": True})
+
+        Response.from_item.when.called_with({"message": {}, "response": {}}).should.throw(KeyError)
+
+    def test_json_default(self):
+        """
+        json_default() Test plan:
+            -ensure mappings that aren't dicts are encoded as dicts
+        """
+        json.loads(json.dumps({"a": MappingProxyType({"b": 1})}, default=json_default)).should.equal({"a": {"b": 1}})
@@ -0,0 +1,118 @@
+import sure
+import unittest
+import httpretty
+from concurrent.futures import ThreadPoolExecutor
+
+from hpitclient import Plugin
+from hpitclient.middleware import MiddlewarePipeline
+from hpitclient.exceptions import InvalidParametersError
+from unittest.mock import MagicMock
+
+class TestMiddlewarePipeline(unittest.TestCase):
+
+    def test_compile(self):
+        """
+        MiddlewarePipeline.compile() Test plan:
+            -ensure middleware runs in the order it was added
+            -ensure middleware can transform or short-circuit
+            -ensure phases without middleware compile to None
+            -ensure per-stage timings are kept
+        """
+        calls = []
+
+        def upper(next_handler):
+            def handler(value):
+                calls.append('upper')
+                return next_handler(value.upper())
+            return handler
+
+        def block_secrets(next_handler):
+            def handler(value):
+                calls.append('block_secrets')
+                if value == 'SECRET':
+                    return None
+                return next_handler(value)
+            return handler
+
+        subject = MiddlewarePipeline({'message': lambda value: value + '!', 'response': lambda value: value})
+        subject.add('message', upper)
+        subject.add('message', block_secrets)
+
+        subject.handler('message')('hello').should.equal('HELLO!')
+        calls.should.equal(['upper', 'block_secrets'])
+        subject.handler('message')('secret').should.equal(None)
+        subject.handler('response').should.equal(None)
+
+        stats = subject.stats()['message']
+        list(stats.keys()).should.equal(['upper', 'block_secrets', 'handler'])
+        stats['upper']['calls'].should.equal(2)
+        stats['handler']['calls'].should.equal(1)
+        (stats['upper']['self_time'] <= stats['upper']['total_time']).should.equal(True)
+
+        subject.add.when.called_with('request', upper).should.throw(InvalidParametersError)
+        subject.add.when.called_with('message', 'upper').should.throw(InvalidParametersError)
+
+        subject.remove('message')
+        subject.handler('message').should.equal(None)
+
+    def test_concurrent_timings(self):
+        """
+        MiddlewarePipeline timings Test plan:
+            -ensure no calls are lost when requests are handled from several threads
+        """
+        subject = MiddlewarePipeline({'request': lambda value: value})
+        subject.add('request', lambda next_handler: next_handler, name='pass')
+        handler = subject.handler('request')
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(handler, range(20000)))
+
+        subject.stats()['request']['pass']['calls'].should.equal(20000)
+        subject.stats()['request']['handler']['calls'].should.equal(20000)
+
+    @httpretty.activate
+    def test_plugin_middleware(self):
+        """
+        Plugin.use_middleware() Test plan:
+            -ensure request middleware can change what is posted
+            -ensure message middleware can answer without the callback running
+            -ensure response middleware sees Response objects
+        """
+        httpretty.register_uri(httpretty.POST, "https://www.hpit-project.org/response", body='{}')
+
+        def tag_requests(next_handler):
+            def handler(request):
+                request.data = dict(request.data, client='test')
+                return next_handler(request)
+            return handler
+
+        subject = Plugin(1234, 4567)
+        subject.callbacks['test_event'] = MagicMock()
+
+        def answer_pings(next_handler):
+            def handler(message):
+                if message['message'].get('ping'):
+                    subject.send_response(message['message_id'], {'pong': True})
+                    return None
+                return next_handler(message)
+            return handler
+
+        subject.use_middleware('request', tag_requests)
+        subject.use_middleware('message', answer_pings)
+
+        subject._dispatch([
+            {'message_id': '1', 'sender_entity_id': '2', 'message_name': 'test_event', 'time_created': 'now', 'message': {'ping': True}},
+            {'message_id': '3', 'sender_entity_id': '2', 'message_name': 'test_event', 'time_created': 'now', 'message': {}},
+        ])
+
+        subject.callbacks['test_event'].call_count.should.equal(1)
+        httpretty.last_request().body.should.equal(b'{"message_id": "1", "payload": {"pong": true}, "client": "test"}')
+
+        seen = []
+        subject.use_middleware('response', lambda next_handler: lambda response: seen.append(response.message_id) or next_handler(response), name='seen')
+        subject.response_callbacks['4'] = MagicMock()
+        subject._dispatch_responses([{'message': {'message_id': '4'}, 'response': {'answer': 1}}])
+
+        seen.should.equal(['4'])
+        subject.response_callbacks['4'].assert_called_once_with({'answer': 1})
+        set(subject.middleware_stats().keys()).should.equal({'request', 'message', 'response'})
@@ -3,7 +3,7 @@ import unittest
 import httpretty
 
 from hpitclient import Plugin
-from hpitclient.exceptions import PluginPollError, BadCallbackException, InvalidParametersError
+from hpitclient.exceptions import PluginPollError, BadCallbackException, InvalidParametersError, AuthenticationError
 
 import json
 import shlex
@@ -188,7 +188,7 @@ class TestPlugin(unittest.TestCase):
         self.test_plugin.transaction_callback= MagicMock()
         
         self.test_plugin._handle_transactions().should.equal(True)
-        self.test_plugin.transaction_callback.assert_called_with(event_param["transactions"][0]["message"])
+        self.test_plugin.transaction_callback.assert_called_with({"thing": "test message", "message_id": '1234', "sender_entity_id": '4567', "time_created": time})
         self.test_plugin.transaction_callback.call_count.should.equal(2)
 
     wildCardCalled = False
@@ -348,3 +348,141 @@ class TestPlugin(unittest.TestCase):
             })
         json_string = shlex.quote(json_string)
         self.test_plugin.get_shared_messages(None).should.equal(None)
+
+
+    def test_sync_subscriptions(self):
+        """
+        Plugin.sync_subscriptions() Test plan:
+            -ensure subscriptions are only fetched once
+            -ensure only missing names are subscribed and stale names unsubscribed
+            -ensure callbacks match the desired subscriptions
+        """
+        def test_callback(payload):
+            pass
+
+        self.test_plugin._get_data = MagicMock(return_value={"subscriptions": ["keep", "stale", "transaction"]})
+        self.test_plugin._post_data = MagicMock()
+        self.test_plugin.callbacks["stale"] = test_callback
+
+        result = self.test_plugin.sync_subscriptions({"keep": test_callback, "new": test_callback})
+
+        self.test_plugin._get_data.call_count.should.equal(1)
+        result.should.equal({"subscribed": ["new"], "unsubscribed": ["stale"]})
+        self.test_plugin._post_data.assert_any_call('plugin/subscribe', {'message_name': 'new'}, retry=True)
+        self.test_plugin._post_data.assert_any_call('plugin/unsubscribe', {'message_name': 'stale'}, retry=True)
+        self.test_plugin._post_data.call_count.should.equal(2)
+        self.test_plugin.callbacks.should.equal({"keep": test_callback, "new": test_callback})
+
+
+    @httpretty.activate
+    def test_subscribe_partial_failure(self):
+        """
+        Plugin.subscribe() Test plan:
+            -ensure concurrent subscriptions post through their own sessions
+            -ensure cookies set on those sessions reach the plugin's session
+            -ensure subscriptions that went through are kept when another fails
+        """
+        def subscribe_endpoint(request, uri, headers):
+            if json.loads(request.body)['message_name'] == 'bad':
+                return (403, headers, '')
+            headers['Set-Cookie'] = 'session=abcd1234; Path=/'
+            return (200, headers, 'OK')
+
+        httpretty.register_uri(httpretty.POST, "https://www.hpit-project.org/plugin/subscribe", body=subscribe_endpoint)
+
+        def test_callback(payload):
+            pass
+
+        self.test_plugin.session.post = MagicMock(side_effect=AssertionError('posted through the shared session'))
+
+        self.test_plugin.subscribe.when.called_with(good=test_callback, bad=test_callback, also_good=test_callback).should.throw(AuthenticationError)
+
+        self.test_plugin.callbacks.should.equal({"good": test_callback, "also_good": test_callback})
+        self.test_plugin.session.post.called.should.equal(False)
+        self.test_plugin.session.cookies.get('session').should.equal('abcd1234')
+
+
+    def test_start_drains_on_sigterm(self):
+        """
+        Plugin.start() Test plan:
+            -ensure SIGTERM stops the event loop
+            -ensure backlogged messages are dispatched before disconnecting
+            -ensure the previous SIGTERM handler is restored
+        """
+        import os
+        import signal
+
+        messages = [{"message_id": str(i), "sender_entity_id": '2', "message_name": "test_event", "time_created": "now", "message": {}} for i in range(3)]
+        handled = []
+
+        def test_callback(payload):
+            handled.append(payload['message_id'])
+            if len(handled) == 1:
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        self.test_plugin.connect = MagicMock()
+        self.test_plugin.list_subscriptions = MagicMock()
+        self.test_plugin._poll = MagicMock(return_value=messages)
+        self.test_plugin._handle_transactions = MagicMock(return_value=True)
+        self.test_plugin._poll_responses = MagicMock(return_value=[])
+        self.test_plugin.disconnect = MagicMock(side_effect=lambda: handled.append('disconnect'))
+        self.test_plugin.callbacks["test_event"] = test_callback
+        self.test_plugin.max_dispatch_per_tick = 1
+        self.test_plugin.poll_wait = 0
+
+        previous = signal.getsignal(signal.SIGTERM)
+        self.test_plugin.start()
+
+        handled.should.equal(['0', '1', '2', 'disconnect'])
+        self.test_plugin._poll.call_count.should.equal(1)
+        signal.getsignal(signal.SIGTERM).should.equal(previous)
+
+    def test_drain(self):
+        """
+        Plugin.drain() Test plan:
+            -ensure a timeout of None drains the whole backlog
+            -ensure a timeout of 0 drops the backlog
+        """
+        handled = []
+
+        self.test_plugin.callbacks["test_event"] = lambda payload: handled.append(payload['message_id'])
+        self.test_plugin.send_log_entry = MagicMock()
+        self.test_plugin.max_dispatch_per_tick = 1
+
+        messages = [{"message_id": str(i), "sender_entity_id": '2', "message_name": "test_event", "time_created": "now", "message": {}} for i in range(3)]
+
+        self.test_plugin.message_backlog.extend(messages)
+        self.test_plugin.drain(None).should.equal(0)
+        handled.should.equal(['0', '1', '2'])
+
+        self.test_plugin.message_backlog.extend(messages)
+        self.test_plugin.drain(0).should.equal(3)
+        len(self.test_plugin.message_backlog).should.equal(0)
+
+    @httpretty.activate
+    def test_poll_limits(self):
+        """
+        Plugin.set_poll_limits() Test plan:
+            -ensure the limit is sent with the poll
+            -ensure a full page marks the poll saturated and a short one doesn't
+            -ensure limits below 1 are rejected
+        """
+        messages = [{"message_id": str(i), "sender_entity_id": '2', "message_name": "test_event", "time_created": "now", "message": {}} for i in range(2)]
+
+        httpretty.register_uri(httpretty.GET, "https://www.hpit-project.org/plugin/message/list",
+                                responses=[
+                                    httpretty.Response(body=json.dumps({"messages": messages})),
+                                    httpretty.Response(body=json.dumps({"messages": messages[:1]})),
+                                ])
+
+        self.test_plugin.set_poll_limits(messages=2)
+
+        self.test_plugin._poll().should.equal(messages)
+        httpretty.last_request().querystring.should.equal({'limit': ['2']})
+        self.test_plugin.poll_saturated.should.equal(True)
+
+        self.test_plugin.poll_saturated = False
+        self.test_plugin._poll().should.equal(messages[:1])
+        self.test_plugin.poll_saturated.should.equal(False)
+
+        self.test_plugin.set_poll_limits.when.called_with(responses=0).should.throw(InvalidParametersError)
@@ -0,0 +1,118 @@
+import sure
+import os
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.prefork import PreforkRunner
+from hpitclient.memoize import memoize_response
+from unittest.mock import MagicMock
+
+class EchoPlugin(Plugin):
+
+    def __init__(self):
+        super().__init__(1234, 4567)
+
+    def post_connect(self):
+        self.subscribe(echo=self.echo_callback)
+
+    def echo_callback(self, message):
+        self.send_response(message['message_id'], {'pid': os.getpid()})
+
+class MemoPlugin(Plugin):
+
+    def __init__(self):
+        super().__init__(1234, 4567)
+        self.lookups = 0
+
+    def post_connect(self):
+        self.subscribe(kt_get_skill=self.kt_get_skill, kt_reset=self.kt_reset)
+
+    @memoize_response('skill', invalidate_on='kt_reset')
+    def kt_get_skill(self, message):
+        self.lookups += 1
+        return {'lookups': self.lookups}
+
+    def kt_reset(self, message):
+        pass
+
+class TestPreforkRunner(unittest.TestCase):
+
+    def test_fan_out(self):
+        """
+        PreforkRunner Test plan:
+            -ensure messages are handled in worker processes
+            -ensure worker responses are sent by the supervisor
+            -ensure sticky routing keeps a sender on one worker
+        """
+        runner = PreforkRunner(EchoPlugin, workers=2, sticky=True)
+        runner.setup()
+        runner.plugin._post_data = MagicMock()
+
+        runner.plugin._dispatch([
+            {"message_id": str(i), "sender_entity_id": 'student', "message_name": "echo", "time_created": "now", "message": {}}
+            for i in range(4)
+        ])
+        runner.shutdown()
+
+        responses = [c for c in runner.plugin._post_data.call_args_list if c[0][0] == 'response']
+        len(responses).should.equal(4)
+
+        pids = set(c[0][1]['payload']['pid'] for c in responses)
+        len(pids).should.equal(1)
+        pids.should_not.contain(os.getpid())
+
+    def test_dispatch_stages(self):
+        """
+        PreforkRunner Test plan:
+            -ensure the supervisor's deduplication and middleware run before fan out
+            -ensure work queued for workers counts towards backlog_depth until done
+        """
+        runner = PreforkRunner(EchoPlugin, workers=2, sticky=False)
+        runner.setup()
+        runner.plugin._post_data = MagicMock()
+        runner.plugin.enable_deduplication()
+
+        seen = []
+        def record(next_handler):
+            def handler(message):
+                seen.append(message['message_id'])
+                return next_handler(message)
+            return handler
+        runner.plugin.use_middleware('message', record)
+
+        runner.plugin._dispatch([
+            {"message_id": str(i % 3), "sender_entity_id": 'student', "message_name": "echo", "time_created": "now", "message": {}}
+            for i in range(6)
+        ])
+        seen.should.equal(['0', '1', '2'])
+        (runner.plugin.backlog_depth <= 3).should.equal(True)
+
+        runner.shutdown()
+
+        responses = [c for c in runner.plugin._post_data.call_args_list if c[0][0] == 'response']
+        len(responses).should.equal(3)
+        runner.plugin.backlog_depth.should.equal(0)
+
+    def test_memoize_invalidation(self):
+        """
+        PreforkRunner Test plan:
+            -ensure invalidate_on messages drop memoized responses in every worker
+        """
+        runner = PreforkRunner(MemoPlugin, workers=2, sticky=True)
+        runner.setup()
+        runner.plugin._post_data = MagicMock()
+
+        senders = {}
+        for i in range(20):
+            senders.setdefault(runner._route({'sender_entity_id': str(i)}), str(i))
+
+        def message(message_id, sender, message_name, **payload):
+            return {"message_id": message_id, "sender_entity_id": sender, "message_name": message_name, "time_created": "now", "message": payload}
+
+        runner.plugin._dispatch([message('1', senders[1], 'kt_get_skill', skill='add')])
+        runner.plugin._dispatch([message('2', senders[0], 'kt_reset', skill='add')])
+        runner.plugin._dispatch([message('3', senders[1], 'kt_get_skill', skill='add')])
+        runner.shutdown()
+
+        responses = [c[0][1] for c in runner.plugin._post_data.call_args_list if c[0][0] == 'response']
+        [r['payload']['lookups'] for r in responses].should.equal([1, 2])
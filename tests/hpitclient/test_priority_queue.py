@@ -0,0 +1,69 @@
+import sure
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.priority_queue import PriorityDispatchQueue
+
+def item(name, i):
+    return {"message_name": name, "i": i}
+
+class TestPriorityDispatchQueue(unittest.TestCase):
+
+    def test_popleft(self):
+        """
+        PriorityDispatchQueue.popleft() Test plan:
+            -ensure higher priority messages come out first
+            -ensure equal priority messages come out in arrival order
+            -ensure a starved message jumps ahead
+            -ensure waits are recorded per priority
+        """
+        subject = PriorityDispatchQueue({'hint': 10}, starvation_timeout=5)
+        subject.append(item('log', 0), now=0)
+        subject.append(item('hint', 1), now=1)
+        subject.append(item('hint', 2), now=1)
+
+        subject.popleft(now=2)['i'].should.equal(1)
+        subject.popleft(now=2)['i'].should.equal(2)
+        subject.popleft(now=2)['i'].should.equal(0)
+
+        subject.append(item('log', 3), now=10)
+        subject.append(item('hint', 4), now=16)
+        subject.popleft(now=16)['i'].should.equal(3)
+
+        len(subject).should.equal(1)
+        subject.stats()[0]['count'].should.equal(2)
+        subject.stats()[10]['max_wait'].should.equal(1)
+
+    def test_set_priorities(self):
+        """
+        PriorityDispatchQueue.set_priorities() Test plan:
+            -ensure queued messages move to their new priority
+            -ensure they keep their arrival order and wait
+        """
+        subject = PriorityDispatchQueue({'hint': 10}, starvation_timeout=None)
+        subject.append(item('log', 0), now=0)
+        subject.append(item('hint', 1), now=1)
+        subject.append(item('log', 2), now=2)
+
+        subject.set_priorities({'log': 20})
+        len(subject).should.equal(3)
+
+        [subject.popleft(now=3)['i'] for _ in range(3)].should.equal([0, 2, 1])
+        subject.stats()[20]['max_wait'].should.equal(3)
+
+    def test_plugin_set_priorities(self):
+        """
+        Plugin.set_priorities() Test plan:
+            -ensure the existing backlog is kept and reordered
+            -ensure changing priorities reorders messages already queued
+        """
+        plugin = Plugin(1234, 4567)
+        plugin.message_backlog.extend([item('log', 0), item('hint', 1)])
+        plugin.set_priorities(hint=10)
+
+        [m['i'] for m in plugin._take_backlog()].should.equal([1, 0])
+
+        plugin.message_backlog.extend([item('log', 2), item('hint', 3)])
+        plugin.set_priorities(log=20)
+
+        [m['i'] for m in plugin._take_backlog()].should.equal([2, 3])
@@ -0,0 +1,56 @@
+import sure
+import unittest
+
+from hpitclient.requests_mixin import RequestsMixin
+from hpitclient.rate_limit import TokenBucket, endpoint_class
+from hpitclient.exceptions import RateLimitExceededError, InvalidParametersError
+from unittest.mock import MagicMock
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_token_bucket(self):
+        """
+        TokenBucket.try_acquire() Test plan:
+            -ensure burst capacity is available immediately
+            -ensure an empty bucket reports how long to wait
+        """
+        subject = TokenBucket(rate=1, capacity=2)
+        subject.try_acquire().should.equal(0)
+        subject.try_acquire().should.equal(0)
+        subject.try_acquire().should.be.greater_than(0)
+
+    def test_endpoint_class(self):
+        endpoint_class('message').should.equal('send')
+        endpoint_class('https://www.hpit-project.org/plugin/message/list').should.equal('poll')
+        endpoint_class('connect').should.equal(None)
+
+    def test_modes(self):
+        """
+        RequestsMixin.set_rate_limit() Test plan:
+            -ensure 'raise' mode raises once the burst is used up
+            -ensure 'queue' mode holds requests until flushed
+            -ensure only fire and forget endpoints can be queued
+            -ensure endpoints without a limit are unaffected
+        """
+        subject = RequestsMixin()
+        subject.entity_id = 'test_modes'
+        subject._send_post = MagicMock()
+
+        subject.set_rate_limit('send', rate=0.001, burst=1, mode='raise')
+        subject._post_data('message', {})
+        subject._post_data.when.called_with('message', {}).should.throw(RateLimitExceededError)
+
+        subject.set_rate_limit('log', rate=0.001, burst=1, mode='queue')
+        subject._post_data('log', {'log_entry': '1'})
+        subject._post_data('log', {'log_entry': '2'}).should.equal(None)
+        subject._send_post.call_count.should.equal(2)
+        subject.rate_limiter.pending().should.equal(1)
+
+        subject.clear_rate_limit('log')
+        subject.flush_rate_limited().should.equal(1)
+        subject._send_post.assert_called_with('log', {'log_entry': '2'}, True)
+
+        subject.set_rate_limit.when.called_with('send', 1, mode='queue').should.throw(InvalidParametersError)
+
+        subject._post_data('connect', {})
+        subject._send_post.call_count.should.equal(4)
@@ -0,0 +1,72 @@
+import sure
+import unittest
+import tempfile
+import os
+
+from hpitclient import Plugin
+from hpitclient.recorder import TrafficRecorder, TrafficReplayer
+from hpitclient.exceptions import InvalidParametersError
+from unittest.mock import MagicMock
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_record_and_replay(self):
+        """
+        TrafficRecorder/TrafficReplayer Test plan:
+            -ensure polled messages and transactions are recorded
+            -ensure empty polls are not recorded
+            -ensure replay routes messages and transactions to the handlers
+            -ensure handlers registered in post_connect are installed
+            -ensure requests and lookups made by handlers don't touch the network
+        """
+        messages = [{"message_id": '1', "sender_entity_id": '2', "message_name": "test_event", "time_created": "now", "message": {"thing": 1}}]
+        transactions = [{"message_id": '3', "sender_entity_id": '2', "message_name": "transaction", "time_created": "now", "message": {"thing": 2}}]
+
+        plugin = Plugin(1234, 4567)
+        plugin.start_recording(self.path)
+        plugin._get_data = MagicMock(return_value={"messages": messages})
+        plugin._poll()
+        plugin._get_data = MagicMock(return_value={"transactions": transactions})
+        plugin._poll_transactions()
+        plugin._get_data = MagicMock(return_value={"transactions": []})
+        plugin._poll_transactions()
+        plugin.stop_recording()
+
+        list(TrafficReplayer(self.path).records()).should.have.length_of(2)
+
+        transaction_callback = MagicMock()
+        owners = []
+
+        class ReplayedPlugin(Plugin):
+            def post_connect(self):
+                self.subscribe(test_event=self.test_callback)
+                self.register_transaction_callback(transaction_callback)
+
+            def test_callback(self, payload):
+                owners.append(self.get_message_owner(payload.message_name))
+                self.send_response(payload['message_id'], {'ok': True})
+
+        replayed = ReplayedPlugin(1234, 4567)
+
+        stats = TrafficReplayer(self.path).replay(replayed)
+
+        stats['messages'].should.equal(1)
+        stats['transactions'].should.equal(1)
+        stats['outbound_requests'].should.equal(1)
+        stats['lookups'].should.equal(1)
+        owners.should.equal([None])
+        transaction_callback.call_count.should.equal(1)
+        replayed.__dict__.should_not.have.key('_post_data')
+        replayed.__dict__.should_not.have.key('_get_data')
+
+    def test_record_unknown_kind(self):
+        recorder = TrafficRecorder(self.path)
+        recorder.record.when.called_with('bogus', [1]).should.throw(InvalidParametersError)
+        recorder.close()
@@ -0,0 +1,115 @@
+import sure
+import unittest
+import httpretty
+
+from hpitclient import Tutor
+from hpitclient.response_cache import ResponseCache, payload_digest
+from hpitclient.exceptions import InvalidParametersError
+from unittest.mock import MagicMock
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_key(self):
+        """
+        ResponseCache.key() Test plan:
+            -ensure payloads with keys in a different order share a key
+            -ensure message names without a ttl aren't cached
+            -ensure ttls and max_size must be positive
+        """
+        subject = ResponseCache({'get_student': 60})
+
+        subject.key('get_student', {'a': 1, 'b': 2}).should.equal(subject.key('get_student', {'b': 2, 'a': 1}))
+        subject.key('get_student', {'a': 1}).shouldnt.equal(subject.key('get_student', {'a': 2}))
+        subject.key('kt_trace', {'a': 1}).should.equal(None)
+        payload_digest({'a': object()}).should.equal(None)
+
+        subject.set_ttl.when.called_with('get_student', 0).should.throw(InvalidParametersError)
+        with self.assertRaises(InvalidParametersError):
+            ResponseCache({'get_student': 60}, max_size=0)
+
+    @httpretty.activate
+    def test_send_cached(self):
+        """
+        MessageSenderMixin.send() with a response cache Test plan:
+            -ensure an identical query in flight isn't sent again
+            -ensure the response reaches every waiting callback
+            -ensure repeated queries are answered from the cache
+            -ensure invalidated responses are queried again
+        """
+        sent = []
+
+        def message_endpoint(request, uri, headers):
+            sent.append(request.body)
+            return (200, headers, '{"message_id": "4"}')
+
+        httpretty.register_uri(httpretty.POST, "https://www.hpit-project.org/message", body=message_endpoint)
+
+        subject = Tutor(123, 456, None)
+        subject.enable_response_cache(get_student=60)
+
+        first = MagicMock()
+        second = MagicMock()
+
+        subject.send('get_student', {'student_id': '1'}, first).should.equal({'message_id': '4'})
+        subject.send('get_student', {'student_id': '1'}, second).should.equal({'message_id': '4', 'coalesced': True})
+        len(sent).should.equal(1)
+
+        subject._dispatch_responses([{'message': {'message_id': '4'}, 'response': {'name': 'Ann'}}])
+        first.assert_called_once_with({'name': 'Ann'})
+        second.assert_called_once_with({'name': 'Ann'})
+
+        subject.send_blocking('get_student', {'student_id': '1'}).should.equal({'name': 'Ann'})
+        len(sent).should.equal(1)
+
+        stats = subject.response_cache_stats()
+        stats['messages']['get_student'].should.equal({'hits': 1, 'misses': 2, 'coalesced': 1, 'hit_rate': 2 / 3})
+
+        subject.invalidate_responses('get_student')
+        subject.send('get_student', {'student_id': '1'})
+        len(sent).should.equal(2)
+
+    def test_inflight_timeout(self):
+        """
+        ResponseCache.inflight() Test plan:
+            -ensure queries in flight past inflight_timeout are forgotten with their waiters
+            -ensure the query's own callback still gets a late response
+        """
+        subject = ResponseCache({'get_student': 60}, inflight_timeout=30)
+        key = subject.key('get_student', {'student_id': '1'})
+
+        own = MagicMock()
+        waiter = MagicMock()
+
+        complete = subject.sent(key, '4', own)
+        subject.inflight(key, waiter).should.equal('4')
+
+        subject._inflight[key] = ('4', subject._inflight[key][1] - 30)
+        subject.inflight(key, None).should.equal(None)
+        subject.stats()['inflight'].should.equal(0)
+        subject._waiters.should.equal({})
+
+        complete({'name': 'Ann'})
+        own.assert_called_once_with({'name': 'Ann'})
+        waiter.called.should.equal(False)
+
+    def test_cached_response_middleware(self):
+        """
+        MessageSenderMixin.send() with a response cache Test plan:
+            -ensure responses answered from the cache pass through response middleware
+        """
+        subject = Tutor(123, 456, None)
+        subject.enable_response_cache(get_student=60)
+        subject.response_cache.complete(subject.response_cache.key('get_student', {'student_id': '1'}), '4', {'name': 'Ann'})
+
+        seen = []
+        def record(next_handler):
+            def handler(response):
+                seen.append(response.message_id)
+                return next_handler(response)
+            return handler
+        subject.use_middleware('response', record)
+
+        callback = MagicMock()
+        subject.send('get_student', {'student_id': '1'}, callback).should.equal({'message_id': '4', 'cached': True})
+        callback.assert_called_once_with({'name': 'Ann'})
+        seen.should.equal(['4'])
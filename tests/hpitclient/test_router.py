@@ -0,0 +1,61 @@
+import sure
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.router import MessageRouter, NO_ROUTE
+from hpitclient.exceptions import BadCallbackException
+from unittest.mock import MagicMock
+
+def exact_callback(payload):
+    pass
+
+def low_callback(payload):
+    pass
+
+def high_callback(payload):
+    pass
+
+class TestMessageRouter(unittest.TestCase):
+
+    def test_resolve(self):
+        """
+        MessageRouter.resolve() Test plan:
+            -ensure exact callbacks win over patterns
+            -ensure higher priority patterns win over lower ones
+            -ensure a name subscribed without a callback falls back to patterns
+            -ensure changing routes invalidates cached resolutions
+            -ensure unmatched names resolve to NO_ROUTE
+        """
+        subject = MessageRouter()
+        subject.add_pattern('kt_*', low_callback)
+        subject.add_pattern('kt_tr*', high_callback, priority=5)
+        subject['kt_trace'] = exact_callback
+        subject['kt_reset'] = None
+
+        subject.resolve('kt_trace').should.equal(exact_callback)
+        subject.resolve('kt_train').should.equal(high_callback)
+        subject.resolve('kt_reset').should.equal(low_callback)
+        subject.resolve('other').should.be(NO_ROUTE)
+
+        del subject['kt_trace']
+        subject.resolve('kt_trace').should.equal(high_callback)
+
+        subject.remove_pattern('kt_tr*')
+        subject.resolve('kt_trace').should.equal(low_callback)
+
+        subject.add_pattern.when.called_with('x*', 4).should.throw(BadCallbackException)
+
+    def test_plugin_pattern_dispatch(self):
+        """
+        Plugin.subscribe_pattern() Test plan:
+            -ensure pattern callbacks receive matching messages
+            -ensure subscribe() rejects callbacks that aren't callable
+        """
+        plugin = Plugin(1234, 4567)
+        callback = MagicMock()
+        plugin.subscribe_pattern('log_*', callback)
+
+        plugin._dispatch([{"message_id": '1', "sender_entity_id": '2', "message_name": "log_event", "time_created": "now", "message": {}}])
+        callback.call_count.should.equal(1)
+
+        plugin.subscribe.when.called_with({'test_event': 4}).should.throw(BadCallbackException)
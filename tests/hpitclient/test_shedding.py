@@ -0,0 +1,59 @@
+import sure
+import unittest
+
+from hpitclient import Plugin
+from hpitclient.shedding import LoadShedder, parse_time
+from unittest.mock import MagicMock
+from datetime import datetime, timezone
+
+class TestLoadShedder(unittest.TestCase):
+
+    def test_parse_time(self):
+        """
+        parse_time() Test plan:
+            -ensure datetimes, epoch numbers, ISO and HTTP date strings are understood
+            -ensure garbage and non-finite numbers return None
+        """
+        expected = datetime(2014, 10, 16, 17, 0, tzinfo=timezone.utc).timestamp()
+
+        parse_time(datetime(2014, 10, 16, 17, 0)).should.equal(expected)
+        parse_time(expected).should.equal(expected)
+        parse_time(expected * 1000).should.equal(expected)
+        parse_time('2014-10-16T17:00:00').should.equal(expected)
+        parse_time('Thu, 16 Oct 2014 17:00:00 GMT').should.equal(expected)
+        parse_time('not a time').should.equal(None)
+        parse_time(None).should.equal(None)
+        parse_time('nan').should.equal(None)
+        parse_time('-inf').should.equal(None)
+        parse_time(float('inf')).should.equal(None)
+
+    def test_check(self):
+        """
+        LoadShedder.check() Test plan:
+            -ensure messages past max_age are shed and counted
+            -ensure fresh messages and names without a policy are not shed
+        """
+        subject = LoadShedder()
+        subject.set_policy('kt_trace', 5, {'error': 'expired'})
+
+        subject.check('kt_trace', 100, now=104).should.equal((False, None))
+        subject.check('kt_trace', 100, now=106).should.equal((True, {'error': 'expired'}))
+        subject.check('other', 100, now=1000).should.equal((False, None))
+        subject.check('kt_trace', 'nan', now=1000).should.equal((False, None))
+        subject.check('kt_trace', '-inf', now=1000).should.equal((False, None))
+        subject.stats().should.equal({'kt_trace': 1})
+
+    def test_plugin_sheds_stale_messages(self):
+        """
+        Plugin.set_max_age() Test plan:
+            -ensure stale messages skip their callback and get the expired response
+        """
+        plugin = Plugin(1234, 4567)
+        plugin.send_response = MagicMock()
+        plugin.callbacks["kt_trace"] = MagicMock()
+        plugin.set_max_age('kt_trace', 5, {'error': 'expired'})
+
+        plugin._dispatch([{"message_id": '1', "sender_entity_id": '2', "message_name": "kt_trace", "time_created": 0, "message": {}}])
+
+        plugin.callbacks["kt_trace"].call_count.should.equal(0)
+        plugin.send_response.assert_called_once_with('1', {'error': 'expired'})
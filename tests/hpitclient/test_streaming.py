@@ -0,0 +1,103 @@
+import json
+import sure
+import unittest
+import requests
+import httpretty
+
+from hpitclient import Plugin
+from hpitclient.exceptions import ConnectionError
+from hpitclient.streaming import JSONArrayStream, iter_json_array
+from unittest.mock import MagicMock
+
+class TestJSONArrayStream(unittest.TestCase):
+
+    def test_iter(self):
+        """
+        JSONArrayStream Test plan:
+            -ensure items are decoded whatever the chunk boundaries
+            -ensure other keys are skipped
+            -ensure the buffer stays near the size of a single item
+            -ensure truncated bodies raise
+        """
+        items = [{"message_id": str(i), "text": "é" * i} for i in range(100)] + [12345, 1.5e-7, True, None]
+        body = json.dumps({"other": {"x": [1, 2]}, "messages": items, "tail": 1.5}).encode('utf-8')
+
+        for size in (1, 7, 4096):
+            subject = JSONArrayStream([body[i:i + size] for i in range(0, len(body), size)], 'messages')
+            list(subject).should.equal(items)
+            subject.bytes_read.should.equal(len(body))
+
+        subject = JSONArrayStream([body[i:i + 16] for i in range(0, len(body), 16)], 'messages')
+        list(subject)
+        (subject.max_buffered <= max(len(json.dumps(item)) for item in items) + 32).should.equal(True)
+
+        list(iter_json_array([b'{"messages": []}'], 'messages')).should.equal([])
+        list(iter_json_array([b'{}'], 'messages')).should.equal([])
+        list.when.called_with(iter_json_array([b'{"messages": [{"a": 1},'], 'messages')).should.throw(ValueError)
+
+    @httpretty.activate
+    def test_plugin_poll(self):
+        """
+        Plugin streaming Test plan:
+            -ensure messages are read from one response a batch at a time
+            -ensure the backlog isn't filled past the high water mark
+            -ensure transactions are streamed
+        """
+        messages = [{"message_id": str(i), "sender_entity_id": "1", "message_name": "test_event",
+                     "time_created": "now", "message": {"i": i}} for i in range(5)]
+
+        httpretty.register_uri(httpretty.GET, "https://www.hpit-project.org/plugin/message/list",
+                                body=json.dumps({"messages": messages}))
+        httpretty.register_uri(httpretty.GET, "https://www.hpit-project.org/plugin/transaction/list",
+                                body=json.dumps({"transactions": messages}))
+
+        subject = Plugin(1234, 4567)
+        subject.enable_streaming(batch_size=2, chunk_size=16)
+
+        subject._poll().should.equal(messages[:2])
+        subject._poll().should.equal(messages[2:4])
+        subject._poll().should.equal(messages[4:])
+        subject._message_stream.should.equal(None)
+        len(httpretty.latest_requests()).should.equal(1)
+
+        subject.enable_flow_control(high_water=3)
+        subject.message_backlog.extend(messages[:2])
+        subject._poll().should.equal(messages[:1])
+        subject._close_message_stream()
+
+        list(subject._poll_transactions()).should.equal(messages)
+
+    def test_stream_cut_off(self):
+        """
+        RequestsMixin._get_stream() Test plan:
+            -ensure a body cut off part way is polled again instead of raising
+            -ensure the items read before the cut are kept
+            -ensure a body that keeps being cut off gives up once retries run out
+        """
+        def cut_off_response(*chunks):
+            def iter_content(chunk_size):
+                yield from chunks
+                raise requests.exceptions.ChunkedEncodingError('Connection broken: IncompleteRead')
+
+            response = MagicMock(status_code=200)
+            response.iter_content = iter_content
+            return response
+
+        whole = MagicMock(status_code=200)
+        whole.iter_content = lambda chunk_size: iter([b'{"messages": [{"message_id": "3"}]}'])
+
+        subject = Plugin(1234, 4567)
+        subject.send_log_entry = MagicMock()
+        subject.session.get = MagicMock(side_effect=[
+            cut_off_response(b'{"messages": [{"message_id": "1"}, {"mess'),
+            cut_off_response(b'{"messages": [{"message_id": "2"}'),
+            whole,
+        ])
+
+        list(subject._get_stream('plugin/message/list', 'messages')).should.equal([
+            {"message_id": "1"}, {"message_id": "2"}, {"message_id": "3"}])
+        subject.send_log_entry.call_count.should.equal(2)
+
+        subject.session.get = MagicMock(side_effect=lambda *args, **kwargs: cut_off_response(b'{"messages": ['))
+        list.when.called_with(subject._get_stream('plugin/message/list', 'messages', retry=False)).should.throw(ConnectionError)
+        subject.session.get.call_count.should.equal(3)